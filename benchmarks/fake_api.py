@@ -0,0 +1,118 @@
+import collections
+import datetime
+import itertools
+import json
+import uuid
+
+from aiohttp import web
+from fake_master import FakeMaster
+
+# Resources the operator reads and writes, by their URL prefix
+PREFIX = r"{prefix:api/v1|apis/batch/v1|apis/locust.io/v1|apis/coordination.k8s.io/v1}"
+
+
+def merge(target: dict, patch: dict) -> dict:
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class FakeApiServer:
+    """In-memory stand-in for the parts of the kubernetes API the operator
+    uses. Objects are stored as sent, patches are merged as JSON merge
+    patches and service proxy requests are answered by a fake master.
+    """
+
+    def __init__(self, master: FakeMaster | None = None):
+        self.master = master or FakeMaster()
+        self.objects: dict[tuple[str, str, str], dict] = {}
+        self.calls: collections.Counter[tuple[str, str]] = collections.Counter()
+        self._resource_versions = itertools.count(1)
+
+        self.app = web.Application()
+        base = f"/{PREFIX}/namespaces/{{namespace}}/{{plural}}"
+        self.app.router.add_get(
+            "/api/v1/namespaces/{namespace}/services/{name}/proxy/{path:.*}",
+            self.proxy,
+        )
+        self.app.router.add_get(base, self.list)
+        self.app.router.add_post(base, self.create)
+        self.app.router.add_get(f"{base}/{{name}}", self.read)
+        self.app.router.add_patch(f"{base}/{{name}}", self.patch)
+        self.app.router.add_patch(f"{base}/{{name}}/status", self.patch)
+        self.app.router.add_delete(f"{base}/{{name}}", self.delete)
+
+    def count(self, request: web.Request, verb: str):
+        self.calls[(verb, request.match_info.get("plural", "services/proxy"))] += 1
+
+    def add(self, namespace: str, plural: str, obj: dict) -> dict:
+        metadata = obj.setdefault("metadata", {})
+        metadata.setdefault("namespace", namespace)
+        metadata.setdefault("uid", str(uuid.uuid4()))
+        metadata.setdefault(
+            "creationTimestamp",
+            datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        )
+        metadata["resourceVersion"] = str(next(self._resource_versions))
+        self.objects[(namespace, plural, metadata["name"])] = obj
+        return obj
+
+    def _get(self, request: web.Request) -> dict:
+        info = request.match_info
+        obj = self.objects.get((info["namespace"], info["plural"], info["name"]))
+        if obj is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"kind": "Status", "code": 404, "reason": "NotFound"}),
+                content_type="application/json",
+            )
+        return obj
+
+    async def list(self, request: web.Request) -> web.Response:
+        self.count(request, "list")
+        info = request.match_info
+        items = [
+            obj
+            for (namespace, plural, _), obj in self.objects.items()
+            if namespace == info["namespace"] and plural == info["plural"]
+        ]
+        return web.json_response({"metadata": {}, "items": items})
+
+    async def create(self, request: web.Request) -> web.Response:
+        self.count(request, "create")
+        info = request.match_info
+        obj = await request.json()
+        if (info["namespace"], info["plural"], obj["metadata"]["name"]) in self.objects:
+            raise web.HTTPConflict(
+                text=json.dumps({"kind": "Status", "code": 409}),
+                content_type="application/json",
+            )
+        return web.json_response(
+            self.add(info["namespace"], info["plural"], obj), status=201
+        )
+
+    async def read(self, request: web.Request) -> web.Response:
+        self.count(request, "read")
+        return web.json_response(self._get(request))
+
+    async def patch(self, request: web.Request) -> web.Response:
+        self.count(request, "patch")
+        obj = self._get(request)
+        merge(obj, await request.json())
+        obj["metadata"]["resourceVersion"] = str(next(self._resource_versions))
+        return web.json_response(obj)
+
+    async def delete(self, request: web.Request) -> web.Response:
+        self.count(request, "delete")
+        info = request.match_info
+        self._get(request)
+        del self.objects[(info["namespace"], info["plural"], info["name"])]
+        return web.json_response({"kind": "Status", "code": 200})
+
+    async def proxy(self, request: web.Request) -> web.Response:
+        self.count(request, "proxy")
+        return web.json_response(self.master.payload())
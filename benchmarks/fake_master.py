@@ -0,0 +1,71 @@
+import random
+
+from aiohttp import web
+
+
+def stats_payload(endpoints: int = 10, users: int = 100, workers: int = 4) -> dict:
+    """Payload shaped like the stats/requests endpoint of a running master."""
+    stats = []
+    for i in range(endpoints):
+        num_requests = random.randint(1_000, 100_000)
+        stats.append(
+            {
+                "method": "GET",
+                "name": f"/endpoint/{i}",
+                "num_requests": num_requests,
+                "num_failures": num_requests // 100,
+                "avg_response_time": random.uniform(10, 500),
+                "current_rps": random.uniform(1, 100),
+                "current_fail_per_sec": random.uniform(0, 1),
+                "median_response_time": random.randint(10, 300),
+                "ninetieth_response_time": random.randint(300, 600),
+                "ninety_ninth_response_time": random.randint(600, 1200),
+                "response_time_percentile_0.5": random.randint(10, 300),
+                "response_time_percentile_0.95": random.randint(300, 900),
+            }
+        )
+    num_requests = sum(entry["num_requests"] for entry in stats)
+    stats.append(
+        {
+            "method": None,
+            "name": "Aggregated",
+            "num_requests": num_requests,
+            "num_failures": num_requests // 100,
+            "avg_response_time": 120.0,
+            "current_rps": sum(entry["current_rps"] for entry in stats),
+            "current_fail_per_sec": 0.5,
+            "median_response_time": 100,
+            "response_time_percentile_0.5": 100,
+            "response_time_percentile_0.95": 450,
+        }
+    )
+    return {
+        "state": "running",
+        "total_rps": stats[-1]["current_rps"],
+        "fail_ratio": 0.01,
+        "user_count": users,
+        "worker_count": workers,
+        "workers": [
+            {"id": f"worker-{i}", "state": "running", "user_count": users // workers}
+            for i in range(workers)
+        ],
+        "stats": stats,
+        "errors": [],
+    }
+
+
+class FakeMaster:
+    """Stand-in for the web UI of a locust master, serving stats/requests."""
+
+    def __init__(self, endpoints: int = 10):
+        self.endpoints = endpoints
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/stats/requests", self.stats)
+
+    def payload(self) -> dict:
+        self.requests += 1
+        return stats_payload(self.endpoints)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.payload())
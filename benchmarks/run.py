@@ -0,0 +1,207 @@
+"""Offline benchmark of the reconcile and stats poll paths of the operator.
+
+Runs the controller against an in-memory kubernetes API and a fake locust
+master, for a growing number of LocustTests, and saves the results as JSON:
+
+    python benchmarks/run.py --tests 1 100 1000 --output benchmarks/results
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path[:0] = [str(HERE), str(HERE.parent / "locust_operator")]
+
+import kopf  # noqa: E402
+from aiohttp import web  # noqa: E402
+from fake_api import FakeApiServer  # noqa: E402
+from fake_master import FakeMaster  # noqa: E402
+from kubernetes import client  # noqa: E402
+
+NAMESPACE = "bench"
+
+# Read by the operator modules when they are first imported, by bench
+ENVIRONMENT = {
+    # Slow reconciles post events, only possible within kopf handlers
+    "LOCUST_OPERATOR_SLOW_RECONCILE_SECONDS": "0",
+    # Measures the operator itself, not the limits it puts on the API calls
+    "LOCUST_OPERATOR_API_QPS": "0",
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(int(round(q * len(ordered))) - 1, 0)]
+
+
+def locust_test_body(api: FakeApiServer, name: str) -> dict:
+    return api.add(
+        NAMESPACE,
+        "locusttests",
+        {
+            "apiVersion": "locust.io/v1",
+            "kind": "LocustTest",
+            "metadata": {"name": name, "generation": 1},
+            "spec": {
+                "image": "locustio/locust",
+                "workers": 4,
+                "locustfile": {"content": "from locust import HttpUser\n"},
+            },
+            "status": {},
+        },
+    )
+
+
+async def bench_all(counts: list[int], endpoints: int, polls: int) -> list[dict]:
+    api = FakeApiServer(FakeMaster(endpoints))
+    runner = web.AppRunner(api.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    # Before the operator modules create their shared API clients
+    configuration = client.Configuration()
+    configuration.host = f"http://127.0.0.1:{port}"
+    client.Configuration.set_default(configuration)
+
+    try:
+        runs = []
+        for count in counts:
+            api.objects.clear()
+            runs.append(await bench(api, count, polls))
+            print(json.dumps(runs[-1]))
+        return runs
+    finally:
+        await runner.cleanup()
+
+
+async def bench(api: FakeApiServer, count: int, polls: int) -> dict:
+    from controller import LocustTest
+    from history import history
+    from objects import ensure_results
+    from stats import PollState
+
+    logger = logging.getLogger("bench")
+    bodies = [locust_test_body(api, f"test-{i}") for i in range(count)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+
+    tests = [
+        LocustTest(
+            body["metadata"]["name"],
+            NAMESPACE,
+            kopf.Body(body),
+            kopf.Patch(),
+            logger,
+        )
+        for body in bodies
+    ]
+
+    # Reconcile, every object is created
+    async def timed(coro) -> float:
+        t0 = time.perf_counter()
+        await coro
+        return time.perf_counter() - t0
+
+    api.calls.clear()
+    ensure_results.clear()
+    t0 = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(test.reconcile()) for test in tests))
+    create_seconds = time.perf_counter() - t0
+    create_calls = sum(api.calls.values())
+    create_results = dict(ensure_results)
+
+    # Reconciled again with nothing to change
+    api.calls.clear()
+    ensure_results.clear()
+    t0 = time.perf_counter()
+    noop_latencies = await asyncio.gather(*(timed(test.reconcile()) for test in tests))
+    noop_seconds = time.perf_counter() - t0
+    noop_calls = sum(api.calls.values())
+    noop_results = dict(ensure_results)
+
+    # Stats polls through the API server proxy
+    poll_states = [PollState() for _ in tests]
+    api.calls.clear()
+    poll_latencies = []
+    t0 = time.perf_counter()
+    for _ in range(polls):
+        poll_latencies += await asyncio.gather(
+            *(timed(test.poll_stats(poll)) for test, poll in zip(tests, poll_states))
+        )
+    poll_seconds = time.perf_counter() - t0
+    poll_calls = sum(api.calls.values())
+
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    memory = sum(stat.size_diff for stat in snapshot.compare_to(baseline, "filename"))
+    for test in tests:
+        history.forget(NAMESPACE, test.name)
+
+    return {
+        "tests": count,
+        "reconcile": {
+            "throughput_per_second": round(count / create_seconds, 1),
+            "latency_p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "api_calls_per_reconcile": round(create_calls / count, 2),
+            "ensure_results": create_results,
+        },
+        "noop_reconcile": {
+            "throughput_per_second": round(count / noop_seconds, 1),
+            "latency_p50_ms": round(statistics.median(noop_latencies) * 1000, 2),
+            "latency_p95_ms": round(percentile(noop_latencies, 0.95) * 1000, 2),
+            "api_calls_per_reconcile": round(noop_calls / count, 2),
+            "ensure_results": noop_results,
+        },
+        "stats_poll": {
+            "polls_per_second": round(count * polls / poll_seconds, 1),
+            "latency_p50_ms": round(statistics.median(poll_latencies) * 1000, 2),
+            "latency_p95_ms": round(percentile(poll_latencies, 0.95) * 1000, 2),
+            "api_calls_per_poll": round(poll_calls / (count * polls), 2),
+        },
+        "memory_per_test_kib": round(memory / count / 1024, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--endpoints", type=int, default=10)
+    parser.add_argument("--polls", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=HERE / "results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "endpoints": args.endpoints,
+        "polls": args.polls,
+        "runs": asyncio.run(bench_all(args.tests, args.endpoints, args.polls)),
+    }
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    path = args.output / f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    path.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Saved to {path}")
+    return results
+
+
+if __name__ == "__main__":
+    # Stats are fetched through the API server proxy, as out of cluster
+    os.environ.pop("KUBERNETES_SERVICE_HOST", None)
+    os.environ.update(ENVIRONMENT)
+    main()
@@ -79,10 +79,20 @@ RBAC rules for the operator
 # Applcation: Managed resources
 - apiGroups: [""]
   resources: ["services", "configmaps"]
-  verbs: ["get","create","update","patch","delete"]
+  verbs: ["get","list","watch","create","update","patch","delete"]
+- apiGroups: [""]
+  resources: ["pods"]
+  verbs: ["get","list","watch","create","patch","delete","deletecollection"]
+# Application: zones of the nodes running workers, only with cluster RBAC
+- apiGroups: [""]
+  resources: ["nodes"]
+  verbs: ["get"]
 - apiGroups: ["batch"]
   resources: ["jobs"]
-  verbs: ["get","list","create","update","patch","delete"]
+  verbs: ["get","list","watch","create","update","patch","delete"]
+- apiGroups: ["coordination.k8s.io"]
+  resources: ["leases"]
+  verbs: ["get","list","watch","create","patch","delete"]
 - apiGroups: [""]
   resources: ["events"]
   verbs: ["create", "patch", "update"]
@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+
+from constants import ADMISSION_CPU, ADMISSION_MEMORY, ADMISSION_SCOPE
+from kubernetes.utils import parse_quantity
+from metrics import ADMISSION_QUEUED, ADMISSION_UTILIZATION
+
+QUEUED = "QUEUED"
+
+# States of tests whose pods were never created
+NOT_ADMITTED_STATES = {None, "", QUEUED, "Invalid"}
+
+
+@dataclass(frozen=True)
+class Resources:
+    cpu: float = 0.0
+    memory: float = 0.0
+
+    def __add__(self, other: "Resources") -> "Resources":
+        return Resources(self.cpu + other.cpu, self.memory + other.memory)
+
+    def __mul__(self, count: int) -> "Resources":
+        return Resources(self.cpu * count, self.memory * count)
+
+    def within(self, budget: "Resources") -> bool:
+        """Fits in budget, whose zero values are unlimited."""
+        return (not budget.cpu or self.cpu <= budget.cpu) and (
+            not budget.memory or self.memory <= budget.memory
+        )
+
+
+def _quantity(value) -> float:
+    return float(parse_quantity(value)) if value not in (None, "") else 0.0
+
+
+def pod_requests(resources: dict) -> Resources:
+    """Requests of a container, which default to its limits."""
+    requests = resources.get("requests") or {}
+    limits = resources.get("limits") or {}
+    return Resources(
+        cpu=_quantity(requests.get("cpu", limits.get("cpu"))),
+        memory=_quantity(requests.get("memory", limits.get("memory"))),
+    )
+
+
+def locust_test_requests(spec: dict, workers: int) -> Resources:
+    """Resources requested by the master and workers pods of a test."""
+    master = pod_requests(spec.get("master", {}).get("resources", {}))
+    worker = pod_requests(spec.get("worker", {}).get("resources", {}))
+    return master + worker * workers
+
+
+def is_admitted(status: dict) -> bool:
+    return bool(status.get("admitted_at")) or (
+        status.get("state") not in NOT_ADMITTED_STATES
+    )
+
+
+def is_finished(status: dict) -> bool:
+    """The master of the admitted run exited, its pods are gone."""
+    return bool(status.get("run_finished_at"))
+
+
+@dataclass
+class Waiting:
+    priority: int
+    created: str
+    request: Resources
+
+
+class AdmissionLedger:
+    """Resources requested by the admitted tests and the tests waiting for
+    theirs, kept in memory from the watch events of every LocustTest.
+
+    Waiting tests are admitted in order of priority, then of creation, the
+    first one has to fit before any other is considered.
+    """
+
+    def __init__(
+        self,
+        cpu: str = ADMISSION_CPU,
+        memory: str = ADMISSION_MEMORY,
+        scope: str = ADMISSION_SCOPE,
+    ):
+        self.budget = Resources(_quantity(cpu), _quantity(memory))
+        self.per_namespace = scope == "namespace"
+        self.admitted: dict[tuple[str, str], Resources] = {}
+        self.waiting: dict[tuple[str, str], Waiting] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.budget.cpu or self.budget.memory)
+
+    def fits_budget(self, request: Resources) -> bool:
+        return request.within(self.budget)
+
+    def observe(
+        self,
+        namespace: str,
+        name: str,
+        status: dict,
+        request: Resources,
+        priority: int,
+        created: str,
+    ):
+        key = (namespace, name)
+        if is_finished(status):
+            # Admitted again if it is restarted
+            self.admitted.pop(key, None)
+            self.waiting.pop(key, None)
+        elif is_admitted(status) or key in self.admitted:
+            # Admitted here ahead of the status, never queued again
+            self.waiting.pop(key, None)
+            self.admitted[key] = request
+        elif status.get("state") == QUEUED:
+            self.waiting[key] = Waiting(priority, created, request)
+        self._update_metrics(self._scope(namespace))
+
+    def forget(self, namespace: str, name: str):
+        self.admitted.pop((namespace, name), None)
+        self.waiting.pop((namespace, name), None)
+        self._update_metrics(self._scope(namespace))
+
+    def try_admit(
+        self,
+        namespace: str,
+        name: str,
+        request: Resources,
+        priority: int,
+        created: str,
+    ) -> int:
+        """Admit the test if it is next and fits, returns 0 when admitted or
+        its position in the queue.
+        """
+        key = (namespace, name)
+        if key in self.admitted:
+            self.admitted[key] = request
+            return 0
+
+        self.waiting[key] = Waiting(priority, created, request)
+        scope = self._scope(namespace)
+        queue = sorted(
+            (-waiting.priority, waiting.created, other)
+            for other, waiting in self.waiting.items()
+            if self._scope(other[0]) == scope
+        )
+        position = next(i for i, (*_, other) in enumerate(queue, 1) if other == key)
+        if position == 1 and (self.used(scope) + request).within(self.budget):
+            del self.waiting[key]
+            self.admitted[key] = request
+            position = 0
+
+        self._update_metrics(scope)
+        return position
+
+    def used(self, scope: str) -> Resources:
+        used = Resources()
+        for (namespace, _), request in self.admitted.items():
+            if self._scope(namespace) == scope:
+                used += request
+        return used
+
+    def _scope(self, namespace: str) -> str:
+        return namespace if self.per_namespace else "cluster"
+
+    def _update_metrics(self, scope: str):
+        if not self.enabled:
+            return
+        ADMISSION_QUEUED.labels(scope).set(
+            sum(self._scope(key[0]) == scope for key in self.waiting)
+        )
+        used = self.used(scope)
+        for resource in ("cpu", "memory"):
+            budget = getattr(self.budget, resource)
+            if budget:
+                ADMISSION_UTILIZATION.labels(scope, resource).set(
+                    getattr(used, resource) / budget
+                )
+
+
+admission = AdmissionLedger()
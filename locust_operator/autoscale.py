@@ -0,0 +1,69 @@
+import math
+from dataclasses import dataclass
+
+
+@dataclass
+class Autoscale:
+    min_workers: int
+    max_workers: int
+    target_users_per_worker: int | None
+    target_cpu_percent: float | None
+    cooldown_seconds: float
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> "Autoscale | None":
+        autoscale = spec.get("autoscale")
+        if not autoscale:
+            return None
+
+        min_workers = autoscale.get("minWorkers", 1)
+        return cls(
+            min_workers=min_workers,
+            max_workers=max(autoscale.get("maxWorkers", min_workers), min_workers),
+            target_users_per_worker=autoscale.get("targetUsersPerWorker"),
+            target_cpu_percent=autoscale.get("targetCpuPercent"),
+            cooldown_seconds=autoscale.get("cooldownSeconds", 60),
+        )
+
+    def clamp(self, workers: int) -> int:
+        return min(max(workers, self.min_workers), self.max_workers)
+
+
+def plan_workers(
+    autoscale: Autoscale,
+    current: int,
+    user_count: int,
+    cpu_usages: list[float],
+    processes: int = 1,
+) -> tuple[int, str]:
+    """Worker pod count the test should run with, and why.
+
+    Each configured target proposes a count, the largest one wins so that
+    neither users per worker nor CPU usage go over their target. Users are
+    per locust worker process, each pod runs processes of them.
+    """
+    proposals = []
+    if autoscale.target_users_per_worker:
+        target = autoscale.target_users_per_worker
+        workers = math.ceil(user_count / (target * processes))
+        reason = f"{user_count} users at {target} per worker"
+        if processes > 1:
+            reason += f", {processes} workers per pod"
+        proposals.append((workers, reason))
+
+    if autoscale.target_cpu_percent and cpu_usages:
+        cpu = sum(cpu_usages) / len(cpu_usages)
+        workers = math.ceil(current * cpu / autoscale.target_cpu_percent)
+        proposals.append(
+            (
+                workers,
+                f"average worker cpu {cpu:.0f}% with a target of "
+                f"{autoscale.target_cpu_percent:.0f}%",
+            )
+        )
+
+    if not proposals:
+        return autoscale.clamp(current), "no autoscale target configured"
+
+    workers, reason = max(proposals, key=lambda proposal: proposal[0])
+    return autoscale.clamp(workers), reason
@@ -0,0 +1,236 @@
+import logging
+import threading
+from collections import defaultdict
+
+from constants import LABEL_ANNOTATION_PREFIX, WATCH_NAMESPACE
+from kubernetes import client, watch
+
+MANAGED_BY_SELECTOR = "app.kubernetes.io/managed-by=locust-operator"
+TEST_RUN_LABEL = f"{LABEL_ANNOTATION_PREFIX}/test-run"
+
+# Watches are restarted from the last seen resourceVersion after this long,
+# a full relist only happens when the API server reports it as expired (410).
+WATCH_TIMEOUT_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+
+class Informer:
+    """In-memory copy of one kind of operator owned objects, kept up to date
+    by a list followed by a watch resumed from the last seen resourceVersion.
+    """
+
+    def __init__(self, kind: str, list_fn, *list_args):
+        self.kind = kind
+        self._list_fn = list_fn
+        self._list_args = list_args
+
+        self._lock = threading.Lock()
+        self._objects: dict[tuple[str, str], object] = {}
+        self._by_test_run: dict[tuple[str, str], set[str]] = defaultdict(set)
+
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch: watch.Watch | None = None
+
+        self.resource_version: str | None = None
+        self.hits = 0
+        self.misses = 0
+        self.resyncs = 0
+
+    @property
+    def synced(self) -> bool:
+        return self._synced.is_set()
+
+    def get(self, namespace: str, name: str):
+        """Cached object, None if not cached or the cache can't answer yet."""
+        with self._lock:
+            # Possibly deleted since, the miss is read from the API server
+            obj = self._objects.get((namespace, name)) if self.synced else None
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return obj
+
+    def list(self, namespace: str, test_run: str) -> list | None:
+        """Objects of a test run, None if the cache can't answer yet."""
+        if not self.synced:
+            return None
+
+        with self._lock:
+            self.hits += 1
+            names = self._by_test_run.get((namespace, test_run), ())
+            return [self._objects[(namespace, name)] for name in names]
+
+    def forget(self, namespace: str, name: str):
+        with self._lock:
+            obj = self._objects.get((namespace, name))
+            if obj is not None:
+                self._forget(obj)
+
+    def stats(self) -> dict[str, int | bool]:
+        return {
+            "synced": self.synced,
+            "objects": len(self._objects),
+            "hits": self.hits,
+            "misses": self.misses,
+            "resyncs": self.resyncs,
+        }
+
+    def run(self):
+        backoff = 1.0
+        while not self._stopped.is_set():
+            try:
+                if not self.synced:
+                    self._resync()
+                self._watch_changes()
+                backoff = 1.0
+            except client.ApiException as e:
+                if e.status == 410:
+                    logger.info(f"{self.kind} watch expired, relisting")
+                    self._synced.clear()
+                    continue
+                if e.status == 403:
+                    logger.warning(
+                        f"Not allowed to watch {self.kind}, caching disabled"
+                    )
+                    return
+                logger.warning(f"{self.kind} watch failed: {e}")
+                self._synced.clear()
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2.0, 30.0)
+            except Exception as e:
+                logger.warning(f"{self.kind} watch failed: {e}")
+                self._synced.clear()
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2.0, 30.0)
+
+    def stop(self):
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def _resync(self):
+        result = self._list_fn(*self._list_args, label_selector=MANAGED_BY_SELECTOR)
+
+        with self._lock:
+            self._objects.clear()
+            self._by_test_run.clear()
+            for obj in result.items:
+                self._store(obj)
+
+        self.resource_version = result.metadata.resource_version
+        self.resyncs += 1
+        self._synced.set()
+        logger.debug(f"Listed {len(result.items)} {self.kind}")
+
+    def _watch_changes(self):
+        self._watch = watch.Watch()
+
+        # With timeout_seconds the client doesn't retry on 410 by itself,
+        # it raises so we can relist.
+        for event in self._watch.stream(
+            self._list_fn,
+            *self._list_args,
+            label_selector=MANAGED_BY_SELECTOR,
+            resource_version=self.resource_version,
+            timeout_seconds=WATCH_TIMEOUT_SECONDS,
+            allow_watch_bookmarks=True,
+        ):
+            if event["type"] == "BOOKMARK":
+                metadata = event["raw_object"]["metadata"]
+                self.resource_version = metadata["resourceVersion"]
+                continue
+
+            obj = event["object"]
+            with self._lock:
+                if event["type"] == "DELETED":
+                    self._forget(obj)
+                else:
+                    self._store(obj)
+            self.resource_version = obj.metadata.resource_version
+
+    def _store(self, obj):
+        meta = obj.metadata
+        self._objects[(meta.namespace, meta.name)] = obj
+        test_run = (meta.labels or {}).get(TEST_RUN_LABEL)
+        if test_run:
+            self._by_test_run[(meta.namespace, test_run)].add(meta.name)
+
+    def _forget(self, obj):
+        meta = obj.metadata
+        self._objects.pop((meta.namespace, meta.name), None)
+        test_run = (meta.labels or {}).get(TEST_RUN_LABEL)
+        names = self._by_test_run.get((meta.namespace, test_run))
+        if names is not None:
+            names.discard(meta.name)
+            if not names:
+                del self._by_test_run[(meta.namespace, test_run)]
+
+
+class ObjectCache:
+    """Shared informers for the jobs, services and configmaps the operator
+    creates. Lookups that miss must fall back to the API server, a miss
+    doesn't mean the object does not exist.
+    """
+
+    def __init__(self):
+        self._informers: dict[str, Informer] = {}
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        core = client.CoreV1Api()
+        batch = client.BatchV1Api()
+        if WATCH_NAMESPACE:
+            self._informers = {
+                "jobs": Informer("jobs", batch.list_namespaced_job, WATCH_NAMESPACE),
+                "services": Informer(
+                    "services", core.list_namespaced_service, WATCH_NAMESPACE
+                ),
+                "configmaps": Informer(
+                    "configmaps", core.list_namespaced_config_map, WATCH_NAMESPACE
+                ),
+            }
+        else:
+            self._informers = {
+                "jobs": Informer("jobs", batch.list_job_for_all_namespaces),
+                "services": Informer("services", core.list_service_for_all_namespaces),
+                "configmaps": Informer(
+                    "configmaps", core.list_config_map_for_all_namespaces
+                ),
+            }
+        for informer in self._informers.values():
+            thread = threading.Thread(
+                target=informer.run, name=f"informer-{informer.kind}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for informer in self._informers.values():
+            informer.stop()
+
+    def get(self, kind: str, namespace: str, name: str):
+        informer = self._informers.get(kind)
+        if informer is None:
+            return None
+        return informer.get(namespace, name)
+
+    def list(self, kind: str, namespace: str, test_run: str) -> list | None:
+        informer = self._informers.get(kind)
+        if informer is None:
+            return None
+        return informer.list(namespace, test_run)
+
+    def forget(self, kind: str, namespace: str, name: str):
+        """Drop an object we know is going away until the watch catches up."""
+        informer = self._informers.get(kind)
+        if informer is not None:
+            informer.forget(namespace, name)
+
+    def stats(self) -> dict[str, dict[str, int | bool]]:
+        return {kind: informer.stats() for kind, informer in self._informers.items()}
+
+
+owned_objects = ObjectCache()
@@ -8,6 +8,74 @@ KIND = "LocustTest"
 PLURAL = "locusttests"
 LOCUST_TEST_RESOURCE = f"{PLURAL}.{VERSION}.{GROUP}"
 
+POOL_KIND = "LocustWorkerPool"
+POOL_PLURAL = "locustworkerpools"
+LOCUST_WORKER_POOL_RESOURCE = f"{POOL_PLURAL}.{VERSION}.{GROUP}"
+
 LABEL_ANNOTATION_PREFIX = f"{GROUP}"
 
 IN_CLUSTER = os.getenv("KUBERNETES_SERVICE_HOST")
+
+# Set when the operator only watches its own namespace (namespaced RBAC)
+WATCH_NAMESPACE = os.getenv("LOCUST_OPERATOR_NAMESPACE")
+
+# Upper bound of concurrent blocking kubernetes API calls
+API_MAX_WORKERS = int(os.getenv("LOCUST_OPERATOR_API_MAX_WORKERS", "32"))
+
+# Ensure owned objects with a single server-side apply request instead of
+# read followed by patch or create
+SERVER_SIDE_APPLY = os.getenv("LOCUST_OPERATOR_SERVER_SIDE_APPLY", "").lower() in (
+    "1",
+    "true",
+)
+FIELD_MANAGER = "locust-operator"
+
+# Client side limit of the kubernetes API calls, shared by every test, and
+# retries of the calls throttled by the API server (429)
+API_QPS = float(os.getenv("LOCUST_OPERATOR_API_QPS", "50"))
+API_BURST = int(os.getenv("LOCUST_OPERATOR_API_BURST", "100"))
+API_MAX_RETRIES = int(os.getenv("LOCUST_OPERATOR_API_MAX_RETRIES", "5"))
+
+# Reconciles running at once, the others wait in priority order
+MAX_CONCURRENT_RECONCILES = int(
+    os.getenv("LOCUST_OPERATOR_MAX_CONCURRENT_RECONCILES", "10")
+)
+
+# Stats polling of the locust masters
+STATS_CONNECT_TIMEOUT = float(os.getenv("LOCUST_OPERATOR_STATS_CONNECT_TIMEOUT", "2"))
+STATS_READ_TIMEOUT = float(os.getenv("LOCUST_OPERATOR_STATS_READ_TIMEOUT", "5"))
+STATS_MAX_IN_FLIGHT = int(os.getenv("LOCUST_OPERATOR_STATS_MAX_IN_FLIGHT", "50"))
+STATS_IDLE_INTERVAL = float(os.getenv("LOCUST_OPERATOR_STATS_IDLE_INTERVAL", "30"))
+# Finished master jobs are kept this long, so the polls see that the master
+# exited and capture the results of its run
+FINISHED_MASTER_TTL = int(os.getenv("LOCUST_OPERATOR_FINISHED_MASTER_TTL", "300"))
+
+# Port of the operator's own HTTP endpoints (prometheus metrics)
+SERVER_PORT = int(os.getenv("LOCUST_OPERATOR_SERVER_PORT", "8000"))
+
+# Split the LocustTests between operator replicas, each one renewing a lease
+# named after its pod in the operator namespace
+SHARDING = os.getenv("LOCUST_OPERATOR_SHARDING", "").lower() in ("1", "true")
+POD_NAME = os.getenv("LOCUST_OPERATOR_POD_NAME", "locust-operator")
+POD_NAMESPACE = os.getenv("LOCUST_OPERATOR_POD_NAMESPACE", "default")
+SHARD_LEASE_DURATION = int(os.getenv("LOCUST_OPERATOR_SHARD_LEASE_DURATION", "15"))
+
+# Reconcile traces, written as JSON lines to stdout and/or exported over OTLP
+# when OTEL_EXPORTER_OTLP_ENDPOINT is set (needs opentelemetry-sdk)
+TRACE_LOG = os.getenv("LOCUST_OPERATOR_TRACE_LOG", "").lower() in ("1", "true")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+# Reconciles slower than this post a warning event with their breakdown, 0
+# disables it
+SLOW_RECONCILE_SECONDS = float(
+    os.getenv("LOCUST_OPERATOR_SLOW_RECONCILE_SECONDS", "10")
+)
+
+# Resources the admitted LocustTests may request in total, new tests wait in
+# the QUEUED state until they fit. Unset disables the queue, the budget is
+# shared by the whole cluster or applies to each namespace.
+ADMISSION_CPU = os.getenv("LOCUST_OPERATOR_ADMISSION_CPU", "")
+ADMISSION_MEMORY = os.getenv("LOCUST_OPERATOR_ADMISSION_MEMORY", "")
+ADMISSION_SCOPE = os.getenv("LOCUST_OPERATOR_ADMISSION_SCOPE", "cluster")
+ADMISSION_RETRY_SECONDS = float(
+    os.getenv("LOCUST_OPERATOR_ADMISSION_RETRY_SECONDS", "10")
+)
@@ -1,34 +1,86 @@
-import ast
-import random
+import asyncio
+import base64
+import binascii
+import collections
+import datetime
+import gzip
+import json
 import time
+from functools import partial
 
 import kopf
-import requests
-from constants import GROUP, IN_CLUSTER, LABEL_ANNOTATION_PREFIX, PLURAL, VERSION
+from admission import (
+    QUEUED,
+    Resources,
+    admission,
+    is_admitted,
+    is_finished,
+    locust_test_requests,
+    pod_requests,
+)
+from autoscale import Autoscale, plan_workers
+from cache import owned_objects
+from constants import (
+    ADMISSION_RETRY_SECONDS,
+    GROUP,
+    IN_CLUSTER,
+    LABEL_ANNOTATION_PREFIX,
+    PLURAL,
+    SLOW_RECONCILE_SECONDS,
+    VERSION,
+)
+from history import history
 from kubernetes import client
+from loadprofile import LoadProfile, Stage, check_abort
+from metrics import (
+    ADMISSION_WAIT,
+    STATS_POLL_DURATION,
+    TIME_TO_FIRST_REQUEST,
+    observe_stats,
+    timed_step,
+)
 from objects import (
+    CONFIGMAP_MAX_SIZE,
     MASTER_P1_PORT_NAME,
     MASTER_P2_PORT_NAME,
     MASTER_WEB_PORT_NAME,
+    EnsureResult,
+    api_client,
+    apply_client,
+    build_bundle_configmap,
     build_configmap,
     build_master_job,
+    build_results_configmap,
+    build_scheduling,
     build_service,
     build_worker_job,
+    bundle_configmap_name,
+    call,
+    default_spread,
     ensure,
+    ensure_shared,
     exists,
+    get_node_zone,
+    job_mutable_fields,
     to_label_selector_string,
 )
+from planner import RestartPlan, plan_restart
+from pool import CLAIMED, POOL_STATE_LABEL, claim_workers
+from stats import PollState, stats_client, worker_pods_status
+from tracing import Span, trace
 
-FORCE_RESTART_FIELDS = {
-    ("spec", "image"),
-    ("spec", "args"),
-    ("spec", "env"),
-    ("spec", "master"),
-    ("spec", "worker"),
-    ("spec", "locustfile"),
+# Exports of the master's web UI kept with the results of a run
+RESULT_EXPORTS = {
+    "requests.csv": "stats/requests/csv",
+    "failures.csv": "stats/failures/csv",
+    "exceptions.csv": "exceptions/csv",
 }
 
 
+def now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
 class LocustTest:
     def __init__(
         self,
@@ -46,8 +98,19 @@ class LocustTest:
         self._logger = logger
         self._body = body
 
-        self._core = client.CoreV1Api()
-        self._batch = client.BatchV1Api()
+        self._core = client.CoreV1Api(api_client())
+        self._batch = client.BatchV1Api(api_client())
+        self._custom = client.CustomObjectsApi(api_client())
+        self._apply_core = client.CoreV1Api(apply_client())
+        self._apply_batch = client.BatchV1Api(apply_client())
+
+        self._ensure_results: collections.Counter[str] = collections.Counter()
+
+        # Generation at which the master and workers were last replaced
+        self._master_revision = body.status.get("master_revision")
+        self._worker_revision = body.status.get("worker_revision")
+        # Workers claimed from spec.workerPool, on top of the worker job
+        self._pool_workers = body.status.get("pool_workers", 0)
 
     def base_labels(self) -> dict[str, str]:
         return {
@@ -72,65 +135,219 @@ class LocustTest:
             f"{LABEL_ANNOTATION_PREFIX}/component": component,
         }
 
-    def reconcile(self, diff: kopf.Diff | None = None):
-        restart = False
-        if diff:
-            restart_fields = [
-                path
-                for _, path, _, _ in diff
-                if path
-                and path[0] == "spec"
-                and tuple(path[:2]) in FORCE_RESTART_FIELDS
-            ]
-            self._logger.info(f"Will restart test: {restart_fields} updated!")
-            restart = any(restart_fields)
+    async def reconcile(self, diff: kopf.Diff | None = None, retry: int = 0):
+        root = None
+        try:
+            with trace(
+                "reconcile", namespace=self.namespace, name=self.name, retry=retry
+            ) as root:
+                await self._reconcile(diff)
+        finally:
+            if root is not None:
+                self.report_if_slow(root)
+
+    def report_if_slow(self, root: Span):
+        if not SLOW_RECONCILE_SECONDS or root.duration < SLOW_RECONCILE_SECONDS:
+            return
+
+        message = f"Reconcile took {root.duration:.1f}s: {root.breakdown()}"
+        self._logger.warning(message)
+        kopf.event(self._body, type="Warning", reason="SlowReconcile", message=message)
+
+    async def _reconcile(self, diff: kopf.Diff | None):
+        plan = plan_restart(diff)
+        if self.run_finished(plan):
+            self._logger.debug(
+                f"Run of {self.namespace}/{self.name} finished, nothing to reconcile"
+            )
+            return
+
+        self.admit(plan)
+
+        if plan.restart:
+            self._logger.info(
+                f"Will restart {plan.describe()}: {list(plan.fields)} updated!"
+            )
 
-        cm_name = self.ensure_configmap()
-        master_svc = self.ensure_master_service()
+        # Replaced jobs are named after the generation, so the new job doesn't
+        # clash with the old one still being deleted and a retried reconcile
+        # ensures the same job.
+        generation = self._body.metadata.get("generation")
+        if plan.master:
+            self._master_revision = generation
+            self._patch.status["master_revision"] = generation
+            self._patch.status["restarted_at"] = now_iso()
+            self._patch.status["restart_seconds"] = None
+            self._patch.status["master_ready_seconds"] = None
+            self._patch.status["workers_connected_seconds"] = None
+            self._patch.status["worker_distribution"] = None
+            self._patch.status["load_profile"] = None
+            self._patch.status["run_finished_at"] = None
+        if plan.workers:
+            self._worker_revision = generation
+            self._patch.status["worker_revision"] = generation
+            self._patch.status["worker_distribution"] = None
 
-        # TODO: the user should be able to choose if he wants the webui or not
-        self.ensure_webui_service()
+        # The configmap and the services don't depend on each other, the jobs
+        # depend on all of them so they are only ensured afterwards.
+        cm_name, master_svc, _ = await asyncio.gather(
+            self.ensure_configmap(),
+            self.ensure_master_service(),
+            # TODO: the user should be able to choose if he wants the webui or not
+            self.ensure_webui_service(),
+        )
 
-        if restart:
-            self.delete_jobs()
+        if self.spec.get("workerPool") and (diff is None or plan.workers):
+            await self.claim_pool_workers(master_svc, replace=plan.workers)
+
+        if plan.master:
+            # Taken out of the master service right away, the new master job
+            # doesn't wait for it to be gone.
+            await self.delete_jobs(component="master", keep=self.get_master_job_name())
 
         try:
-            self.ensure_master(cm_name)
-            self.ensure_worker(cm_name, master_svc)
+            await asyncio.gather(
+                self.ensure_master(cm_name),
+                self.ensure_worker(cm_name, master_svc),
+            )
         except kopf.TemporaryError:
             self._patch.status["state"] = "RECONCILING"
             raise
 
-        if restart:
+        if plan.workers and plan.master:
+            # They would connect to the new master with the old spec
+            await self.delete_jobs(component="worker", keep=self.get_worker_job_name())
+            self._patch.status["rolling_workers"] = None
+        elif plan.workers:
+            # Rolling over from the old workers while the master keeps
+            # running, they are deleted once the new ones are connected.
+            self._patch.status["rolling_workers"] = True
+
+        if plan.configmap:
+            await self.release_bundles(keep=cm_name if self.is_bundle() else None)
+
+        if plan.restart:
             kopf.event(
                 self._body,
                 type="Normal",
                 reason="Restarted",
-                message="Locust run restarted due to spec change",
+                message=f"Locust {plan.describe()} restarted due to spec change",
             )
 
         self._patch.status["state"] = "CREATED"
 
-    def ensure_configmap(self) -> str | None:
+        self._logger.info(
+            f"Reconciled {self.namespace}/{self.name}: "
+            f"{self._ensure_results['created']} created, "
+            f"{self._ensure_results['patched']} patched, "
+            f"{self._ensure_results['applied']} applied, "
+            f"{self._ensure_results['unchanged']} unchanged (writes avoided)"
+        )
+
+    def run_finished(self, plan: RestartPlan) -> bool:
+        """The master exited and the jobs were deleted with it, only a restart
+        of the master runs the test again. Workers alone would wait for a
+        master that is gone.
+        """
+        return is_finished(self._body.status) and not plan.master
+
+    def get_resource_requests(self) -> Resources:
+        return locust_test_requests(self.spec, self.get_worker_count())
+
+    def observe_admission(self):
+        admission.observe(
+            self.namespace,
+            self.name,
+            self._body.status,
+            self.get_resource_requests(),
+            self.spec.get("queuePriority", 0),
+            self._body.metadata.get("creationTimestamp", ""),
+        )
+
+    def admit(self, plan: RestartPlan = RestartPlan()):
+        """Keep the test QUEUED, without any of its objects, until it fits in
+        the admission budget. Retried by kopf until then.
+
+        A finished run released its resources, a plan restarting its master
+        queues it again.
+        """
+        status = self._body.status
+        if self.run_finished(plan):
+            return
+        rerun = is_finished(status)
+        if not admission.enabled or (is_admitted(status) and not rerun):
+            return
+
+        request = self.get_resource_requests()
+        if not admission.fits_budget(request):
+            raise self.invalid(
+                f"Requests {request.cpu:g} cpu and {request.memory:.0f} bytes of "
+                f"memory, more than the whole admission budget"
+            )
+
+        position = admission.try_admit(
+            self.namespace,
+            self.name,
+            request,
+            self.spec.get("queuePriority", 0),
+            self._body.metadata.get("creationTimestamp", ""),
+        )
+        queued_at = (not rerun and status.get("queued_at")) or now_iso()
+        if position:
+            self._patch.status["state"] = QUEUED
+            self._patch.status["admitted_at"] = None
+            self._patch.status["run_finished_at"] = None
+            self._patch.status["queued_at"] = queued_at
+            self._patch.status["queue_position"] = position
+            raise kopf.TemporaryError(
+                f"Queued at position {position}", delay=ADMISSION_RETRY_SECONDS
+            )
+
+        waited = datetime.datetime.now(datetime.timezone.utc) - (
+            datetime.datetime.fromisoformat(queued_at)
+        )
+        ADMISSION_WAIT.observe(waited.total_seconds())
+        self._patch.status["admitted_at"] = now_iso()
+        self._patch.status["queue_position"] = None
+        self._patch.status["queue_wait_seconds"] = round(waited.total_seconds(), 1)
+        self._logger.info(
+            f"Admitted {self.namespace}/{self.name} after "
+            f"{waited.total_seconds():.0f}s in the queue"
+        )
+
+    async def _ensure(
+        self, create, read, patch, desired, lookup=None, apply=None, mutable=None
+    ) -> EnsureResult:
+        result = await ensure(create, read, patch, desired, lookup, apply, mutable)
+        self._ensure_results[result] += 1
+        return result
+
+    @timed_step
+    async def ensure_configmap(self) -> str | None:
         self._logger.debug("Ensuring up configmap")
         locustfile = self.spec.get("locustfile")
         if not locustfile:
             return None
 
+        if self.is_bundle():
+            return await self.ensure_bundle(locustfile["bundle"])
+
         is_inline = "content" in locustfile
 
         if not is_inline:
             existing_cm_name = locustfile.get("configMap", {}).get("name")
             self._logger.debug(f"Already created configmap {existing_cm_name}")
-            if not exists(
-                lambda: self._core.read_namespaced_config_map(
-                    existing_cm_name, self.namespace
-                )
+            if not await exists(
+                partial(
+                    self._core.read_namespaced_config_map,
+                    existing_cm_name,
+                    self.namespace,
+                ),
+                partial(
+                    owned_objects.get, "configmaps", self.namespace, existing_cm_name
+                ),
             ):
-                error_msg = f"Confimap '{existing_cm_name}' does not exist"
-                self._patch.status["state"] = "Invalid"
-                self._patch.status["message"] = error_msg
-                raise kopf.PermanentError(error_msg)
+                raise self.invalid(f"Confimap '{existing_cm_name}' does not exist")
 
             self._logger.info(f"Found configmap {existing_cm_name}")
             return existing_cm_name
@@ -146,21 +363,125 @@ class LocustTest:
             annotations=self.get_annotations(),
         )
 
-        kopf.adopt(cm)
+        kopf.adopt(cm, owner=self._body)
 
-        ensure(
-            lambda cm=cm: self._core.create_namespaced_config_map(self.namespace, cm),
-            lambda: self._core.read_namespaced_config_map(cm_name, self.namespace),
-            lambda cm=cm: self._core.patch_namespaced_config_map(
-                cm_name, self.namespace, cm
-            ),
+        await self._ensure(
+            partial(self._core.create_namespaced_config_map, self.namespace),
+            partial(self._core.read_namespaced_config_map, cm_name, self.namespace),
+            partial(self._core.patch_namespaced_config_map, cm_name, self.namespace),
             cm,
+            partial(owned_objects.get, "configmaps", self.namespace, cm_name),
+            partial(
+                self._apply_core.patch_namespaced_config_map, cm_name, self.namespace
+            ),
         )
 
         self._logger.info(f"Created configmap {cm_name}")
         return cm_name
 
-    def ensure_master_service(self) -> str:
+    def is_bundle(self) -> bool:
+        return "bundle" in self.spec.get("locustfile", {})
+
+    def invalid(self, message: str) -> kopf.PermanentError:
+        self._patch.status["state"] = "Invalid"
+        self._patch.status["message"] = message
+        return kopf.PermanentError(message)
+
+    async def ensure_bundle(self, encoded: str) -> str:
+        """Ensure the ConfigMap holding a compressed locustfile bundle.
+
+        The ConfigMap is named after the bundle content and shared by every
+        test of the namespace running the same bundle, each one of them
+        owning it so it's garbage collected along with the last one.
+        """
+        try:
+            content = base64.b64decode(encoded)
+        except binascii.Error as e:
+            raise self.invalid(f"Locustfile bundle is not valid base64: {e}")
+        if not content.startswith(b"\x1f\x8b"):
+            raise self.invalid("Locustfile bundle is not a gzip compressed tarball")
+        if len(content) > CONFIGMAP_MAX_SIZE:
+            raise self.invalid(
+                f"Locustfile bundle is {len(content)} bytes, "
+                f"larger than the {CONFIGMAP_MAX_SIZE} bytes a ConfigMap can hold"
+            )
+
+        cm_name = bundle_configmap_name(content)
+        cm = build_bundle_configmap(
+            name=cm_name,
+            content=content,
+            # Not labelled with a single test run, it's shared between them
+            labels={
+                "app.kubernetes.io/name": "locust",
+                "app.kubernetes.io/managed-by": "locust-operator",
+                f"{LABEL_ANNOTATION_PREFIX}/component": "bundle",
+            },
+            annotations={},
+        )
+        kopf.append_owner_reference(
+            cm, owner=self._body, controller=False, block_owner_deletion=False
+        )
+
+        result = await ensure_shared(
+            partial(self._core.create_namespaced_config_map, self.namespace),
+            partial(self._core.read_namespaced_config_map, cm_name, self.namespace),
+            partial(self._core.patch_namespaced_config_map, cm_name, self.namespace),
+            cm,
+            partial(owned_objects.get, "configmaps", self.namespace, cm_name),
+        )
+        self._ensure_results[result] += 1
+
+        self._logger.info(f"Ensured locustfile bundle {cm_name}")
+        return cm_name
+
+    @timed_step
+    async def release_bundles(self, keep: str | None = None):
+        """Stop owning the bundles this test no longer runs, deleting the ones
+        no other test owns.
+        """
+        uid = self._body.metadata.uid
+        configmaps = await call(
+            self._core.list_namespaced_config_map,
+            self.namespace,
+            label_selector=f"{LABEL_ANNOTATION_PREFIX}/component=bundle",
+        )
+        for cm in configmaps.items:
+            name = cm.metadata.name
+            owners = {ref.uid for ref in cm.metadata.owner_references or ()}
+            if name == keep or uid not in owners:
+                continue
+
+            try:
+                if owners == {uid}:
+                    # Fails if another test took ownership since it was listed
+                    await call(
+                        self._core.delete_namespaced_config_map,
+                        name,
+                        self.namespace,
+                        body=client.V1DeleteOptions(
+                            preconditions=client.V1Preconditions(
+                                resource_version=cm.metadata.resource_version
+                            )
+                        ),
+                    )
+                    self._logger.info(f"Deleted locustfile bundle {name}")
+                    continue
+            except client.ApiException as e:
+                if e.status == 404:
+                    continue
+                if e.status != 409:
+                    raise
+
+            await call(
+                self._core.patch_namespaced_config_map,
+                name,
+                self.namespace,
+                {"metadata": {"ownerReferences": [{"$patch": "delete", "uid": uid}]}},
+            )
+            self._logger.info(f"Released locustfile bundle {name}")
+
+    @timed_step
+    async def ensure_master_service(self) -> str:
         self._logger.debug("Ensuring master service")
         name = f"{self.name}-master"
 
@@ -185,24 +506,86 @@ class LocustTest:
             ],
         )
 
-        kopf.adopt(msvc)
+        kopf.adopt(msvc, owner=self._body)
 
-        ensure(
-            lambda svc=msvc: self._core.create_namespaced_service(self.namespace, svc),
-            lambda: self._core.read_namespaced_service(name, self.namespace),
-            lambda svc=msvc: self._core.patch_namespaced_service(
-                name, self.namespace, svc
-            ),
+        await self._ensure(
+            partial(self._core.create_namespaced_service, self.namespace),
+            partial(self._core.read_namespaced_service, name, self.namespace),
+            partial(self._core.patch_namespaced_service, name, self.namespace),
             msvc,
+            partial(owned_objects.get, "services", self.namespace, name),
+            partial(self._apply_core.patch_namespaced_service, name, self.namespace),
         )
 
         self._logger.info(f"Created master service {name}")
         return name
 
+    def get_master_job_name(self) -> str:
+        if self._master_revision:
+            return f"{self.name}-master-{self._master_revision}"
+        return f"{self.name}-master"
+
+    def get_worker_job_name(self) -> str:
+        if self._worker_revision:
+            return f"{self.name}-worker-{self._worker_revision}"
+        return f"{self.name}-worker"
+
+    def get_worker_count(self) -> int:
+        if (self._body.status.get("load_profile") or {}).get("aborted"):
+            # Released until the master is restarted
+            return 0
+        workers = self.spec.get("workers", 1)
+        autoscale = Autoscale.from_spec(self.spec)
+        if autoscale is None:
+            return workers
+        return autoscale.clamp(self._body.status.get("desired_workers", workers))
+
+    def get_job_parallelism(self, workers: int) -> int:
+        """Worker pods the job runs, besides the ones claimed from the pool."""
+        return max(workers - self._pool_workers, 0)
+
+    def get_worker_processes(self) -> int:
+        """Locust processes of each worker pod, "auto" runs one per requested
+        core since a locust process only uses one.
+        """
+        worker = self.spec.get("worker", {})
+        processes = worker.get("processes", 1)
+        if processes == "auto":
+            return max(int(pod_requests(worker.get("resources", {})).cpu), 1)
+        return max(int(processes), 1)
+
+    def get_expected_workers(self) -> int:
+        """Worker processes that should be connected to the master, pool
+        workers run a single one.
+        """
+        workers = self.get_worker_count()
+        job_pods = self.get_job_parallelism(workers)
+        return job_pods * self.get_worker_processes() + workers - job_pods
+
+    def get_scheduling(self, component: str) -> dict:
+        """Scheduling of the master or worker pods. Workers are spread over
+        the nodes and zones by default, and the master is kept apart from
+        them as spec.master.isolation says.
+        """
+        isolation = self.spec.get("master", {}).get("isolation", "preferred")
+        other = "worker" if component == "master" else "master"
+        return build_scheduling(
+            self.spec.get(component, {}),
+            spread=(
+                default_spread(self.specific_labels("worker"))
+                if component == "worker"
+                else None
+            ),
+            avoid=self.specific_labels(other) if isolation != "none" else None,
+            # Workers only prefer it, the master may not be scheduled yet
+            avoid_required=isolation == "required" and component == "master",
+        )
+
     def get_webui_service_name(self) -> str:
         return f"{self.name}-webui"
 
-    def ensure_webui_service(self) -> str:
+    @timed_step
+    async def ensure_webui_service(self) -> str:
         self._logger.debug("Ensuring webui service")
         name = f"{self.name}-webui"
 
@@ -222,23 +605,24 @@ class LocustTest:
             ],
         )
 
-        kopf.adopt(msvc)
+        kopf.adopt(msvc, owner=self._body)
 
-        ensure(
-            lambda svc=msvc: self._core.create_namespaced_service(self.namespace, svc),
-            lambda: self._core.read_namespaced_service(name, self.namespace),
-            lambda svc=msvc: self._core.patch_namespaced_service(
-                name, self.namespace, svc
-            ),
+        await self._ensure(
+            partial(self._core.create_namespaced_service, self.namespace),
+            partial(self._core.read_namespaced_service, name, self.namespace),
+            partial(self._core.patch_namespaced_service, name, self.namespace),
             msvc,
+            partial(owned_objects.get, "services", self.namespace, name),
+            partial(self._apply_core.patch_namespaced_service, name, self.namespace),
         )
 
         self._logger.info(f"Created webui service {name}")
         return name
 
-    def ensure_master(self, cm_name: str | None):
+    @timed_step
+    async def ensure_master(self, cm_name: str | None):
         self._logger.debug("Ensuring locust master job")
-        name = f"{self.name}-master"
+        name = self.get_master_job_name()
 
         pod_spec = self.spec.get("master", {})
 
@@ -248,6 +632,7 @@ class LocustTest:
             args=self.spec.get("args", ""),
             env=self.spec.get("env", []),
             cm_name=cm_name,
+            bundle=self.is_bundle(),
             annotations=self.get_annotations(),
             labels=self.get_labels("master"),
             pod_annotations=pod_spec.get("annotations", {}),
@@ -255,24 +640,29 @@ class LocustTest:
             pod_resources=pod_spec.get("resources", {}),
             image_pull_policy=self.spec.get("imagePullPolicy"),
             image_pull_secrets=self.spec.get("imagePullSecrets"),
+            scheduling=self.get_scheduling("master"),
         )
 
-        kopf.adopt(master)
+        kopf.adopt(master, owner=self._body)
 
-        ensure(
-            lambda job=master: self._batch.create_namespaced_job(self.namespace, job),
-            lambda: self._batch.read_namespaced_job(name, self.namespace),
-            lambda job=master: self._batch.patch_namespaced_job(
-                name, self.namespace, job
-            ),
+        await self._ensure(
+            partial(self._batch.create_namespaced_job, self.namespace),
+            partial(self._batch.read_namespaced_job, name, self.namespace),
+            partial(self._batch.patch_namespaced_job, name, self.namespace),
             master,
+            partial(owned_objects.get, "jobs", self.namespace, name),
+            partial(self._apply_batch.patch_namespaced_job, name, self.namespace),
+            # Started from an older template, after an operator upgrade: it
+            # keeps running as it is until the next restart.
+            job_mutable_fields,
         )
 
         self._logger.info(f"Created master job {name}")
 
-    def ensure_worker(self, cm_name: str | None, master_svc: str):
+    @timed_step
+    async def ensure_worker(self, cm_name: str | None, master_svc: str):
         self._logger.debug("Ensuring locust worker job")
-        name = f"{self.name}-worker"
+        name = self.get_worker_job_name()
 
         pod_spec = self.spec.get("worker", {})
 
@@ -282,8 +672,10 @@ class LocustTest:
             args=self.spec.get("args", ""),
             env=self.spec.get("env", []),
             master_svc=master_svc,
-            worker_count=self.spec.get("workers", 1),
+            worker_count=self.get_job_parallelism(self.get_worker_count()),
+            processes=self.get_worker_processes(),
             cm_name=cm_name,
+            bundle=self.is_bundle(),
             annotations=self.get_annotations(),
             labels=self.get_labels("worker"),
             pod_annotations=pod_spec.get("annotations", {}),
@@ -291,27 +683,116 @@ class LocustTest:
             pod_resources=pod_spec.get("resources", {}),
             image_pull_policy=self.spec.get("imagePullPolicy"),
             image_pull_secrets=self.spec.get("imagePullSecrets"),
+            scheduling=self.get_scheduling("worker"),
         )
 
-        kopf.adopt(worker)
+        kopf.adopt(worker, owner=self._body)
 
-        ensure(
-            lambda job=worker: self._batch.create_namespaced_job(self.namespace, job),
-            lambda: self._batch.read_namespaced_job(name, self.namespace),
-            lambda job=worker: self._batch.patch_namespaced_job(
-                name, self.namespace, job
-            ),
+        await self._ensure(
+            partial(self._batch.create_namespaced_job, self.namespace),
+            partial(self._batch.read_namespaced_job, name, self.namespace),
+            partial(self._batch.patch_namespaced_job, name, self.namespace),
             worker,
+            partial(owned_objects.get, "jobs", self.namespace, name),
+            partial(self._apply_batch.patch_namespaced_job, name, self.namespace),
+            job_mutable_fields,
         )
 
         self._logger.info(f"Created worker job {name}")
 
-    def delete_jobs(self):
-        label_selector = to_label_selector_string(self.base_labels())
+    def get_pool_unsupported(self) -> list[str]:
+        """What the test gives its workers that standby workers can't get,
+        they are started ahead with only the locustfile sent by the master.
+        """
+        unsupported = []
+        if self.spec.get("env"):
+            unsupported.append("env")
+        if self.spec.get("args"):
+            unsupported.append("args")
+        if self.is_bundle():
+            unsupported.append("bundle files")
+        if self.get_worker_processes() > 1:
+            unsupported.append("worker processes")
+        return unsupported
 
-        jobs = self._batch.list_namespaced_job(
-            self.namespace, label_selector=label_selector
-        ).items
+    @timed_step
+    async def claim_pool_workers(self, master_svc: str, replace: bool = False):
+        """Take over standby workers of spec.workerPool, so the worker job
+        only starts the ones the pool couldn't provide.
+        """
+        pool = self.spec["workerPool"]
+        selector = to_label_selector_string(
+            {**self.specific_labels("worker"), POOL_STATE_LABEL: CLAIMED}
+        )
+        pods = await call(
+            self._core.list_namespaced_pod, self.namespace, label_selector=selector
+        )
+        claimed = [
+            pod.metadata.name
+            for pod in pods.items
+            if pod.metadata.deletion_timestamp is None
+        ]
+        if replace and claimed:
+            # They run what the previous revision was started with
+            await call(
+                self._core.delete_collection_namespaced_pod,
+                self.namespace,
+                label_selector=selector,
+            )
+            claimed = []
+
+        needed = self.get_worker_count() - len(claimed)
+        unsupported = self.get_pool_unsupported()
+        if unsupported:
+            self._logger.warning(
+                f"Not claiming workers from pool {pool}, they would run without "
+                f"the {', '.join(unsupported)} of the test"
+            )
+        elif needed > 0:
+            pod_spec = self.spec.get("worker", {})
+            claimed += await claim_workers(
+                pool=pool,
+                namespace=self.namespace,
+                image=self.spec.get("image", ""),
+                resources=pod_spec.get("resources", {}),
+                count=needed,
+                owner=self._body,
+                labels={**pod_spec.get("labels", {}), **self.get_labels("worker")},
+                master_host=master_svc,
+            )
+
+        self._pool_workers = len(claimed)
+        self._patch.status["pool_workers"] = self._pool_workers
+        self._logger.info(f"Claimed {len(claimed)} workers from pool {pool}")
+
+    @timed_step
+    async def delete_jobs(
+        self,
+        component: str | None = None,
+        keep: str | None = None,
+        propagation_policy: str = "Background",
+    ):
+        labels = self.base_labels()
+        if component is not None:
+            labels[f"{LABEL_ANNOTATION_PREFIX}/component"] = component
+
+        jobs = owned_objects.list("jobs", self.namespace, self.name)
+        if jobs is None:
+            label_selector = to_label_selector_string(labels)
+            jobs = (
+                await call(
+                    self._batch.list_namespaced_job,
+                    self.namespace,
+                    label_selector=label_selector,
+                )
+            ).items
+
+        jobs = [
+            job
+            for job in jobs
+            if job.metadata.name != keep
+            and labels.items() <= (job.metadata.labels or {}).items()
+        ]
 
         if not jobs:
             self._logger.info(f"No Jobs to delete for {self.namespace}/{self.name}.")
@@ -320,73 +801,636 @@ class LocustTest:
         for job in jobs:
             job_name = job.metadata.name
             self._logger.info(f"Deleting Job {self.namespace}/{job_name}")
-            self._batch.delete_namespaced_job(
-                name=job_name,
-                namespace=self.namespace,
-                propagation_policy="Foreground",
-            )
+            try:
+                await call(
+                    self._batch.delete_namespaced_job,
+                    name=job_name,
+                    namespace=self.namespace,
+                    propagation_policy=propagation_policy,
+                )
+            except client.ApiException as e:
+                # The cache can lag behind a deletion
+                if e.status != 404:
+                    raise
+            owned_objects.forget("jobs", self.namespace, job_name)
 
-    async def stats_daemon(self, stopped: kopf.DaemonStopped):
-        interval = self.spec.get("metrics", {}).get("intervalSeconds", 5)
+    def get_poll_interval(self) -> float:
+        return self.spec.get("metrics", {}).get("intervalSeconds", 5)
 
+    async def poll_stats(self, poll: PollState) -> str:
+        """Fetch the master stats once and publish them in the status when
+        they changed enough, returns the locust state.
+        """
         webui_svc_name = self.get_webui_service_name()
         # TODO: Should be configurable and come from centralized place
         # to be shared with master service
         webui_svc_port = 8089
 
-        backoff = 1.0
-        while not stopped.is_set():
-            t0 = time.time()
-            try:
-                stats = self.fetch_stats(webui_svc_name, webui_svc_port)
+        if is_finished(self._body.status) or self.master_finished():
+            # Nothing left to poll once the master exited
+            return await self.finish_run(poll)
 
-                worker_count = int(
-                    stats.get("worker_count", len(stats.get("workers", [])))
-                )
+        t0 = time.time()
+        stats = await self.fetch_stats(webui_svc_name, webui_svc_port)
+        poll_latency = time.time() - t0
+        STATS_POLL_DURATION.observe(poll_latency)
+        observe_stats(self.namespace, self.name, stats)
+        run_history = history.record(self.namespace, self.name, time.time(), stats)
 
-                client.CustomObjectsApi().patch_namespaced_custom_object_status(
-                    GROUP,
-                    VERSION,
-                    self.namespace,
-                    PLURAL,
-                    self.name,
-                    {
-                        "status": {
-                            "state": stats.get("state", "").upper(),
-                            "fail_ratio": f"{int(stats.get('fail_ratio', 0)) * 100}%",
-                            "total_rps": int(stats.get("total_rps", 0)),
-                            "user_count": int(stats.get("user_count", 0)),
-                            "worker_count": worker_count,
-                            "worker_ratio": f"{worker_count}/{self.spec.get('workers', 1)}",
-                        }
-                    },
-                )
+        sample = {
+            "state": stats.get("state", ""),
+            "fail_ratio": float(stats.get("fail_ratio", 0)),
+            "total_rps": float(stats.get("total_rps", 0)),
+            "user_count": int(stats.get("user_count", 0)),
+            "worker_count": int(
+                stats.get("worker_count", len(stats.get("workers", [])))
+            ),
+        }
+
+        if sample["state"] == "running":
+            await self.autoscale_workers(stats, poll)
+        load_profile = await self.drive_load_profile(stats, sample, poll)
+
+        results = None
+        if sample["state"] in ("spawning", "running"):
+            poll.results_captured = poll.run_finished = False
+        elif sample["state"] == "stopped" and not poll.results_captured:
+            results = await self.capture_results(stats)
+            poll.results_captured = True
+
+        restart_seconds = self.get_restart_seconds()
+        first_request_seconds = None
+        if not poll.first_request_seen:
+            first_request_seconds = self.get_time_to_first_request(stats)
+            poll.first_request_seen = first_request_seconds is not None
+
+        rolled = await self.finish_worker_rollout(stats, poll)
+        startup = await self.get_startup_times(sample["worker_count"], poll)
+        if sample["state"] in ("spawning", "running", "stopped"):
+            poll.last_stats = stats
+        distribution = await self.observe_worker_distribution(
+            sample["worker_count"], poll
+        )
+
+        status_writer = poll.status_writer
+        status_writer.configure(self.spec.get("metrics", {}))
+        now = time.monotonic()
+        if (
+            restart_seconds is None
+            and first_request_seconds is None
+            and not startup
+            and load_profile is None
+            and results is None
+            and not rolled
+            and distribution is None
+            and not status_writer.should_write(
+                sample, now, self._body.status.get("state")
+            )
+        ):
+            return sample["state"]
+
+        status = {
+            "state": sample["state"].upper(),
+            "fail_ratio": f"{sample['fail_ratio'] * 100:.1f}%",
+            "total_rps": int(sample["total_rps"]),
+            "user_count": sample["user_count"],
+            "worker_count": sample["worker_count"],
+            "worker_ratio": f"{sample['worker_count']}/{self.get_expected_workers()}",
+            **worker_pods_status(stats.get("workers", [])),
+            "poll_latency_ms": int(poll_latency * 1000),
+            "poll_errors": poll.errors,
+            "summary": run_history.summary(),
+        }
+        if restart_seconds is not None:
+            status["restart_seconds"] = restart_seconds
+        if first_request_seconds is not None:
+            status["time_to_first_request_seconds"] = first_request_seconds
+        if results is not None:
+            status["results"] = results
+        status.update(startup)
+        if load_profile is not None:
+            status["load_profile"] = load_profile
+        if rolled:
+            status["rolling_workers"] = None
+        if distribution is not None:
+            status["worker_distribution"] = distribution
+
+        await call(
+            self._custom.patch_namespaced_custom_object_status,
+            GROUP,
+            VERSION,
+            self.namespace,
+            PLURAL,
+            self.name,
+            {"status": status},
+        )
+        status_writer.written(sample, now)
+
+        return sample["state"]
+
+    async def finish_worker_rollout(self, stats: dict, poll: PollState) -> bool:
+        """Delete the worker jobs replaced by the current one once all of its
+        workers are connected, returns whether it just did.
+        """
+        job_name = self.get_worker_job_name()
+        if not self._body.status.get("rolling_workers") or (
+            poll.rolled_worker_job == job_name
+        ):
+            return False
+
+        # Locust names its workers after their hostname, the pod name
+        connected = sum(
+            str(worker.get("id", "")).startswith(f"{job_name}-")
+            for worker in stats.get("workers", [])
+        )
+        expected = self.get_job_parallelism(self.get_worker_count())
+        if connected < expected * self.get_worker_processes():
+            return False
+
+        await self.delete_jobs(component="worker", keep=job_name)
+        poll.rolled_worker_job = job_name
+        return True
+
+    def master_finished(self) -> bool:
+        """The master job completed or failed, as seen by the job cache."""
+        job = owned_objects.get("jobs", self.namespace, self.get_master_job_name())
+        conditions = (job is not None and job.status and job.status.conditions) or []
+        return any(
+            condition.type in ("Complete", "Failed") and condition.status == "True"
+            for condition in conditions
+        )
+
+    async def finish_run(self, poll: PollState) -> str:
+        """Record the end of the run of a master that exited, which releases
+        its admission, and capture its results from its last poll if no poll
+        saw it stopped. Its exports went away with it.
+        """
+        if poll.run_finished or is_finished(self._body.status):
+            return "stopped"
+
+        status = {"state": "STOPPED", "run_finished_at": now_iso()}
+        if not poll.results_captured and poll.last_stats is not None:
+            status["results"] = await self.capture_results(
+                poll.last_stats, exports=False
+            )
+        await call(
+            self._custom.patch_namespaced_custom_object_status,
+            GROUP,
+            VERSION,
+            self.namespace,
+            PLURAL,
+            self.name,
+            {"status": status},
+        )
+        poll.results_captured = poll.run_finished = True
+        return "stopped"
+
+    def get_results_configmap_name(self) -> str:
+        return f"{self.name}-results"
+
+    @timed_step
+    async def capture_results(self, stats: dict, exports: bool = True) -> dict:
+        """Keep the results of a stopped run in a ConfigMap owned by the test,
+        the master's pod doesn't outlive its job. Returns their summary.
+        """
+        svc, port = self.get_webui_service_name(), 8089
+        fetched = []
+        if exports:
+            fetched = await asyncio.gather(
+                *(self.fetch(svc, port, path) for path in RESULT_EXPORTS.values()),
+                return_exceptions=True,
+            )
+        files = {"stats.json.gz": gzip.compress(json.dumps(stats).encode())}
+        for filename, export in zip(RESULT_EXPORTS, fetched):
+            if isinstance(export, BaseException):
+                self._logger.warning(f"Failed to fetch {filename}: {export}")
+                continue
+            files[f"{filename}.gz"] = gzip.compress(export)
+
+        # The largest exports are left out rather than failing the whole write
+        omitted = []
+        while sum(map(len, files.values())) * 4 / 3 > CONFIGMAP_MAX_SIZE:
+            largest = max(files, key=lambda filename: len(files[filename]))
+            omitted.append(largest)
+            del files[largest]
+
+        name = self.get_results_configmap_name()
+        cm = build_results_configmap(
+            name=name,
+            files=files,
+            labels=self.get_labels("results"),
+            annotations=self.get_annotations(),
+        )
+        kopf.adopt(cm, owner=self._body)
+        await self._ensure(
+            partial(self._core.create_namespaced_config_map, self.namespace),
+            partial(self._core.read_namespaced_config_map, name, self.namespace),
+            partial(self._core.patch_namespaced_config_map, name, self.namespace),
+            cm,
+            partial(owned_objects.get, "configmaps", self.namespace, name),
+            partial(self._apply_core.patch_namespaced_config_map, name, self.namespace),
+        )
 
-            except Exception as e:
-                self._logger.error(f"stats poll error: {e}")
-                await stopped.wait(min(backoff, interval))
-                backoff = min(backoff * 2.0, 30.0)
+        total = next(
+            (e for e in stats.get("stats", []) if e.get("name") == "Aggregated"), {}
+        )
+        results = {
+            "configmap": name,
+            "captured_at": now_iso(),
+            "num_requests": total.get("num_requests", 0),
+            "num_failures": total.get("num_failures", 0),
+            "avg_response_time_ms": round(total.get("avg_response_time") or 0, 1),
+            "p95_response_time_ms": total.get("response_time_percentile_0.95"),
+            "errors": len(stats.get("errors", [])),
+        }
+        if omitted:
+            results["omitted"] = omitted
+        self._logger.info(f"Captured results of {self.namespace}/{self.name}")
+        return results
+
+    @property
+    def restart_pending(self) -> bool:
+        """The master was restarted and hasn't answered a poll yet."""
+        status = self._body.status
+        return bool(status.get("restarted_at")) and (
+            status.get("restart_seconds") is None
+        )
+
+    def master_ready(self) -> bool | None:
+        """The current master job has a ready pod, None when the job cache
+        can't tell. The master service only routes to ready pods.
+        """
+        jobs = owned_objects.list("jobs", self.namespace, self.name)
+        if jobs is None:
+            return None
+        name = self.get_master_job_name()
+        return any(
+            job.metadata.name == name and job.status and job.status.ready
+            for job in jobs
+        )
+
+    def get_restart_seconds(self) -> float | None:
+        """Time from the last master restart to its first answered poll, if
+        it hasn't been recorded yet.
+        """
+        if not self.restart_pending:
+            return None
+        if self.master_ready() is False:
+            # Answered by the old master, still terminating
+            return None
+
+        restarted_at = self._body.status["restarted_at"]
+        elapsed = datetime.datetime.now(datetime.timezone.utc) - (
+            datetime.datetime.fromisoformat(restarted_at)
+        )
+        return round(elapsed.total_seconds(), 1)
+
+    def awaits_start(self, poll: PollState) -> bool:
+        """The ready master still waits for its workers to connect, or for
+        the operator to start its load profile.
+        """
+        if not poll.workers_connected_seen and self.get_expected_workers() > 0:
+            return True
+        progress = poll.load_profile or self._body.status.get("load_profile") or {}
+        return LoadProfile.from_spec(self.spec) is not None and not progress.get(
+            "started_at"
+        )
 
-            elapsed = time.time() - t0
-            base = max(0.0, interval - elapsed)
-            jitter = random.uniform(-0.2, 0.2) * interval
-            await stopped.wait(max(0.0, base + jitter))
+    def get_run_start(self) -> str | None:
+        """When the current master was started, with the test, once admitted,
+        or by a restart.
+        """
+        status = self._body.status
+        return (
+            status.get("restarted_at")
+            or status.get("admitted_at")
+            or self._body.metadata.get("creationTimestamp")
+        )
+
+    async def get_startup_times(self, worker_count: int, poll: PollState) -> dict:
+        """Seconds from the start of the master until it was ready and until
+        all the workers were connected to it, each once they just happened.
+        """
+        run_start = self.get_run_start()
+        if not run_start:
+            return {}
+        if poll.run_start != run_start:
+            poll.run_start = run_start
+            poll.master_ready_seen = poll.workers_connected_seen = False
+            poll.last_stats = None
+
+        started = datetime.datetime.fromisoformat(run_start.replace("Z", "+00:00"))
+        status = self._body.status
+        times = {}
+
+        if not poll.master_ready_seen:
+            poll.master_ready_seen = status.get("master_ready_seconds") is not None
+        if not poll.master_ready_seen:
+            ready = await self.get_master_ready_time()
+            if ready is not None:
+                seconds = max((ready - started).total_seconds(), 0)
+                times["master_ready_seconds"] = round(seconds, 1)
+                poll.master_ready_seen = True
+
+        if not poll.workers_connected_seen:
+            poll.workers_connected_seen = (
+                status.get("workers_connected_seconds") is not None
+            )
+        expected = self.get_expected_workers()
+        if not poll.workers_connected_seen and expected and worker_count >= expected:
+            elapsed = datetime.datetime.now(datetime.timezone.utc) - started
+            times["workers_connected_seconds"] = round(elapsed.total_seconds(), 1)
+            poll.workers_connected_seen = True
+
+        return times
+
+    async def observe_worker_distribution(
+        self, worker_count: int, poll: PollState
+    ) -> dict | None:
+        """Placement of the worker pods, taken again once all the workers are
+        connected after a restart, a rollout or a resize.
+        """
+        expected = self.get_expected_workers()
+        workers = (self.get_run_start(), self.get_worker_job_name(), expected)
+        if poll.distribution_of is None and self._body.status.get(
+            "worker_distribution"
+        ):
+            # Taken before the operator restarted
+            poll.distribution_of = workers
+        if poll.distribution_of == workers or not expected or worker_count < expected:
+            return None
+        if self._body.status.get("rolling_workers") and (
+            poll.rolled_worker_job != self.get_worker_job_name()
+        ):
+            # The replaced workers are still connected
+            return None
+
+        poll.distribution_of = workers
+        return await self.get_worker_distribution()
+
+    async def get_worker_distribution(self) -> dict:
+        """Running worker pods per node and per zone, many on one node share
+        its network bandwidth.
+        """
+        pods = await call(
+            self._core.list_namespaced_pod,
+            self.namespace,
+            label_selector=to_label_selector_string(self.specific_labels("worker")),
+        )
+        nodes = collections.Counter(
+            pod.spec.node_name
+            for pod in pods.items
+            if pod.spec.node_name and pod.status and pod.status.phase == "Running"
+        )
+        zones = collections.Counter()
+        for node, count in nodes.items():
+            zone = await get_node_zone(self._core, node)
+            if zone is not None:
+                zones[zone] += count
 
-    def fetch_stats(self, svc: str, port: int):
+        distribution = {
+            "nodes": len(nodes),
+            "max_pods_per_node": max(nodes.values(), default=0),
+            "pods_per_node": dict(nodes),
+        }
+        if zones:
+            distribution["pods_per_zone"] = dict(zones)
+        return distribution
+
+    async def get_master_ready_time(self) -> datetime.datetime | None:
+        """When the pod of the current master job became ready, if it is.
+
+        The pod is only listed once the cached job counts a ready pod, a
+        master that never gets ready costs no API call.
+        """
+        job = owned_objects.get("jobs", self.namespace, self.get_master_job_name())
+        if job is not None and not (job.status and job.status.ready):
+            return None
+
+        pods = await call(
+            self._core.list_namespaced_pod,
+            self.namespace,
+            label_selector=to_label_selector_string(
+                {"job-name": self.get_master_job_name()}
+            ),
+        )
+        for pod in pods.items:
+            for condition in (pod.status and pod.status.conditions) or []:
+                if condition.type == "Ready" and condition.status == "True":
+                    return condition.last_transition_time
+        return None
+
+    def get_time_to_first_request(self, stats: dict) -> float | None:
+        """Time from the creation of the test, or its admission when it was
+        queued, to the first request its workers made, when they just made it.
+        """
+        if "time_to_first_request_seconds" in self._body.status:
+            return None
+        if not any(entry.get("num_requests") for entry in stats.get("stats", [])):
+            return None
+
+        created = self._body.status.get("admitted_at") or (
+            self._body.metadata.get("creationTimestamp")
+        )
+        if not created:
+            return None
+        elapsed = datetime.datetime.now(datetime.timezone.utc) - (
+            datetime.datetime.fromisoformat(created.replace("Z", "+00:00"))
+        )
+        seconds = round(elapsed.total_seconds(), 1)
+        TIME_TO_FIRST_REQUEST.labels(str(self._pool_workers > 0).lower()).observe(
+            seconds
+        )
+        return seconds
+
+    async def autoscale_workers(self, stats: dict, poll: PollState):
+        autoscale = Autoscale.from_spec(self.spec)
+        if autoscale is None:
+            return
+
+        now = time.monotonic()
+        if now - poll.last_scale_time < autoscale.cooldown_seconds:
+            return
+
+        current = self.get_worker_count()
+        desired, reason = plan_workers(
+            autoscale,
+            current=current,
+            user_count=int(stats.get("user_count", 0)),
+            cpu_usages=[
+                float(worker["cpu_usage"])
+                for worker in stats.get("workers", [])
+                if worker.get("cpu_usage") is not None
+            ],
+            processes=self.get_worker_processes(),
+        )
+        if desired == current:
+            return
+
+        # Resized in place, the job controller starts or removes worker pods
+        await call(
+            self._batch.patch_namespaced_job,
+            self.get_worker_job_name(),
+            self.namespace,
+            {"spec": {"parallelism": self.get_job_parallelism(desired)}},
+        )
+        await call(
+            self._custom.patch_namespaced_custom_object_status,
+            GROUP,
+            VERSION,
+            self.namespace,
+            PLURAL,
+            self.name,
+            {"status": {"desired_workers": desired, "worker_distribution": None}},
+        )
+        poll.last_scale_time = now
+
+        message = f"Scaled workers from {current} to {desired}: {reason}"
+        self._logger.info(message)
+        kopf.event(self._body, type="Normal", reason="Autoscaled", message=message)
+
+    async def drive_load_profile(
+        self, stats: dict, sample: dict, poll: PollState
+    ) -> dict | None:
+        """Move the swarm through the stages of spec.loadProfile and abort it
+        on its rules, returns the progress of the profile when it changed.
+        """
+        profile = LoadProfile.from_spec(self.spec)
+        if profile is None:
+            return None
+
+        run_start = self.get_run_start()
+        if poll.load_profile is None or poll.load_profile_run != run_start:
+            poll.load_profile = dict(self._body.status.get("load_profile") or {})
+            poll.load_profile_run = run_start
+            poll.abort_breaches.clear()
+        progress = poll.load_profile
+        if progress.get("aborted") or progress.get("finished_at"):
+            return None
+
+        state = sample["state"]
+        svc, port = self.get_webui_service_name(), 8089
+        if not progress.get("started_at"):
+            # Every worker is connected, or the first stage would only run on
+            # the ones that were quick to start
+            if state != "ready" or sample["worker_count"] < self.get_expected_workers():
+                return None
+            await self.swarm(svc, port, profile.stages[0])
+            progress.update(started_at=now_iso(), stage=0)
+            self._logger.info(f"Started load profile of {self.namespace}/{self.name}")
+            return dict(progress)
+
+        if state in ("spawning", "running"):
+            reason = check_abort(
+                profile.abort_rules, stats, time.monotonic(), poll.abort_breaches
+            )
+            if reason is not None:
+                await self.abort_run(svc, port, reason)
+                progress.update(aborted=reason, finished_at=now_iso())
+                return dict(progress)
+
+        started_at = datetime.datetime.fromisoformat(progress["started_at"])
+        elapsed = datetime.datetime.now(datetime.timezone.utc) - started_at
+        stage = profile.stage_at(elapsed.total_seconds())
+        if stage is None:
+            await self.fetch(svc, port, "stop")
+            progress.update(finished_at=now_iso())
+            self._logger.info(f"Finished load profile of {self.namespace}/{self.name}")
+            return dict(progress)
+        if stage != progress.get("stage"):
+            await self.swarm(svc, port, profile.stages[stage])
+            progress.update(stage=stage)
+            return dict(progress)
+        return None
+
+    async def swarm(self, svc: str, port: int, stage: Stage):
+        await self.fetch(
+            svc,
+            port,
+            "swarm",
+            data={"user_count": stage.users, "spawn_rate": stage.spawn_rate},
+        )
+
+    @timed_step
+    async def abort_run(self, svc: str, port: int, reason: str):
+        """Stop the swarm and release the workers right away, the master is
+        kept for its results.
+        """
+        await self.fetch(svc, port, "stop")
+        await call(
+            self._batch.patch_namespaced_job,
+            self.get_worker_job_name(),
+            self.namespace,
+            {"spec": {"parallelism": 0}},
+        )
+        if self._pool_workers:
+            await call(
+                self._core.delete_collection_namespaced_pod,
+                self.namespace,
+                label_selector=to_label_selector_string(
+                    {**self.specific_labels("worker"), POOL_STATE_LABEL: CLAIMED}
+                ),
+            )
+
+        message = f"Aborted the run: {reason}"
+        self._logger.warning(message)
+        kopf.event(self._body, type="Warning", reason="Aborted", message=message)
+
+    async def fetch_stats(self, svc: str, port: int):
         path = "stats/requests"
 
         if not IN_CLUSTER:
-            raw = str(
-                self._core.connect_get_namespaced_service_proxy_with_path(
-                    name=f"{svc}:{port}",
-                    namespace=self.namespace,
-                    path=path,
-                )
-            )
-            return ast.literal_eval(raw)
+            return json.loads(await self.fetch(svc, port, path))
 
         else:
-            response = requests.get(
+            return await stats_client.get_json(
                 f"http://{svc}.{self.namespace}.svc.cluster.local:{port}/{path}"
             )
-            return response.json()
+
+    async def fetch(
+        self, svc: str, port: int, path: str, data: dict | None = None
+    ) -> bytes:
+        """GET path from the master, or POST data to it as a form."""
+        if not IN_CLUSTER:
+            async with stats_client.in_flight:
+                if data is not None:
+                    return await call(
+                        self.post_service_proxy, f"{svc}:{port}", path, data
+                    )
+                return await call(self.read_service_proxy, f"{svc}:{port}", path)
+
+        url = f"http://{svc}.{self.namespace}.svc.cluster.local:{port}/{path}"
+        if data is not None:
+            return await stats_client.post_form(url, data)
+        return await stats_client.get_bytes(url)
+
+    def read_service_proxy(self, name: str, path: str) -> bytes:
+        # Skip the client's model deserialization, the payload is plain JSON
+        # and can be large with many endpoints.
+        response = self._core.connect_get_namespaced_service_proxy_with_path(
+            name=name,
+            namespace=self.namespace,
+            path=path,
+            _preload_content=False,
+        )
+        try:
+            return response.data
+        finally:
+            response.release_conn()
+
+    def post_service_proxy(self, name: str, path: str, data: dict) -> bytes:
+        # The generated proxy POST method has no body parameter
+        response = self._core.api_client.call_api(
+            "/api/v1/namespaces/{namespace}/services/{name}/proxy/{path}",
+            "POST",
+            path_params={"namespace": self.namespace, "name": name, "path": path},
+            header_params={"Content-Type": "application/x-www-form-urlencoded"},
+            post_params=list(data.items()),
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+            _return_http_data_only=True,
+        )
+        try:
+            return response.data
+        finally:
+            response.release_conn()
@@ -0,0 +1,252 @@
+import math
+from array import array
+from dataclasses import dataclass
+
+# Endpoints beyond this are left out of a test's history, the aggregated
+# series still covers them.
+MAX_ENDPOINTS = 20
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    resolution: float
+    capacity: int
+
+
+# Every poll for the last half hour, then per minute for half a day and per
+# quarter of an hour for a week. Each test holds at most the sum of the
+# capacities per series, however long it runs.
+TIERS = (
+    Tier("raw", 0, 360),
+    Tier("1m", 60, 720),
+    Tier("15m", 900, 672),
+)
+ENDPOINT_TIERS = TIERS[1:]
+
+AGGREGATE_FIELDS = (
+    "total_rps",
+    "fail_ratio",
+    "user_count",
+    "worker_count",
+    "response_time_p50",
+    "response_time_p95",
+)
+ENDPOINT_FIELDS = ("rps", "response_time_p50", "response_time_p95", "response_time_p99")
+
+
+class RingBuffer:
+    """Up to a fixed number of samples of a few fields, stored in flat arrays
+    grown as samples come, overwriting the oldest sample once full. Short
+    runs and the coarse tiers of young runs only hold what they recorded.
+    """
+
+    def __init__(self, capacity: int, fields: tuple[str, ...]):
+        self.capacity = capacity
+        self.fields = fields
+        self._times = array("d")
+        self._values = [array("f") for _ in fields]
+        self._next = 0
+        self.size = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size == self.capacity
+
+    def append(self, t: float, values: list[float]):
+        i = self._next
+        if self.full:
+            self._times[i] = t
+            for column, value in zip(self._values, values):
+                column[i] = value
+        else:
+            # Not wrapped around yet, i is the end of the arrays
+            self._times.append(t)
+            for column, value in zip(self._values, values):
+                column.append(value)
+        self._next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _order(self) -> list[int]:
+        start = (self._next - self.size) % self.capacity
+        return [(start + i) % self.capacity for i in range(self.size)]
+
+    def to_dict(self, since: float = 0) -> dict[str, list[float]]:
+        order = [i for i in self._order() if self._times[i] >= since]
+        return {
+            "time": [self._times[i] for i in order],
+            **{
+                field: [round(column[i], 3) for i in order]
+                for field, column in zip(self.fields, self._values)
+            },
+        }
+
+    def column(self, field: str) -> list[float]:
+        column = self._values[self.fields.index(field)]
+        return [column[i] for i in self._order()]
+
+
+class TieredSeries:
+    """A ring buffer per tier. Coarser tiers get the mean of each of their
+    buckets, except response times that keep the worst value.
+    """
+
+    def __init__(self, fields: tuple[str, ...], tiers: tuple[Tier, ...] = TIERS):
+        self.fields = fields
+        self.tiers = tiers
+        self.buffers = [RingBuffer(tier.capacity, fields) for tier in tiers]
+        self._use_max = [field.startswith("response_time") for field in fields]
+        self._buckets: list[tuple[float, int, list[float]] | None] = [None] * len(tiers)
+
+    def add(self, t: float, values: list[float]):
+        for index, tier in enumerate(self.tiers):
+            if not tier.resolution:
+                self.buffers[index].append(t, values)
+                continue
+
+            start = t - t % tier.resolution
+            bucket = self._buckets[index]
+            if bucket is not None and bucket[0] != start:
+                self._flush(index)
+                bucket = None
+            if bucket is None:
+                self._buckets[index] = (start, 1, list(values))
+                continue
+
+            _, count, acc = bucket
+            for i, value in enumerate(values):
+                acc[i] = max(acc[i], value) if self._use_max[i] else acc[i] + value
+            self._buckets[index] = (start, count + 1, acc)
+
+    def _flush(self, index: int):
+        start, count, acc = self._buckets[index]
+        values = [
+            value if use_max else value / count
+            for value, use_max in zip(acc, self._use_max)
+        ]
+        self.buffers[index].append(start, values)
+        self._buckets[index] = None
+
+    def tier(self, resolution: float) -> int:
+        """Finest tier at least as coarse as resolution."""
+        for index, tier in enumerate(self.tiers):
+            if tier.resolution >= resolution:
+                return index
+        return len(self.tiers) - 1
+
+    def whole_run(self) -> RingBuffer:
+        """Finest buffer still holding the start of the run."""
+        for buffer in self.buffers:
+            if not buffer.full:
+                return buffer
+        return self.buffers[-1]
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def _response_time(entry: dict, quantile: str, fallback: str | None = None) -> float:
+    value = entry.get(f"response_time_percentile_{quantile}")
+    if value is None and fallback is not None:
+        value = entry.get(fallback)
+    return float(value or 0)
+
+
+class RunHistory:
+    def __init__(self):
+        self.aggregate = TieredSeries(AGGREGATE_FIELDS)
+        self.endpoints: dict[str, TieredSeries] = {}
+        # Exact, the buffers only hold means of older samples
+        self.extremes: dict[str, tuple[float, float]] = {}
+
+    def record(self, t: float, stats: dict):
+        entries = stats.get("stats", [])
+        total = next((e for e in entries if e.get("name") == "Aggregated"), {})
+        num_requests = total.get("num_requests", 0)
+        aggregate = [
+            float(stats.get("total_rps", 0)),
+            total.get("num_failures", 0) / num_requests if num_requests else 0.0,
+            float(stats.get("user_count", 0)),
+            float(stats.get("worker_count", len(stats.get("workers", [])))),
+            _response_time(total, "0.5", "median_response_time"),
+            _response_time(total, "0.95"),
+        ]
+        self.aggregate.add(t, aggregate)
+        for field in ("total_rps", "response_time_p95"):
+            value = aggregate[AGGREGATE_FIELDS.index(field)]
+            low, high = self.extremes.get(field, (value, value))
+            self.extremes[field] = (min(low, value), max(high, value))
+
+        for entry in entries:
+            if entry is total:
+                continue
+            key = f"{entry.get('method') or ''} {entry.get('name', '')}".strip()
+            series = self.endpoints.get(key)
+            if series is None:
+                if len(self.endpoints) >= MAX_ENDPOINTS:
+                    continue
+                series = self.endpoints[key] = TieredSeries(
+                    ENDPOINT_FIELDS, ENDPOINT_TIERS
+                )
+            series.add(
+                t,
+                [
+                    float(entry.get("current_rps", 0)),
+                    _response_time(entry, "0.5", "median_response_time"),
+                    _response_time(entry, "0.95"),
+                    _response_time(entry, "0.99", "ninety_ninth_response_time"),
+                ],
+            )
+
+    def to_dict(self, resolution: float = 0, since: float = 0) -> dict:
+        index = self.aggregate.tier(resolution)
+        tier = self.aggregate.tiers[index]
+        endpoint_index = min(
+            max(index - (len(TIERS) - len(ENDPOINT_TIERS)), 0),
+            len(ENDPOINT_TIERS) - 1,
+        )
+        return {
+            "resolution": tier.resolution,
+            "aggregate": self.aggregate.buffers[index].to_dict(since),
+            "endpoints": {
+                key: series.buffers[endpoint_index].to_dict(since)
+                for key, series in self.endpoints.items()
+            },
+            "summary": self.summary(),
+        }
+
+    def summary(self) -> dict[str, float]:
+        buffer = self.aggregate.whole_run()
+        if not buffer.size:
+            return {}
+
+        summary = {}
+        for field, name in (("total_rps", "rps"), ("response_time_p95", "latency_ms")):
+            low, high = self.extremes[field]
+            summary[f"{name}_min"] = round(low, 1)
+            summary[f"{name}_max"] = round(high, 1)
+            summary[f"{name}_p95"] = round(percentile(buffer.column(field), 0.95), 1)
+        return summary
+
+
+class HistoryStore:
+    def __init__(self):
+        self._tests: dict[tuple[str, str], RunHistory] = {}
+
+    def record(self, namespace: str, name: str, t: float, stats: dict) -> RunHistory:
+        history = self._tests.get((namespace, name))
+        if history is None:
+            history = self._tests[(namespace, name)] = RunHistory()
+        history.record(t, stats)
+        return history
+
+    def get(self, namespace: str, name: str) -> RunHistory | None:
+        return self._tests.get((namespace, name))
+
+    def forget(self, namespace: str, name: str):
+        self._tests.pop((namespace, name), None)
+
+
+history = HistoryStore()
@@ -0,0 +1,98 @@
+import itertools
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Stage:
+    duration_seconds: float
+    users: int
+    spawn_rate: float
+
+
+@dataclass(frozen=True)
+class AbortRule:
+    metric: str
+    threshold: float
+    for_seconds: float
+
+    def value(self, stats: dict) -> float:
+        """Value over the current window of the stats, the last seconds of the
+        run, so breaches are seen as they happen and cleared as they end.
+        """
+        if self.metric == "failRatio":
+            total = next(
+                (e for e in stats.get("stats", []) if e.get("name") == "Aggregated"),
+                {},
+            )
+            rps = float(total.get("current_rps") or 0)
+            fail_per_sec = float(total.get("current_fail_per_sec") or 0)
+            return fail_per_sec / rps if rps else 0.0
+        percentiles = stats.get("current_response_time_percentiles") or {}
+        return float(percentiles.get("response_time_percentile_0.95") or 0)
+
+    def describe(self, value: float) -> str:
+        if self.metric == "failRatio":
+            return (
+                f"fail ratio {value * 100:.1f}% above {self.threshold * 100:.1f}% "
+                f"for {self.for_seconds:.0f}s"
+            )
+        return (
+            f"p95 response time {value:.0f}ms above {self.threshold:.0f}ms "
+            f"for {self.for_seconds:.0f}s"
+        )
+
+
+@dataclass
+class LoadProfile:
+    stages: list[Stage]
+    abort_rules: list[AbortRule]
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> "LoadProfile | None":
+        profile = spec.get("loadProfile")
+        if not profile or not profile.get("stages"):
+            return None
+
+        return cls(
+            stages=[
+                Stage(
+                    duration_seconds=stage["durationSeconds"],
+                    users=stage["users"],
+                    spawn_rate=stage.get("spawnRate", stage["users"]),
+                )
+                for stage in profile["stages"]
+            ],
+            abort_rules=[
+                AbortRule(
+                    metric=rule["metric"],
+                    threshold=rule["threshold"],
+                    for_seconds=rule.get("forSeconds", 0),
+                )
+                for rule in profile.get("abort", [])
+            ],
+        )
+
+    def stage_at(self, elapsed: float) -> int | None:
+        """Stage running elapsed seconds into the profile, None once over."""
+        ends = itertools.accumulate(stage.duration_seconds for stage in self.stages)
+        for index, end in enumerate(ends):
+            if elapsed < end:
+                return index
+        return None
+
+
+def check_abort(
+    rules: list[AbortRule], stats: dict, now: float, breaches: dict[int, float]
+) -> str | None:
+    """Why the run should be aborted, if a rule has been breached for long
+    enough. breaches holds since when each rule is breached, across polls.
+    """
+    for index, rule in enumerate(rules):
+        value = rule.value(stats)
+        if value <= rule.threshold:
+            breaches.pop(index, None)
+            continue
+        since = breaches.setdefault(index, now)
+        if now - since >= rule.for_seconds:
+            return rule.describe(value)
+    return None
@@ -2,9 +2,35 @@ import datetime
 import logging
 
 import kopf
-from constants import IN_CLUSTER, LABEL_ANNOTATION_PREFIX, LOCUST_TEST_RESOURCE
+from admission import QUEUED, admission
+from cache import owned_objects
+from constants import (
+    GROUP,
+    IN_CLUSTER,
+    LABEL_ANNOTATION_PREFIX,
+    LOCUST_TEST_RESOURCE,
+    LOCUST_WORKER_POOL_RESOURCE,
+    PLURAL,
+    SERVER_PORT,
+    VERSION,
+    WATCH_NAMESPACE,
+)
 from controller import LocustTest
 from kubernetes import client, config
+from metrics import CacheCollector
+from objects import api_client, call
+from pool import WorkerPool
+from prometheus_client import REGISTRY
+from scheduler import stats_scheduler
+from server import OperatorServer
+from sharding import (
+    ShardDiffBaseStorage,
+    ShardProgressStorage,
+    owns_object,
+    shards,
+)
+from stats import stats_client
+from workqueue import Priority, reconcile_queue, stagger_start
 
 try:
     if IN_CLUSTER:
@@ -15,11 +41,15 @@ except config.config_exception.ConfigException:
     raise Exception("Unable to configure kubernetes client!")
 
 
+POOL_REFILL_INTERVAL = 15
+
 core_api = client.CoreV1Api()
+server = OperatorServer(SERVER_PORT)
+REGISTRY.register(CacheCollector(owned_objects))
 
 
 @kopf.on.startup()
-def on_startup(settings: kopf.OperatorSettings, logger: kopf.Logger, **_):
+async def on_startup(settings: kopf.OperatorSettings, logger: kopf.Logger, **_):
     logger.info("Starting Locust Operator.")
 
     settings.watching.server_timeout = 120
@@ -39,13 +69,66 @@ def on_startup(settings: kopf.OperatorSettings, logger: kopf.Logger, **_):
     settings.posting.event_name_prefix = "locust-event"
 
     settings.persistence.finalizer = f"{LABEL_ANNOTATION_PREFIX}/kopf-finalizer"
-    settings.persistence.progress_storage = kopf.AnnotationsProgressStorage(
+    # Same annotations as without sharding, only written by the owner
+    settings.persistence.progress_storage = ShardProgressStorage(
         prefix=LABEL_ANNOTATION_PREFIX
     )
-    settings.persistence.diffbase_storage = kopf.AnnotationsDiffBaseStorage(
+    settings.persistence.diffbase_storage = ShardDiffBaseStorage(
         prefix=LABEL_ANNOTATION_PREFIX
     )
 
+    owned_objects.start()
+    stats_scheduler.start()
+    await server.start()
+    await shards.start()
+    if admission.enabled:
+        await load_admissions(logger)
+
+
+async def load_admissions(logger: kopf.Logger):
+    """Fill the admission ledger before any handler runs, so queued tests
+    aren't admitted ahead of the events of the already admitted ones.
+    """
+    custom = client.CustomObjectsApi(api_client())
+    if WATCH_NAMESPACE:
+        objs = await call(
+            custom.list_namespaced_custom_object,
+            GROUP,
+            VERSION,
+            WATCH_NAMESPACE,
+            PLURAL,
+        )
+    else:
+        objs = await call(custom.list_cluster_custom_object, GROUP, VERSION, PLURAL)
+
+    for obj in objs["items"]:
+        metadata = obj["metadata"]
+        LocustTest(
+            metadata["name"],
+            metadata["namespace"],
+            kopf.Body(obj),
+            kopf.Patch(),
+            logger,
+        ).observe_admission()
+
+
+async def on_shard_change():
+    stats_scheduler.retain(shards.owns)
+    await shards.take_over()
+
+
+shards.on_change(on_shard_change)
+
+
+@kopf.on.cleanup()
+async def on_cleanup(logger: kopf.Logger, **_):
+    logger.info("Stopping Locust Operator.")
+    await shards.stop()
+    owned_objects.stop()
+    await stats_scheduler.stop()
+    await stats_client.close()
+    await server.stop()
+
 
 @kopf.on.probe(id="now")
 def get_current_timestamp(logger: kopf.Logger, **_) -> str:
@@ -53,48 +136,132 @@ def get_current_timestamp(logger: kopf.Logger, **_) -> str:
     return datetime.datetime.now(datetime.timezone.utc).isoformat()
 
 
-@kopf.on.create(LOCUST_TEST_RESOURCE)
-def on_create(
+@kopf.on.probe(id="cache")
+def get_cache_stats(**_) -> dict:
+    return owned_objects.stats()
+
+
+@kopf.on.probe(id="reconcile_queue")
+def get_reconcile_queue_stats(**_) -> dict:
+    return reconcile_queue.stats()
+
+
+@kopf.on.create(LOCUST_TEST_RESOURCE, when=owns_object)
+async def on_create(
     name,
     namespace,
     patch: kopf.Patch,
     body: kopf.Body,
     logger: kopf.Logger,
+    retry: int,
     **_,
 ):
     logger.info(f"Initializing LocustTest name={name} namespace={namespace}")
 
     locust_test = LocustTest(name, namespace, body, patch, logger)
-    locust_test.reconcile()
+    async with reconcile_queue.slot(Priority.CREATE):
+        await locust_test.reconcile(retry=retry)
 
 
-@kopf.on.update(LOCUST_TEST_RESOURCE)
-def on_update(
+@kopf.on.update(LOCUST_TEST_RESOURCE, when=owns_object)
+async def on_update(
     name,
     namespace,
     patch: kopf.Patch,
     body: kopf.Body,
     logger: kopf.Logger,
     diff: kopf.Diff,
+    retry: int,
     **_,
 ):
     logger.info(f"Updating LocustTest name={name} namespace={namespace}")
 
     locust_test = LocustTest(name, namespace, body, patch, logger)
-    locust_test.reconcile(diff)
+    async with reconcile_queue.slot(Priority.UPDATE):
+        await locust_test.reconcile(diff, retry=retry)
 
 
-@kopf.daemon(LOCUST_TEST_RESOURCE, initial_delay=5.0)
-async def stats_daemon(
+# Existing tests on startup, after the creates and edits waiting with them
+@kopf.on.resume(LOCUST_TEST_RESOURCE, when=owns_object)
+async def on_resume(
     name,
     namespace,
     patch: kopf.Patch,
     body: kopf.Body,
     logger: kopf.Logger,
-    stopped: kopf.DaemonStopped,
+    retry: int,
     **_,
 ):
-    logger.debug("Starting daemon for resource")
+    logger.debug(f"Resuming LocustTest name={name} namespace={namespace}")
 
     locust_test = LocustTest(name, namespace, body, patch, logger)
-    await locust_test.stats_daemon(stopped)
+    async with reconcile_queue.slot(Priority.RESUME):
+        await locust_test.reconcile(retry=retry)
+
+
+# Async to run on the loop of the scheduler, which it changes
+@kopf.on.event(LOCUST_TEST_RESOURCE)
+async def track_stats(
+    name,
+    namespace,
+    type,
+    patch: kopf.Patch,
+    body: kopf.Body,
+    logger: kopf.Logger,
+    **_,
+):
+    if type == "DELETED" or body.metadata.get("deletionTimestamp"):
+        admission.forget(namespace, name)
+        stats_scheduler.remove(namespace, name)
+        return
+
+    locust_test = LocustTest(name, namespace, body, patch, logger)
+    if admission.enabled:
+        # Every replica accounts for the tests of the others
+        locust_test.observe_admission()
+
+    if not shards.owns(namespace, name) or body.status.get("state") == QUEUED:
+        stats_scheduler.remove(namespace, name)
+        return
+
+    stats_scheduler.upsert(locust_test)
+
+
+@kopf.on.create(LOCUST_WORKER_POOL_RESOURCE, when=owns_object)
+@kopf.on.update(LOCUST_WORKER_POOL_RESOURCE, when=owns_object)
+@kopf.on.resume(LOCUST_WORKER_POOL_RESOURCE, when=owns_object)
+async def on_pool_change(
+    name,
+    namespace,
+    spec: kopf.Spec,
+    patch: kopf.Patch,
+    body: kopf.Body,
+    logger: kopf.Logger,
+    reason: str,
+    **_,
+):
+    pool = WorkerPool(name, namespace, spec, logger)
+    async with reconcile_queue.slot(Priority.for_reason(reason)):
+        patch.status.update(await pool.refill(body))
+
+
+# Claims refill the pool right away, this catches standby pods that went away
+@kopf.timer(
+    LOCUST_WORKER_POOL_RESOURCE,
+    interval=POOL_REFILL_INTERVAL,
+    initial_delay=POOL_REFILL_INTERVAL,
+    when=owns_object,
+)
+async def refill_pool(
+    name,
+    namespace,
+    spec: kopf.Spec,
+    patch: kopf.Patch,
+    body: kopf.Body,
+    logger: kopf.Logger,
+    **_,
+):
+    # The timers of every pool start together on startup
+    await stagger_start(namespace, name, POOL_REFILL_INTERVAL)
+    pool = WorkerPool(name, namespace, spec, logger)
+    patch.status.update(await pool.refill(body))
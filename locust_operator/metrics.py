@@ -0,0 +1,227 @@
+import functools
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from stats import worker_pod_cpu
+from tracing import span
+
+TEST_LABELS = ["namespace", "test"]
+ENDPOINT_LABELS = [*TEST_LABELS, "method", "endpoint"]
+
+# Locust run stats, as reported by each master
+
+USERS = Gauge("locust_users", "Running locust users", TEST_LABELS)
+WORKERS = Gauge("locust_workers", "Connected locust workers", TEST_LABELS)
+WORKER_POD_CPU = Gauge(
+    "locust_worker_pod_cpu_percent",
+    "Average CPU usage of the locust processes of a worker pod",
+    [*TEST_LABELS, "pod"],
+)
+REQUESTS_PER_SECOND = Gauge(
+    "locust_requests_per_second", "Current requests per second", ENDPOINT_LABELS
+)
+FAILURES_PER_SECOND = Gauge(
+    "locust_failures_per_second", "Current failures per second", ENDPOINT_LABELS
+)
+FAILURE_RATIO = Gauge(
+    "locust_failure_ratio", "Ratio of failed requests", ENDPOINT_LABELS
+)
+RESPONSE_TIME = Gauge(
+    "locust_response_time_seconds",
+    "Response time percentiles as computed by locust",
+    [*ENDPOINT_LABELS, "quantile"],
+)
+
+# Operator internals
+
+RECONCILE_STEP_DURATION = Histogram(
+    "locust_operator_reconcile_step_duration_seconds",
+    "Duration of each reconcile step",
+    ["step"],
+)
+API_CALLS = Counter(
+    "locust_operator_api_calls_total",
+    "Kubernetes API calls made by the operator",
+    ["operation", "status"],
+)
+API_CALL_DURATION = Histogram(
+    "locust_operator_api_call_duration_seconds",
+    "Duration of kubernetes API calls",
+    ["operation"],
+)
+API_THROTTLED = Counter(
+    "locust_operator_api_throttled_total",
+    "Kubernetes API calls rejected with 429 and retried",
+    ["operation"],
+)
+API_RATE_LIMIT_WAIT = Histogram(
+    "locust_operator_api_rate_limit_wait_seconds",
+    "Time API calls waited for the client side rate limit",
+)
+RECONCILE_QUEUE_DEPTH = Gauge(
+    "locust_operator_reconcile_queue_depth",
+    "Reconciles waiting for their turn",
+    ["priority"],
+)
+ENSURE_RESULTS = Counter(
+    "locust_operator_ensure_results_total",
+    "Outcome of ensuring owned objects, unchanged ones avoided a write",
+    ["result"],
+)
+STATS_POLL_DURATION = Histogram(
+    "locust_operator_stats_poll_duration_seconds",
+    "Duration of fetching the stats of a locust master",
+)
+STATS_POLL_ERRORS = Counter(
+    "locust_operator_stats_poll_errors_total", "Failed stats polls"
+)
+
+TIME_TO_FIRST_REQUEST = Histogram(
+    "locust_operator_time_to_first_request_seconds",
+    "Time from the creation of a test to the first request of its workers",
+    ["warm"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300),
+)
+
+ADMISSION_WAIT = Histogram(
+    "locust_operator_admission_wait_seconds",
+    "Time tests waited in the admission queue",
+    buckets=(0, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+ADMISSION_QUEUED = Gauge(
+    "locust_operator_admission_queued_tests",
+    "Tests waiting in the admission queue",
+    ["scope"],
+)
+ADMISSION_UTILIZATION = Gauge(
+    "locust_operator_admission_utilization_ratio",
+    "Share of the admission budget requested by the admitted tests",
+    ["scope", "resource"],
+)
+
+_ENDPOINT_METRICS = (
+    REQUESTS_PER_SECOND,
+    FAILURES_PER_SECOND,
+    FAILURE_RATIO,
+)
+
+# Label values of the series exported for each test, so they can be dropped
+# when the test goes away.
+_endpoints: dict[tuple[str, str], set[tuple[str, str]]] = {}
+_quantiles: dict[tuple[str, str], set[tuple[str, str, str]]] = {}
+_pods: dict[tuple[str, str], set[str]] = {}
+
+
+def _quantile_of(key: str) -> str | None:
+    if key.startswith("response_time_percentile_"):
+        return key.removeprefix("response_time_percentile_")
+    return {
+        "median_response_time": "0.5",
+        "ninetieth_response_time": "0.9",
+        "ninety_ninth_response_time": "0.99",
+    }.get(key)
+
+
+def observe_stats(namespace: str, test: str, stats: dict):
+    """Export the payload of a master's stats/requests endpoint."""
+    key = (namespace, test)
+    USERS.labels(namespace, test).set(stats.get("user_count", 0))
+    WORKERS.labels(namespace, test).set(
+        stats.get("worker_count", len(stats.get("workers", [])))
+    )
+
+    pod_cpu = worker_pod_cpu(stats.get("workers", []))
+    for pod in _pods.get(key, set()) - pod_cpu.keys():
+        WORKER_POD_CPU.remove(namespace, test, pod)
+    for pod, usage in pod_cpu.items():
+        WORKER_POD_CPU.labels(namespace, test, pod).set(usage)
+    _pods[key] = set(pod_cpu)
+
+    endpoints = _endpoints.setdefault(key, set())
+    quantiles = _quantiles.setdefault(key, set())
+    for entry in stats.get("stats", []):
+        endpoint = (entry.get("method") or "", entry.get("name", ""))
+        labels = (namespace, test, *endpoint)
+        endpoints.add(endpoint)
+
+        num_requests = entry.get("num_requests", 0)
+        REQUESTS_PER_SECOND.labels(*labels).set(entry.get("current_rps", 0))
+        FAILURES_PER_SECOND.labels(*labels).set(entry.get("current_fail_per_sec", 0))
+        FAILURE_RATIO.labels(*labels).set(
+            entry.get("num_failures", 0) / num_requests if num_requests else 0
+        )
+
+        for field, value in entry.items():
+            quantile = _quantile_of(field)
+            if quantile is None or value is None:
+                continue
+            quantiles.add((*endpoint, quantile))
+            RESPONSE_TIME.labels(*labels, quantile).set(value / 1000)
+
+
+def forget_test(namespace: str, test: str):
+    key = (namespace, test)
+    for gauge in (USERS, WORKERS):
+        try:
+            gauge.remove(namespace, test)
+        except KeyError:
+            pass
+    for endpoint in _endpoints.pop(key, ()):
+        for gauge in _ENDPOINT_METRICS:
+            try:
+                gauge.remove(namespace, test, *endpoint)
+            except KeyError:
+                pass
+    for pod in _pods.pop(key, ()):
+        try:
+            WORKER_POD_CPU.remove(namespace, test, pod)
+        except KeyError:
+            pass
+    for labels in _quantiles.pop(key, ()):
+        try:
+            RESPONSE_TIME.remove(namespace, test, *labels)
+        except KeyError:
+            pass
+
+
+def timed_step(fn):
+    """Record the duration of a reconcile step, named after the method, and
+    trace it when part of a reconcile.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = time.monotonic()
+        try:
+            with span(fn.__name__):
+                return await fn(*args, **kwargs)
+        finally:
+            RECONCILE_STEP_DURATION.labels(fn.__name__).observe(time.monotonic() - t0)
+
+    return wrapper
+
+
+class CacheCollector:
+    """Exports the hit and miss counters of the owned objects cache."""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "locust_operator_cache_hits", "Owned objects cache hits", labels=["kind"]
+        )
+        misses = CounterMetricFamily(
+            "locust_operator_cache_misses",
+            "Owned objects cache misses, served by the API server",
+            labels=["kind"],
+        )
+        objects = GaugeMetricFamily(
+            "locust_operator_cache_objects", "Cached owned objects", labels=["kind"]
+        )
+        for kind, stats in self._cache.stats().items():
+            hits.add_metric([kind], stats["hits"])
+            misses.add_metric([kind], stats["misses"])
+            objects.add_metric([kind], stats["objects"])
+        yield from (hits, misses, objects)
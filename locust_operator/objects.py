@@ -1,13 +1,69 @@
+import asyncio
+import base64
+import collections
+import contextvars
+import copy
+import functools
+import hashlib
+import itertools
+import json
 import shlex
-from typing import TypedDict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, TypedDict
 
 import kopf
+from constants import (
+    API_MAX_RETRIES,
+    API_MAX_WORKERS,
+    FIELD_MANAGER,
+    FINISHED_MASTER_TTL,
+    LABEL_ANNOTATION_PREFIX,
+    SERVER_SIDE_APPLY,
+)
 from kubernetes import client
+from metrics import (
+    API_CALL_DURATION,
+    API_CALLS,
+    API_RATE_LIMIT_WAIT,
+    API_THROTTLED,
+    ENSURE_RESULTS,
+)
+from ratelimit import api_rate_limit, retry_delay
+from tracing import span
 
 MASTER_P1_PORT_NAME = "master-p1"
 MASTER_P2_PORT_NAME = "master-p2"
 MASTER_WEB_PORT_NAME = "master-web"
 LOCUST_BASE_PATH = "/home/locust"
+BUNDLE_KEY = "bundle.tar.gz"
+BUNDLE_MOUNT_PATH = "/bundle"
+# Total size of data and binaryData the API server accepts in a ConfigMap
+CONFIGMAP_MAX_SIZE = 1024 * 1024
+
+# Workers started before their master listens crash and are restarted with
+# the kubelet backoff, so they wait for the master service to accept
+# connections, which it only does once the master is ready.
+WAIT_FOR_MASTER_SCRIPT = """\
+import socket, sys, time
+host, port = sys.argv[1], int(sys.argv[2])
+while True:
+    try:
+        socket.create_connection((host, port), timeout=2).close()
+        break
+    except OSError:
+        time.sleep(0.5)
+"""
+
+SPEC_HASH_ANNOTATION = f"{LABEL_ANNOTATION_PREFIX}/spec-hash"
+
+HOSTNAME_TOPOLOGY_KEY = "kubernetes.io/hostname"
+ZONE_TOPOLOGY_KEY = "topology.kubernetes.io/zone"
+
+EnsureResult = Literal["created", "patched", "applied", "unchanged"]
+
+# Totals over the lifetime of the operator, keyed by EnsureResult
+ensure_results: collections.Counter[str] = collections.Counter()
 
 
 class ServicePort(TypedDict):
@@ -16,9 +72,56 @@ class ServicePort(TypedDict):
     target_port: int | str
 
 
-def exists(read) -> bool:
+# The kubernetes client is blocking, so API calls run on a dedicated pool
+# instead of pinning a kopf executor thread for the whole reconcile.
+_api_executor = ThreadPoolExecutor(
+    max_workers=API_MAX_WORKERS, thread_name_prefix="k8s-api"
+)
+
+
+async def call(fn, *args, **kwargs):
+    """Run an API call on the API pool, within the client side rate limit.
+
+    Calls rejected with 429 are retried after the Retry-After delay, which
+    holds every other call as well.
+    """
+    operation = getattr(fn, "func", fn).__name__
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    with span(operation, retries=0) as call_span:
+        for attempt in itertools.count():
+            waited = await api_rate_limit.acquire()
+            if waited:
+                API_RATE_LIMIT_WAIT.observe(waited)
+
+            status = "ok"
+            t0 = time.monotonic()
+            try:
+                return await loop.run_in_executor(
+                    _api_executor, functools.partial(ctx.run, fn, *args, **kwargs)
+                )
+            except client.ApiException as e:
+                status = str(e.status)
+                if e.status != 429 or attempt >= API_MAX_RETRIES:
+                    raise
+                delay = retry_delay(e, attempt)
+            finally:
+                API_CALL_DURATION.labels(operation).observe(time.monotonic() - t0)
+                API_CALLS.labels(operation, status).inc()
+                if call_span is not None:
+                    call_span.attributes["status"] = status
+
+            API_THROTTLED.labels(operation).inc()
+            if call_span is not None:
+                call_span.attributes["retries"] = attempt + 1
+            api_rate_limit.pause(delay)
+
+
+async def exists(read, lookup=None) -> bool:
+    if lookup is not None and lookup() is not None:
+        return True
     try:
-        read()
+        await call(read)
         return True
     except client.ApiException as e:
         if e.status == 404:
@@ -26,23 +129,207 @@ def exists(read) -> bool:
         raise
 
 
-def ensure(create, read, patch, desired):
+_serializer = client.ApiClient()
+
+
+def spec_hash(obj) -> str:
+    serialized = _serializer.sanitize_for_serialization(obj)
+    metadata = serialized.get("metadata", {})
+    annotations = metadata.get("annotations", {})
+    annotations.pop(SPEC_HASH_ANNOTATION, None)
+    if not annotations:
+        metadata.pop("annotations", None)
+    content = json.dumps(serialized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def set_spec_hash(obj) -> str:
+    digest = spec_hash(obj)
+    obj.metadata.annotations = {
+        **(obj.metadata.annotations or {}),
+        SPEC_HASH_ANNOTATION: digest,
+    }
+    return digest
+
+
+def get_spec_hash(obj) -> str | None:
+    return (obj.metadata.annotations or {}).get(SPEC_HASH_ANNOTATION)
+
+
+_api_client: client.ApiClient | None = None
+_apply_client: client.ApiClient | None = None
+
+
+def new_api_client() -> client.ApiClient:
+    configuration = client.Configuration.get_default_copy()
+    # One connection per API thread so they can all be kept alive
+    configuration.connection_pool_maxsize = API_MAX_WORKERS
+    return client.ApiClient(configuration)
+
+
+def api_client() -> client.ApiClient:
+    """Client shared by all tests so connections to the API server are reused."""
+    global _api_client
+    if _api_client is None:
+        _api_client = new_api_client()
+    return _api_client
+
+
+def apply_client() -> client.ApiClient:
+    """Client whose patches are sent as server-side apply requests."""
+    global _apply_client
+    if _apply_client is None:
+        _apply_client = new_api_client()
+        # The generated API methods always pick a merge patch content type,
+        # default headers take precedence over it.
+        _apply_client.set_default_header("Content-Type", "application/apply-patch+yaml")
+    return _apply_client
+
+
+def check_not_terminating(existing):
+    # If marked for deletion, wait until it’s gone
+    if existing.metadata.deletion_timestamp:
+        raise kopf.TemporaryError(
+            f"{existing.metadata.name} is terminating...",
+            delay=2,
+        )
+
+
+def is_unchanged(existing, digest: str) -> bool:
+    check_not_terminating(existing)
+
+    # Rendered exactly like last time, nothing to write
+    return get_spec_hash(existing) == digest
+
+
+async def ensure(
+    create, read, patch, desired, lookup=None, apply=None, mutable=None
+) -> EnsureResult:
+    """Create or patch desired. When given, lookup is tried before read to
+    get the existing object without an API call, None means unknown. With
+    server-side apply enabled, apply replaces read, create and patch.
+
+    mutable builds the patch of the fields that can still change, used when
+    the API server refuses desired because it changes immutable fields: the
+    existing object is kept as it is otherwise.
+    """
     # TODO: validate if the existing resource owned by the CR before patching
-    try:
-        existing = read()
+    digest = set_spec_hash(desired)
+    existing = lookup() if lookup is not None else None
 
-        # If marked for deletion, wait until it’s gone
-        if existing.metadata.deletion_timestamp:
-            raise kopf.TemporaryError(
-                f"{existing.metadata.name} is terminating...",
-                delay=2,
+    if SERVER_SIDE_APPLY and apply is not None:
+        if existing is not None and is_unchanged(existing, digest):
+            result = "unchanged"
+        else:
+            applied = await _write(
+                apply, patch, desired, mutable, field_manager=FIELD_MANAGER, force=True
             )
+            if existing is None:
+                # Not looked at before, the apply may have landed on an
+                # object being deleted and would be lost with it
+                check_not_terminating(applied)
+            result = "applied"
+
+        ensure_results[result] += 1
+        ENSURE_RESULTS.labels(result).inc()
+        return result
+
+    try:
+        if existing is None:
+            existing = await call(read)
 
-        return patch(desired)
+        if is_unchanged(existing, digest):
+            result = "unchanged"
+        else:
+            await _write(patch, patch, desired, mutable)
+            result = "patched"
     except client.ApiException as e:
-        if e.status == 404:
-            return create(desired)
-        raise
+        if e.status != 404:
+            raise
+        try:
+            await call(create, desired)
+            result = "created"
+        except client.ApiException as e:
+            # Created concurrently since we looked
+            if e.status != 409:
+                raise
+            await _write(patch, patch, desired, mutable)
+            result = "patched"
+
+    ensure_results[result] += 1
+    ENSURE_RESULTS.labels(result).inc()
+    return result
+
+
+async def _write(write, patch, desired, mutable, **kwargs):
+    try:
+        return await call(write, desired, **kwargs)
+    except client.ApiException as e:
+        if e.status != 422 or mutable is None:
+            raise
+        return await call(patch, mutable(desired))
+
+
+def job_mutable_fields(job: client.V1Job) -> dict:
+    """Patch of what can change on an existing job, its pod template can't."""
+    return {
+        "metadata": {
+            "annotations": job.metadata.annotations,
+            "labels": job.metadata.labels,
+        },
+        "spec": {"parallelism": job.spec.parallelism},
+    }
+
+
+async def ensure_shared(create, read, patch, desired, lookup=None) -> EnsureResult:
+    """Create desired, or add its owner reference to the existing object.
+
+    Shared objects are named after their content so they are never patched
+    otherwise. Owner references are added with a strategic merge patch, keyed
+    by uid, so concurrent owners don't drop each other's references as they
+    would with server-side apply under a single field manager.
+    """
+    (owner,) = desired.metadata.owner_references
+    existing = lookup() if lookup is not None else None
+
+    try:
+        if existing is None:
+            existing = await call(read)
+        check_not_terminating(existing)
+
+        if any(
+            ref.uid == owner.uid for ref in existing.metadata.owner_references or ()
+        ):
+            result = "unchanged"
+        else:
+            await call(patch, _owner_patch(owner))
+            result = "patched"
+    except client.ApiException as e:
+        if e.status != 404:
+            raise
+        try:
+            await call(create, desired)
+            result = "created"
+        except client.ApiException as e:
+            # Another test created it since we looked
+            if e.status != 409:
+                raise
+            await call(patch, _owner_patch(owner))
+            result = "patched"
+
+    ensure_results[result] += 1
+    ENSURE_RESULTS.labels(result).inc()
+    return result
+
+
+def _owner_patch(owner: client.V1OwnerReference) -> dict:
+    return {
+        "metadata": {"ownerReferences": [_serializer.sanitize_for_serialization(owner)]}
+    }
+
+
+def bundle_configmap_name(content: bytes) -> str:
+    return f"locust-bundle-{hashlib.sha256(content).hexdigest()[:16]}"
 
 
 def build_configmap(
@@ -54,6 +341,8 @@ def build_configmap(
     labels: dict[str, str],
 ) -> client.V1ConfigMap:
     return client.V1ConfigMap(
+        api_version="v1",
+        kind="ConfigMap",
         metadata=client.V1ObjectMeta(
             annotations=annotations,
             labels=labels,
@@ -63,6 +352,50 @@ def build_configmap(
     )
 
 
+def build_results_configmap(
+    *,
+    name: str,
+    files: dict[str, bytes],
+    annotations: dict[str, str],
+    labels: dict[str, str],
+) -> client.V1ConfigMap:
+    return client.V1ConfigMap(
+        api_version="v1",
+        kind="ConfigMap",
+        metadata=client.V1ObjectMeta(
+            annotations=annotations,
+            labels=labels,
+            name=name,
+        ),
+        binary_data={
+            filename: base64.b64encode(content).decode()
+            for filename, content in files.items()
+        },
+    )
+
+
+def build_bundle_configmap(
+    *,
+    name: str,
+    content: bytes,
+    annotations: dict[str, str],
+    labels: dict[str, str],
+) -> client.V1ConfigMap:
+    return client.V1ConfigMap(
+        api_version="v1",
+        kind="ConfigMap",
+        metadata=client.V1ObjectMeta(
+            annotations=annotations,
+            labels=labels,
+            name=name,
+        ),
+        binary_data={BUNDLE_KEY: base64.b64encode(content).decode()},
+        # Named after the content, so it never changes and kubelets don't
+        # have to watch it.
+        immutable=True,
+    )
+
+
 def build_service(
     *,
     name: str,
@@ -73,6 +406,8 @@ def build_service(
     type: str = "ClusterIP",
 ) -> client.V1Service:
     return client.V1Service(
+        api_version="v1",
+        kind="Service",
         metadata=client.V1ObjectMeta(
             name=name,
             annotations=annotations,
@@ -86,21 +421,143 @@ def build_service(
     )
 
 
-def get_configmap_volume(
-    cm_name: str, volume_name: str = "locustfile"
-) -> tuple[client.V1Volume, client.V1VolumeMount]:
-    volume = client.V1Volume(
-        name=volume_name,
-        config_map=client.V1ConfigMapVolumeSource(name=cm_name),
-    )
+def get_locustfile_volumes(
+    cm_name: str | None,
+    bundle: bool,
+    image: str,
+    image_pull_policy: str | None,
+) -> tuple[list[client.V1Volume], list[client.V1VolumeMount], list[client.V1Container]]:
+    """Volumes and mounts of the locust container and the init containers
+    needed to provide the locustfile in LOCUST_BASE_PATH.
+    """
+    if cm_name is None:
+        return [], [], []
 
-    volume_mount = client.V1VolumeMount(
-        name=volume_name,
-        mount_path=LOCUST_BASE_PATH,
-        read_only=True,
+    if not bundle:
+        volume = client.V1Volume(
+            name="locustfile",
+            config_map=client.V1ConfigMapVolumeSource(name=cm_name),
+        )
+        volume_mount = client.V1VolumeMount(
+            name="locustfile",
+            mount_path=LOCUST_BASE_PATH,
+            read_only=True,
+        )
+        return [volume], [volume_mount], []
+
+    # The bundle is unpacked by an init container of the same image, so it
+    # only relies on python being there.
+    volumes = [
+        client.V1Volume(
+            name="locustfile-bundle",
+            config_map=client.V1ConfigMapVolumeSource(name=cm_name),
+        ),
+        client.V1Volume(name="locustfile", empty_dir=client.V1EmptyDirVolumeSource()),
+    ]
+    volume_mount = client.V1VolumeMount(name="locustfile", mount_path=LOCUST_BASE_PATH)
+    unpack = client.V1Container(
+        name="unpack-locustfile",
+        image=image,
+        image_pull_policy=image_pull_policy,
+        command=[
+            "python",
+            "-c",
+            "import sys, tarfile; "
+            "tarfile.open(sys.argv[1]).extractall(sys.argv[2], filter='data')",
+            f"{BUNDLE_MOUNT_PATH}/{BUNDLE_KEY}",
+            LOCUST_BASE_PATH,
+        ],
+        volume_mounts=[
+            client.V1VolumeMount(
+                name="locustfile-bundle", mount_path=BUNDLE_MOUNT_PATH, read_only=True
+            ),
+            volume_mount,
+        ],
     )
+    return volumes, [volume_mount], [unpack]
+
+
+def default_spread(labels: dict[str, str]) -> list[dict]:
+    """Spread the pods matching labels evenly over the nodes, then the zones,
+    as long as it doesn't leave any of them unscheduled.
+    """
+    return [
+        {
+            "maxSkew": 1,
+            "topologyKey": topology_key,
+            "whenUnsatisfiable": "ScheduleAnyway",
+            "labelSelector": {"matchLabels": labels},
+        }
+        for topology_key in (HOSTNAME_TOPOLOGY_KEY, ZONE_TOPOLOGY_KEY)
+    ]
+
+
+def with_anti_affinity(
+    affinity: dict | None, labels: dict[str, str], required: bool
+) -> dict:
+    """Copy of affinity keeping the pod off the nodes running pods matching
+    labels, or only preferring to.
+    """
+    term = {
+        "labelSelector": {"matchLabels": labels},
+        "topologyKey": HOSTNAME_TOPOLOGY_KEY,
+    }
+    affinity = copy.deepcopy(affinity or {})
+    anti_affinity = affinity.setdefault("podAntiAffinity", {})
+    if required:
+        anti_affinity.setdefault(
+            "requiredDuringSchedulingIgnoredDuringExecution", []
+        ).append(term)
+    else:
+        anti_affinity.setdefault(
+            "preferredDuringSchedulingIgnoredDuringExecution", []
+        ).append({"weight": 100, "podAffinityTerm": term})
+    return affinity
+
+
+def build_scheduling(
+    pod_spec: dict,
+    *,
+    spread: list[dict] | None = None,
+    avoid: dict[str, str] | None = None,
+    avoid_required: bool = False,
+) -> dict:
+    """Scheduling fields of a pod spec from its part of the LocustTest spec,
+    as V1PodSpec arguments. They are passed through in the API's format.
+
+    spread applies unless topologySpreadConstraints are given, the pods
+    matching avoid are kept off the same nodes on top of the given affinity.
+    """
+    affinity = pod_spec.get("affinity")
+    if avoid:
+        affinity = with_anti_affinity(affinity, avoid, avoid_required)
+    return {
+        "node_selector": pod_spec.get("nodeSelector"),
+        "tolerations": pod_spec.get("tolerations"),
+        "affinity": affinity,
+        "topology_spread_constraints": pod_spec.get(
+            "topologySpreadConstraints", spread
+        ),
+        "priority_class_name": pod_spec.get("priorityClassName"),
+    }
+
+
+_node_zones: dict[str, str | None] = {}
+
 
-    return volume, volume_mount
+async def get_node_zone(core: client.CoreV1Api, name: str) -> str | None:
+    """Zone of a node, remembered since it doesn't change. None when the
+    node has none or can't be read, without cluster wide RBAC.
+    """
+    if name not in _node_zones:
+        try:
+            node = await call(core.read_node, name)
+            _node_zones[name] = (node.metadata.labels or {}).get(ZONE_TOPOLOGY_KEY)
+        except client.ApiException as e:
+            if e.status not in (403, 404):
+                raise
+            _node_zones[name] = None
+    return _node_zones[name]
 
 
 def build_master_job(
@@ -110,6 +567,7 @@ def build_master_job(
     args: str,
     env: dict,
     cm_name: str | None,
+    bundle: bool,
     annotations: dict,
     labels: dict,
     pod_annotations: dict,
@@ -117,11 +575,11 @@ def build_master_job(
     pod_resources: dict,
     image_pull_policy: str | None,
     image_pull_secrets: list[dict[str, str]] | None,
+    scheduling: dict | None = None,
 ) -> client.V1Job:
-    if cm_name is not None:
-        volume, volume_mount = get_configmap_volume(cm_name)
-    else:
-        volume, volume_mount = None, None
+    volumes, volume_mounts, init_containers = get_locustfile_volumes(
+        cm_name, bundle, image, image_pull_policy
+    )
 
     container = client.V1Container(
         name="locust-master",
@@ -134,19 +592,29 @@ def build_master_job(
             client.V1ContainerPort(container_port=8089, name=MASTER_WEB_PORT_NAME),
         ],
         env=[client.V1EnvVar(**env_var) for env_var in env],
-        volume_mounts=[volume_mount],
+        volume_mounts=volume_mounts,
         resources=client.V1ResourceRequirements(**pod_resources),
+        # Out of the master service until workers can connect to it
+        readiness_probe=client.V1Probe(
+            tcp_socket=client.V1TCPSocketAction(port=MASTER_P1_PORT_NAME),
+            period_seconds=1,
+            failure_threshold=3,
+        ),
     )
 
     pod_meta = client.V1ObjectMeta(labels=pod_labels, annotations=pod_annotations)
     pod_spec = client.V1PodSpec(
         restart_policy="Never",
+        init_containers=init_containers,
         containers=[container],
-        volumes=[volume],
+        volumes=volumes,
         image_pull_secrets=image_pull_secrets,
+        **(scheduling or {}),
     )
 
     job = client.V1Job(
+        api_version="batch/v1",
+        kind="Job",
         metadata=client.V1ObjectMeta(
             name=name,
             annotations=annotations,
@@ -154,7 +622,7 @@ def build_master_job(
         ),
         spec=client.V1JobSpec(
             template=client.V1PodTemplateSpec(metadata=pod_meta, spec=pod_spec),
-            ttl_seconds_after_finished=0,
+            ttl_seconds_after_finished=FINISHED_MASTER_TTL,
             parallelism=1,
         ),
     )
@@ -169,7 +637,9 @@ def build_worker_job(
     env: dict,
     master_svc: str,
     worker_count: int,
+    processes: int,
     cm_name: str | None,
+    bundle: bool,
     annotations: dict,
     labels: dict,
     pod_annotations: dict,
@@ -177,31 +647,50 @@ def build_worker_job(
     pod_resources: dict,
     image_pull_policy: str | None,
     image_pull_secrets: list[dict[str, str]] | None,
+    scheduling: dict | None = None,
 ) -> client.V1Job:
-    if cm_name is not None:
-        volume, volume_mount = get_configmap_volume(cm_name)
-    else:
-        volume, volume_mount = None, None
+    volumes, volume_mounts, init_containers = get_locustfile_volumes(
+        cm_name, bundle, image, image_pull_policy
+    )
+
+    wait_for_master = client.V1Container(
+        name="wait-for-master",
+        image=image,
+        image_pull_policy=image_pull_policy,
+        command=["python", "-c", WAIT_FOR_MASTER_SCRIPT, master_svc, "5557"],
+    )
+    init_containers = [*init_containers, wait_for_master]
 
     container = client.V1Container(
         name="locust-worker",
         image=image,
         image_pull_policy=image_pull_policy,
-        args=["--worker", "--master-host", master_svc, *shlex.split(args)],
+        args=[
+            "--worker",
+            "--master-host",
+            master_svc,
+            # Forked workers, each connecting on its own and using a core
+            *(["--processes", str(processes)] if processes > 1 else []),
+            *shlex.split(args),
+        ],
         env=[client.V1EnvVar(**env_var) for env_var in env],
-        volume_mounts=[volume_mount],
+        volume_mounts=volume_mounts,
         resources=client.V1ResourceRequirements(**pod_resources),
     )
 
     pod_meta = client.V1ObjectMeta(labels=pod_labels, annotations=pod_annotations)
     pod_spec = client.V1PodSpec(
         restart_policy="OnFailure",
+        init_containers=init_containers,
         containers=[container],
-        volumes=[volume],
+        volumes=volumes,
         image_pull_secrets=image_pull_secrets,
+        **(scheduling or {}),
     )
 
     job = client.V1Job(
+        api_version="batch/v1",
+        kind="Job",
         metadata=client.V1ObjectMeta(
             name=name,
             annotations=annotations,
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+
+import kopf
+
+MASTER = "master"
+WORKERS = "workers"
+CONFIGMAP = "configmap"
+
+# Components to replace when a spec field changes. Pod templates of jobs
+# can't be patched so anything ending up in one needs a new job, locust
+# only reads the locustfile at startup so a new one needs new pods too.
+# Fields not listed here are patched in place, the most specific path of
+# a field applies.
+RESTART_COMPONENTS: dict[tuple[str, ...], frozenset[str]] = {
+    ("spec", "image"): frozenset({MASTER, WORKERS}),
+    ("spec", "imagePullPolicy"): frozenset({MASTER, WORKERS}),
+    ("spec", "imagePullSecrets"): frozenset({MASTER, WORKERS}),
+    ("spec", "args"): frozenset({MASTER, WORKERS}),
+    ("spec", "env"): frozenset({MASTER, WORKERS}),
+    ("spec", "locustfile"): frozenset({CONFIGMAP, MASTER, WORKERS}),
+    ("spec", "master"): frozenset({MASTER}),
+    # Also keeps the workers off the nodes of the master
+    ("spec", "master", "isolation"): frozenset({MASTER, WORKERS}),
+    ("spec", "worker"): frozenset({WORKERS}),
+}
+
+
+@dataclass(frozen=True)
+class RestartPlan:
+    components: frozenset[str] = frozenset()
+    fields: tuple[tuple[str, ...], ...] = ()
+
+    @property
+    def master(self) -> bool:
+        return MASTER in self.components
+
+    @property
+    def workers(self) -> bool:
+        return WORKERS in self.components
+
+    @property
+    def configmap(self) -> bool:
+        return CONFIGMAP in self.components
+
+    @property
+    def restart(self) -> bool:
+        return self.master or self.workers
+
+    def describe(self) -> str:
+        return " and ".join(
+            component for component in (MASTER, WORKERS) if component in self.components
+        )
+
+
+def plan_restart(diff: kopf.Diff | None) -> RestartPlan:
+    """Minimal set of components to replace for the changes in diff."""
+    components: set[str] = set()
+    fields = []
+    for _, path, _, _ in diff or ():
+        path = tuple(path)
+        if not path or path[0] != "spec":
+            continue
+
+        changed = _restarted_by(path)
+
+        if changed:
+            components |= changed
+            fields.append(path)
+
+    return RestartPlan(frozenset(components), tuple(fields))
+
+
+def _restarted_by(path: tuple[str, ...]) -> frozenset[str]:
+    """Components to replace for a change at path, along with the fields
+    within it when a whole part of the spec was replaced.
+    """
+    changed = frozenset()
+    for length in range(len(path), 1, -1):
+        if path[:length] in RESTART_COMPONENTS:
+            changed = RESTART_COMPONENTS[path[:length]]
+            break
+    return changed.union(
+        *(
+            components
+            for field, components in RESTART_COMPONENTS.items()
+            if len(field) > len(path) and field[: len(path)] == path
+        )
+    )
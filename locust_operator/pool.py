@@ -0,0 +1,322 @@
+import asyncio
+import logging
+
+import kopf
+from constants import GROUP, LABEL_ANNOTATION_PREFIX, POOL_PLURAL, VERSION
+from kubernetes import client
+from kubernetes.utils import parse_quantity
+from objects import api_client, call, to_label_selector_string
+
+POOL_LABEL = f"{LABEL_ANNOTATION_PREFIX}/worker-pool"
+POOL_STATE_LABEL = f"{LABEL_ANNOTATION_PREFIX}/pool-state"
+MASTER_HOST_ANNOTATION = f"{LABEL_ANNOTATION_PREFIX}/master-host"
+
+STANDBY = "standby"
+CLAIMED = "claimed"
+
+CLAIM_PATH = "/etc/locust-claim"
+
+# Started ahead of any test, locust is imported right away so a claimed pod
+# only has to connect. The master host shows up in the downward API volume
+# once the pod is annotated with it, the locustfile is sent by the master.
+# Like the workers of a job, it doesn't connect before the master is ready.
+STANDBY_SCRIPT = f"""\
+import os, socket, sys, time
+from locust.main import main
+
+path = "{CLAIM_PATH}/master-host"
+while not os.path.exists(path) or not os.path.getsize(path):
+    time.sleep(0.2)
+with open(path) as f:
+    master_host = f.read().strip()
+while True:
+    try:
+        socket.create_connection((master_host, 5557), timeout=2).close()
+        break
+    except OSError:
+        time.sleep(0.5)
+sys.argv = ["locust", "--worker", "--master-host", master_host, "-f", "-"]
+sys.exit(main())
+"""
+
+logger = logging.getLogger(__name__)
+
+# Pools being refilled in the background, keyed by (namespace, name)
+_refills: dict[tuple[str, str], asyncio.Task] = {}
+
+
+def _json_pointer(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def build_standby_pod(
+    *,
+    pool: str,
+    image: str,
+    image_pull_policy: str | None,
+    image_pull_secrets: list[dict[str, str]] | None,
+    resources: dict,
+    labels: dict[str, str],
+    annotations: dict[str, str],
+) -> client.V1Pod:
+    container = client.V1Container(
+        name="locust-worker",
+        image=image,
+        image_pull_policy=image_pull_policy,
+        command=["python", "-c", STANDBY_SCRIPT],
+        volume_mounts=[client.V1VolumeMount(name="claim", mount_path=CLAIM_PATH)],
+        resources=client.V1ResourceRequirements(**resources),
+    )
+    claim_volume = client.V1Volume(
+        name="claim",
+        downward_api=client.V1DownwardAPIVolumeSource(
+            items=[
+                client.V1DownwardAPIVolumeFile(
+                    path="master-host",
+                    field_ref=client.V1ObjectFieldSelector(
+                        field_path=f"metadata.annotations['{MASTER_HOST_ANNOTATION}']"
+                    ),
+                )
+            ]
+        ),
+    )
+    return client.V1Pod(
+        api_version="v1",
+        kind="Pod",
+        metadata=client.V1ObjectMeta(
+            generate_name=f"{pool}-",
+            annotations=annotations,
+            labels=labels,
+        ),
+        spec=client.V1PodSpec(
+            restart_policy="Never",
+            containers=[container],
+            volumes=[claim_volume],
+            image_pull_secrets=image_pull_secrets,
+        ),
+    )
+
+
+def is_available(pod: client.V1Pod, image: str) -> bool:
+    """Standby pod already running the image, ready to be claimed."""
+    return (
+        pod.metadata.deletion_timestamp is None
+        and pod.status is not None
+        and pod.status.phase == "Running"
+        and pod.spec.containers[0].image == image
+    )
+
+
+def _quantities(resources: dict) -> tuple[dict, dict]:
+    limits = resources.get("limits") or {}
+    # Requests default to the limits, as the API server does
+    requests = {**limits, **(resources.get("requests") or {})}
+    return tuple(
+        {name: parse_quantity(value) for name, value in values.items()}
+        for values in (requests, limits)
+    )
+
+
+def has_resources(pod: client.V1Pod, resources: dict) -> bool:
+    """Standby pod started with the resources a worker of the test gets."""
+    existing = pod.spec.containers[0].resources
+    existing = {
+        "requests": existing.requests if existing else None,
+        "limits": existing.limits if existing else None,
+    }
+    return _quantities(existing) == _quantities(resources)
+
+
+class WorkerPool:
+    """Standby locust workers of one image, kept at spec.size pods."""
+
+    def __init__(self, name: str, namespace: str, spec: dict, logger: kopf.Logger):
+        self.name = name
+        self.namespace = namespace
+        self.spec = spec
+
+        self._logger = logger
+        self._core = client.CoreV1Api(api_client())
+
+    def get_labels(self) -> dict[str, str]:
+        return {
+            "app.kubernetes.io/name": "locust",
+            "app.kubernetes.io/managed-by": "locust-operator",
+            f"{LABEL_ANNOTATION_PREFIX}/component": "worker",
+            POOL_LABEL: self.name,
+            POOL_STATE_LABEL: STANDBY,
+            **self.spec.get("labels", {}),
+        }
+
+    async def list_standby(self) -> list[client.V1Pod]:
+        pods = await call(
+            self._core.list_namespaced_pod,
+            self.namespace,
+            label_selector=to_label_selector_string(
+                {POOL_LABEL: self.name, POOL_STATE_LABEL: STANDBY}
+            ),
+        )
+        return [pod for pod in pods.items if pod.metadata.deletion_timestamp is None]
+
+    async def refill(self, owner: dict) -> dict[str, int]:
+        """Create the standby pods missing from the pool, returns its status.
+
+        owner is the pool's body, the standby pods belong to it until claimed.
+        """
+        image = self.spec.get("image", "")
+        standby = []
+        for pod in await self.list_standby():
+            if (
+                pod.status and pod.status.phase in ("Succeeded", "Failed")
+            ) or pod.spec.containers[0].image != image:
+                # Exited before being claimed or started from a previous
+                # image, replaced like a missing one
+                await self.delete_pod(pod.metadata.name)
+            else:
+                standby.append(pod)
+        missing = self.spec.get("size", 0) - len(standby)
+
+        if missing > 0:
+            self._logger.info(f"Adding {missing} standby workers to pool {self.name}")
+            await asyncio.gather(*(self.create_pod(owner) for _ in range(missing)))
+        elif missing < 0:
+            # Shrunk, the pods that aren't running yet are the cheapest to lose
+            standby.sort(
+                key=lambda pod: bool(pod.status) and pod.status.phase == "Running"
+            )
+            await asyncio.gather(
+                *(self.delete_pod(pod.metadata.name) for pod in standby[:-missing])
+            )
+
+        return {"ready": sum(is_available(pod, image) for pod in standby)}
+
+    async def create_pod(self, owner: dict):
+        pod = build_standby_pod(
+            pool=self.name,
+            image=self.spec.get("image", ""),
+            image_pull_policy=self.spec.get("imagePullPolicy"),
+            image_pull_secrets=self.spec.get("imagePullSecrets"),
+            resources=self.spec.get("resources", {}),
+            labels=self.get_labels(),
+            annotations=self.spec.get("annotations", {}),
+        )
+        kopf.adopt(pod, owner=owner)
+        await call(self._core.create_namespaced_pod, self.namespace, pod)
+
+    async def delete_pod(self, name: str):
+        try:
+            await call(self._core.delete_namespaced_pod, name, self.namespace)
+        except client.ApiException as e:
+            if e.status != 404:
+                raise
+
+
+async def claim_workers(
+    *,
+    pool: str,
+    namespace: str,
+    image: str,
+    resources: dict,
+    count: int,
+    owner: kopf.Body,
+    labels: dict[str, str],
+    master_host: str,
+) -> list[str]:
+    """Hand over up to count standby workers of the pool to owner, returns
+    the names of the claimed pods. Only pods with the image and the worker
+    resources of the test are claimed.
+
+    Each claim is a JSON patch conditioned on the pod still being on
+    standby, so concurrent tests never get the same pod.
+    """
+    core = client.CoreV1Api(api_client())
+    pods = await call(
+        core.list_namespaced_pod,
+        namespace,
+        label_selector=to_label_selector_string(
+            {POOL_LABEL: pool, POOL_STATE_LABEL: STANDBY}
+        ),
+    )
+    candidates = [
+        pod
+        for pod in pods.items
+        if is_available(pod, image) and has_resources(pod, resources)
+    ][:count]
+    if not candidates:
+        return []
+
+    owner_reference = kopf.build_owner_reference(owner, controller=False)
+    state_path = f"/metadata/labels/{_json_pointer(POOL_STATE_LABEL)}"
+    claim = [
+        {"op": "test", "path": state_path, "value": STANDBY},
+        {"op": "replace", "path": state_path, "value": CLAIMED},
+        *(
+            {
+                "op": "add",
+                "path": f"/metadata/labels/{_json_pointer(key)}",
+                "value": value,
+            }
+            for key, value in labels.items()
+        ),
+        {
+            "op": "add",
+            "path": f"/metadata/annotations/{_json_pointer(MASTER_HOST_ANNOTATION)}",
+            "value": master_host,
+        },
+        # Collected with the test from now on, no longer with the pool
+        {
+            "op": "replace",
+            "path": "/metadata/ownerReferences",
+            "value": [owner_reference],
+        },
+    ]
+
+    async def claim_one(pod: client.V1Pod) -> str | None:
+        patch = claim
+        if pod.metadata.annotations is None:
+            patch = [
+                claim[0],
+                {"op": "add", "path": "/metadata/annotations", "value": {}},
+                *claim[1:],
+            ]
+        try:
+            await call(core.patch_namespaced_pod, pod.metadata.name, namespace, patch)
+        except client.ApiException as e:
+            # Claimed or deleted since it was listed
+            if e.status not in (404, 409, 422):
+                raise
+            return None
+        return pod.metadata.name
+
+    claimed = [
+        name for name in await asyncio.gather(*map(claim_one, candidates)) if name
+    ]
+    if claimed:
+        schedule_refill(namespace, pool)
+    return claimed
+
+
+def schedule_refill(namespace: str, pool: str):
+    """Refill the pool in the background, without waiting for its timer."""
+    key = (namespace, pool)
+    if key in _refills:
+        return
+    task = asyncio.create_task(_refill(namespace, pool))
+    _refills[key] = task
+    task.add_done_callback(lambda _: _refills.pop(key, None))
+
+
+async def _refill(namespace: str, name: str):
+    custom = client.CustomObjectsApi(api_client())
+    try:
+        body = await call(
+            custom.get_namespaced_custom_object,
+            GROUP,
+            VERSION,
+            namespace,
+            POOL_PLURAL,
+            name,
+        )
+        await WorkerPool(name, namespace, body.get("spec", {}), logger).refill(body)
+    except Exception:
+        logger.exception(f"Failed to refill worker pool {namespace}/{name}")
@@ -0,0 +1,73 @@
+import asyncio
+import email.utils
+import time
+
+from constants import API_BURST, API_QPS
+from kubernetes import client
+
+# Backoff of the 429 responses without a usable Retry-After header
+MIN_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+
+
+class TokenBucket:
+    """Allows rate calls per second on average and bursts of up to burst calls.
+
+    Tokens are reserved rather than waited for under a lock, a call that finds
+    the bucket empty takes a token in advance and sleeps until it is due, so
+    waiting calls go out in order. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Take a token, returns how long to wait before using it."""
+        now = self._clock()
+        wait = max(self._paused_until - now, 0)
+        if self.rate > 0:
+            elapsed = max(now - self._updated, 0)
+            self._tokens = min(self._tokens + elapsed * self.rate, self.burst)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(wait, -self._tokens / self.rate)
+        return wait
+
+    def pause(self, seconds: float):
+        """Hold every call for seconds, as asked by the API server."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        # No burst of the tokens saved up while paused
+        self._tokens = min(self._tokens, 0)
+
+    async def acquire(self) -> float:
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def retry_delay(error: client.ApiException, attempt: int) -> float:
+    """Delay before retrying a throttled call, from its Retry-After header
+    in seconds or as a date, else an exponential backoff.
+    """
+    value = (error.headers or {}).get("Retry-After")
+    if value:
+        try:
+            return min(max(float(value), 0), MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            return min(max(date.timestamp() - time.time(), 0), MAX_RETRY_DELAY)
+    return min(MIN_RETRY_DELAY * 2**attempt, MAX_RETRY_DELAY)
+
+
+api_rate_limit = TokenBucket(API_QPS, API_BURST)
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from constants import STATS_IDLE_INTERVAL, STATS_MAX_IN_FLIGHT
+from controller import LocustTest
+from history import history
+from metrics import STATS_POLL_ERRORS, forget_test
+from stats import PollState
+from workqueue import stagger
+
+# Locust states in which the stats change and are worth polling at the
+# configured interval, anything else is polled at STATS_IDLE_INTERVAL.
+ACTIVE_STATES = {"spawning", "running"}
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class ScheduledTest:
+    test: LocustTest
+    interval: float
+    consecutive_errors: int = 0
+    state: str = ""
+    poll: PollState = field(default_factory=PollState)
+    key: tuple[str, str] = field(init=False)
+
+    def __post_init__(self):
+        self.key = (self.test.namespace, self.test.name)
+
+
+class StatsScheduler:
+    """Polls the stats of every active LocustTest from a single task.
+
+    Polls are kept in a heap ordered by due time. Each test gets a fixed
+    phase within its interval derived from its name, so tests sharing an
+    interval are spread evenly over it instead of firing together.
+    """
+
+    def __init__(self, max_concurrency: int = STATS_MAX_IN_FLIGHT):
+        self._tests: dict[tuple[str, str], ScheduledTest] = {}
+        self._heap: list[tuple[float, int, ScheduledTest]] = []
+        self._seq = itertools.count()
+        self._max_concurrency = max_concurrency
+        self._semaphore: asyncio.Semaphore | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._polls: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._tests)
+
+    def upsert(self, test: LocustTest):
+        key = (test.namespace, test.name)
+        interval = float(test.get_poll_interval())
+
+        entry = self._tests.get(key)
+        if entry is not None:
+            # Picked up on the next poll
+            entry.test = test
+            entry.interval = interval
+            return
+
+        entry = ScheduledTest(test=test, interval=interval)
+        self._tests[key] = entry
+        self._schedule(entry, self._now() + stagger(*key, interval))
+
+    def remove(self, namespace: str, name: str):
+        # Heap entries of removed tests are skipped when popped
+        self._tests.pop((namespace, name), None)
+        forget_test(namespace, name)
+        history.forget(namespace, name)
+
+    def retain(self, keep: Callable[[str, str], bool]):
+        """Stop polling the tests for which keep(namespace, name) is false."""
+        for namespace, name in [*self._tests]:
+            if not keep(namespace, name):
+                self.remove(namespace, name)
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        tasks = [*self._polls]
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def run(self):
+        while True:
+            next_due = self._start_due_polls()
+            timeout = next_due - self._now() if next_due is not None else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_due_polls(self) -> float | None:
+        """Start the polls that are due, returns when the next one is."""
+        now = self._now()
+        while self._heap and self._heap[0][0] <= now:
+            due, _, entry = heapq.heappop(self._heap)
+            if self._tests.get(entry.key) is not entry:
+                continue
+            task = asyncio.create_task(self._poll(entry, due))
+            self._polls.add(task)
+            task.add_done_callback(self._polls.discard)
+        return self._heap[0][0] if self._heap else None
+
+    async def _poll(self, entry: ScheduledTest, due: float):
+        async with self._semaphore:
+            try:
+                entry.state = await entry.test.poll_stats(entry.poll)
+                entry.consecutive_errors = 0
+            except Exception as e:
+                entry.poll.errors += 1
+                entry.consecutive_errors += 1
+                STATS_POLL_ERRORS.inc()
+                namespace, name = entry.key
+                logger.error(f"stats poll error for {namespace}/{name}: {e}")
+
+        if self._tests.get(entry.key) is not entry:
+            return
+
+        next_due = max(due + self._next_interval(entry), self._now())
+        self._schedule(entry, next_due)
+
+    def _next_interval(self, entry: ScheduledTest) -> float:
+        idle_interval = max(entry.interval, STATS_IDLE_INTERVAL)
+        if entry.test.restart_pending:
+            # Catch the restarted master as soon as it answers
+            return entry.interval
+        if entry.consecutive_errors:
+            backoff = entry.interval * 2 ** (entry.consecutive_errors - 1)
+            return min(backoff, idle_interval)
+        if entry.state in ACTIVE_STATES:
+            return entry.interval
+        if entry.state == "ready" and entry.test.awaits_start(entry.poll):
+            # Workers are connecting, seen as soon as they are all there
+            return entry.interval
+        return idle_interval
+
+    def _schedule(self, entry: ScheduledTest, due: float):
+        heapq.heappush(self._heap, (due, next(self._seq), entry))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+
+stats_scheduler = StatsScheduler()
@@ -0,0 +1,48 @@
+from aiohttp import web
+from history import history
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+
+class OperatorServer:
+    """HTTP endpoints the operator exposes besides kopf's health probes."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.metrics)
+        self.app.router.add_get("/history/{namespace}/{name}", self.history)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=generate_latest(REGISTRY),
+            headers={"Content-Type": CONTENT_TYPE_LATEST},
+        )
+
+    async def history(self, request: web.Request) -> web.Response:
+        """Stats of a test polled so far, ?resolution=<seconds> picks the
+        coarser tiers and ?since=<unix time> the most recent samples.
+        """
+        run_history = history.get(
+            request.match_info["namespace"], request.match_info["name"]
+        )
+        if run_history is None:
+            raise web.HTTPNotFound(text="No history for this test")
+
+        try:
+            resolution = float(request.query.get("resolution", 0))
+            since = float(request.query.get("since", 0))
+        except ValueError:
+            raise web.HTTPBadRequest(text="resolution and since must be numbers")
+
+        return web.json_response(run_history.to_dict(resolution, since))
@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+
+import kopf
+from constants import (
+    GROUP,
+    LABEL_ANNOTATION_PREFIX,
+    PLURAL,
+    POD_NAME,
+    POD_NAMESPACE,
+    POOL_PLURAL,
+    SHARD_LEASE_DURATION,
+    SHARDING,
+    VERSION,
+    WATCH_NAMESPACE,
+)
+from kubernetes import client
+from objects import api_client, call
+
+SHARD_LABEL = f"{LABEL_ANNOTATION_PREFIX}/operator-shard"
+SHARD_OWNER_ANNOTATION = f"{LABEL_ANNOTATION_PREFIX}/shard-owner"
+# Locustfile bundles in the last handled configuration
+BUNDLE_DIGEST_PREFIX = "sha256:"
+
+logger = logging.getLogger(__name__)
+
+
+def _score(member: str, key: str) -> int:
+    digest = hashlib.blake2b(f"{member}/{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def rendezvous_owner(members: Iterable[str], namespace: str, name: str) -> str:
+    """Member a test belongs to. When a member goes away only its own tests
+    move, spread over the remaining members.
+    """
+    key = f"{namespace}/{name}"
+    return max(members, key=lambda member: _score(member, key))
+
+
+class ShardMembership:
+    """Live operator replicas, as advertised by their leases.
+
+    Each replica renews a lease of its own every third of the lease duration
+    and lists the others', the ones not renewed within the duration are
+    considered gone.
+    """
+
+    def __init__(
+        self,
+        identity: str = POD_NAME,
+        namespace: str = POD_NAMESPACE,
+        lease_duration: int = SHARD_LEASE_DURATION,
+        enabled: bool = SHARDING,
+    ):
+        self.identity = identity
+        self.namespace = namespace
+        self.lease_duration = lease_duration
+        self.enabled = enabled
+        self.members: tuple[str, ...] = (identity,)
+
+        self._on_change: list[Callable[[], Awaitable[None]]] = []
+        self._task: asyncio.Task | None = None
+
+    def owns(self, namespace: str, name: str) -> bool:
+        if not self.enabled:
+            return True
+        return rendezvous_owner(self.members, namespace, name) == self.identity
+
+    def on_change(self, callback: Callable[[], Awaitable[None]]):
+        self._on_change.append(callback)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        # Members are known before any handler runs, otherwise this replica
+        # would briefly consider every test its own.
+        await self.sync()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        # Hand the shard over without waiting for the lease to expire
+        try:
+            await call(
+                self._coordination().delete_namespaced_lease,
+                self.identity,
+                self.namespace,
+            )
+        except client.ApiException as e:
+            if e.status != 404:
+                raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Failed to sync shard membership: {e}")
+
+    async def sync(self):
+        await self.renew()
+        members = await self.list_members()
+        if members == self.members:
+            return
+
+        logger.info(f"Shard members changed from {self.members} to {members}")
+        self.members = members
+        for callback in self._on_change:
+            await callback()
+
+    async def renew(self):
+        coordination = self._coordination()
+        spec = client.V1LeaseSpec(
+            holder_identity=self.identity,
+            lease_duration_seconds=self.lease_duration,
+            renew_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+        try:
+            await call(
+                coordination.patch_namespaced_lease,
+                self.identity,
+                self.namespace,
+                {"spec": spec},
+            )
+        except client.ApiException as e:
+            if e.status != 404:
+                raise
+            lease = client.V1Lease(
+                metadata=client.V1ObjectMeta(
+                    name=self.identity, labels={SHARD_LABEL: "true"}
+                ),
+                spec=spec,
+            )
+            await call(coordination.create_namespaced_lease, self.namespace, lease)
+
+    async def list_members(self) -> tuple[str, ...]:
+        leases = await call(
+            self._coordination().list_namespaced_lease,
+            self.namespace,
+            label_selector=f"{SHARD_LABEL}=true",
+        )
+        now = datetime.datetime.now(datetime.timezone.utc)
+        members = {self.identity}
+        for lease in leases.items:
+            spec = lease.spec
+            if spec.renew_time is None or spec.lease_duration_seconds is None:
+                continue
+            expiry = spec.renew_time + datetime.timedelta(
+                seconds=spec.lease_duration_seconds
+            )
+            if expiry > now:
+                members.add(lease.metadata.name)
+        return tuple(sorted(members))
+
+    async def take_over(self):
+        """Mark the objects this replica just got, the resulting watch events
+        start their handlers here while the previous owner ignores them.
+        """
+        for plural in (PLURAL, POOL_PLURAL):
+            for obj in await self._list(plural):
+                metadata = obj["metadata"]
+                namespace, name = metadata["namespace"], metadata["name"]
+                annotations = metadata.get("annotations") or {}
+                if not self.owns(namespace, name):
+                    continue
+                if annotations.get(SHARD_OWNER_ANNOTATION) == self.identity:
+                    continue
+
+                logger.info(f"Taking over {plural} {namespace}/{name}")
+                try:
+                    await call(
+                        self._custom().patch_namespaced_custom_object,
+                        GROUP,
+                        VERSION,
+                        namespace,
+                        plural,
+                        name,
+                        {
+                            "metadata": {
+                                "annotations": {SHARD_OWNER_ANNOTATION: self.identity}
+                            }
+                        },
+                    )
+                except client.ApiException as e:
+                    if e.status != 404:
+                        raise
+
+    async def _list(self, plural: str) -> list[dict]:
+        custom = self._custom()
+        if WATCH_NAMESPACE:
+            objs = await call(
+                custom.list_namespaced_custom_object,
+                GROUP,
+                VERSION,
+                WATCH_NAMESPACE,
+                plural,
+            )
+        else:
+            objs = await call(custom.list_cluster_custom_object, GROUP, VERSION, plural)
+        return objs["items"]
+
+    def _custom(self) -> client.CustomObjectsApi:
+        return client.CustomObjectsApi(api_client())
+
+    def _coordination(self) -> client.CoordinationV1Api:
+        return client.CoordinationV1Api(api_client())
+
+
+shards = ShardMembership()
+
+
+def owns_object(name: str, namespace: str, **_) -> bool:
+    """kopf `when` filter of the handlers, limiting them to this shard."""
+    return shards.owns(namespace, name)
+
+
+def owns_body(body: kopf.Body) -> bool:
+    return shards.owns(body.metadata.namespace, body.metadata.name)
+
+
+def digest_bundle(essence) -> None:
+    """Replace the locustfile bundle of an essence with its digest."""
+    locustfile = essence.get("spec", {}).get("locustfile")
+    if not isinstance(locustfile, dict):
+        return
+    bundle = locustfile.get("bundle")
+    # Digests have a colon, which base64 doesn't
+    if isinstance(bundle, str) and not bundle.startswith(BUNDLE_DIGEST_PREFIX):
+        digest = hashlib.sha256(bundle.encode()).hexdigest()
+        locustfile["bundle"] = f"{BUNDLE_DIGEST_PREFIX}{digest}"
+
+
+class ShardDiffBaseStorage(kopf.AnnotationsDiffBaseStorage):
+    """Last handled state of the objects of this shard.
+
+    kopf records a change as handled even when the when filter skipped all
+    of its handlers, the other replicas would then hide the changes from
+    the owner. Until it handled them the diff stays pending, so a new owner
+    still gets the creates and updates the previous one didn't finish.
+
+    Locustfile bundles are kept as their digest, the annotations of an
+    object can't hold more than 256 KiB. Changing the bundle still changes
+    the digest.
+    """
+
+    def build(self, *, body: kopf.Body, extra_fields=None):
+        essence = super().build(body=body, extra_fields=extra_fields)
+        digest_bundle(essence)
+        return essence
+
+    def fetch(self, *, body: kopf.Body):
+        # Stored whole before, compared as a digest without a diff
+        essence = super().fetch(body=body)
+        if essence is not None:
+            digest_bundle(essence)
+        return essence
+
+    def store(self, *, body: kopf.Body, patch: kopf.Patch, essence) -> None:
+        if owns_body(body):
+            super().store(body=body, patch=patch, essence=essence)
+
+
+class ShardProgressStorage(kopf.AnnotationsProgressStorage):
+    """Handler progress, retries included, only written by the owner."""
+
+    def store(self, *, key, record, body: kopf.Body, patch: kopf.Patch) -> None:
+        if owns_body(body):
+            super().store(key=key, record=record, body=body, patch=patch)
+
+    def purge(self, *, key, body: kopf.Body, patch: kopf.Patch) -> None:
+        if owns_body(body):
+            super().purge(key=key, body=body, patch=patch)
+
+    def touch(self, *, body: kopf.Body, patch: kopf.Patch, value) -> None:
+        if owns_body(body):
+            super().touch(body=body, patch=patch, value=value)
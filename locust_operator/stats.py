@@ -0,0 +1,209 @@
+import asyncio
+import collections
+from dataclasses import dataclass, field
+
+import aiohttp
+from constants import (
+    STATS_CONNECT_TIMEOUT,
+    STATS_MAX_IN_FLIGHT,
+    STATS_READ_TIMEOUT,
+)
+
+# Average CPU usage of the locust processes of a worker pod from which the
+# pod is saturated, locust itself warns about its workers from 90%
+SATURATED_CPU_PERCENT = 90
+
+
+def worker_pod_cpu(workers: list[dict]) -> dict[str, float]:
+    """Average CPU usage of the locust processes of each worker pod, locust
+    names its workers after the hostname, the pod name, and a random suffix.
+    """
+    usages: dict[str, list[float]] = collections.defaultdict(list)
+    for worker in workers:
+        if worker.get("cpu_usage") is None:
+            continue
+        pod = str(worker.get("id", "")).rsplit("_", 1)[0]
+        usages[pod].append(float(worker["cpu_usage"]))
+    return {pod: sum(values) / len(values) for pod, values in usages.items()}
+
+
+def worker_pods_status(workers: list[dict]) -> dict:
+    cpu = worker_pod_cpu(workers)
+    if not cpu:
+        return {}
+    return {
+        "worker_pods": len(cpu),
+        "worker_pod_cpu_max_percent": round(max(cpu.values())),
+        "saturated_worker_pods": sum(
+            usage >= SATURATED_CPU_PERCENT for usage in cpu.values()
+        ),
+    }
+
+
+class StatsClient:
+    """HTTP client shared by every stats poll, connections to the masters
+    are kept alive between polls and the number of polls in flight is capped
+    so a few slow masters can't pile up requests.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = STATS_CONNECT_TIMEOUT,
+        read_timeout: float = STATS_READ_TIMEOUT,
+        max_in_flight: int = STATS_MAX_IN_FLIGHT,
+    ):
+        self._timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._max_in_flight = max_in_flight
+        self._session: aiohttp.ClientSession | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def in_flight(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        return self._semaphore
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._max_in_flight, keepalive_timeout=60
+                ),
+                timeout=self._timeout,
+            )
+        return self._session
+
+    async def get_json(self, url: str) -> dict:
+        async with self.in_flight:
+            async with self.session().get(url) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def get_bytes(self, url: str) -> bytes:
+        async with self.in_flight:
+            async with self.session().get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def post_form(self, url: str, data: dict) -> bytes:
+        async with self.in_flight:
+            async with self.session().post(url, data=data) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+stats_client = StatsClient()
+
+
+class StatusWriter:
+    """Decides which polled samples of a test are worth a status write.
+
+    Writing the status bumps the resourceVersion of the LocustTest and wakes
+    every watcher, so samples are only written when they differ from the
+    last written one by more than the deadbands. Changes are coalesced to at
+    most one write per min_interval, except for state changes.
+    """
+
+    def __init__(
+        self,
+        rps_deadband_percent: float = 5.0,
+        fail_ratio_deadband: float = 0.01,
+        min_interval: float = 10.0,
+    ):
+        self.rps_deadband_percent = rps_deadband_percent
+        self.fail_ratio_deadband = fail_ratio_deadband
+        self.min_interval = min_interval
+
+        self.last_written: dict | None = None
+        self.last_write_time = float("-inf")
+        self.writes = 0
+        self.skipped = 0
+
+    def configure(self, metrics_spec: dict):
+        self.rps_deadband_percent = float(
+            metrics_spec.get("rpsDeadbandPercent", self.rps_deadband_percent)
+        )
+        self.fail_ratio_deadband = float(
+            metrics_spec.get("failRatioDeadband", self.fail_ratio_deadband)
+        )
+        self.min_interval = float(
+            metrics_spec.get("minWriteIntervalSeconds", self.min_interval)
+        )
+
+    def should_write(
+        self, sample: dict, now: float, stored_state: str | None = None
+    ) -> bool:
+        """stored_state is the state in the status, which reconciles write
+        too, so it can differ from the last written one.
+        """
+        last = self.last_written
+        if last is None or sample["state"] != last["state"]:
+            return True
+        if stored_state is not None and stored_state != sample["state"].upper():
+            return True
+
+        if not self._changed(sample, last):
+            self.skipped += 1
+            return False
+
+        if now - self.last_write_time < self.min_interval:
+            # Still differs on the next poll, so the latest value is written
+            # once the interval has passed.
+            self.skipped += 1
+            return False
+
+        return True
+
+    def written(self, sample: dict, now: float):
+        self.last_written = dict(sample)
+        self.last_write_time = now
+        self.writes += 1
+
+    def _changed(self, sample: dict, last: dict) -> bool:
+        if (
+            sample["user_count"] != last["user_count"]
+            or sample["worker_count"] != last["worker_count"]
+        ):
+            return True
+
+        rps, last_rps = sample["total_rps"], last["total_rps"]
+        if abs(rps - last_rps) > max(last_rps, 1.0) * self.rps_deadband_percent / 100:
+            return True
+
+        fail_ratio_delta = abs(sample["fail_ratio"] - last["fail_ratio"])
+        return fail_ratio_delta > self.fail_ratio_deadband
+
+
+@dataclass
+class PollState:
+    """What is remembered about a test from one stats poll to the next."""
+
+    status_writer: StatusWriter = field(default_factory=StatusWriter)
+    errors: int = 0
+    last_scale_time: float = float("-inf")
+    first_request_seen: bool = False
+    # Reset when the test runs again so the next stop is captured as well
+    results_captured: bool = False
+    # Captured when the master exits before a poll saw it stopped
+    last_stats: dict | None = None
+    run_finished: bool = False
+    # Worker job whose replaced jobs were deleted, ahead of the status
+    rolled_worker_job: str | None = None
+    # Run, worker job and worker count the distribution was taken for
+    distribution_of: tuple | None = None
+    # Start of the master the startup times below were recorded for
+    run_start: str | None = None
+    master_ready_seen: bool = False
+    workers_connected_seen: bool = False
+    # Progress of spec.loadProfile in the run started at load_profile_run,
+    # ahead of the status until the written one is seen again
+    load_profile: dict | None = None
+    load_profile_run: str | None = None
+    abort_breaches: dict[int, float] = field(default_factory=dict)
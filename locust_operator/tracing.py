@@ -0,0 +1,152 @@
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+
+from constants import OTLP_ENDPOINT, TRACE_LOG
+
+logger = logging.getLogger(__name__)
+
+# One JSON document per line, without the log format of kopf
+trace_logger = logging.getLogger("locust_operator.traces")
+trace_logger.propagate = False
+trace_logger.setLevel(logging.INFO)
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter("%(message)s"))
+trace_logger.addHandler(_handler)
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "span", default=None
+)
+
+
+@dataclass
+class Span:
+    name: str
+    attributes: dict[str, str | int | float | bool] = field(default_factory=dict)
+    start: float = field(default_factory=time.time)
+    duration: float | None = None
+    children: list["Span"] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+            **({"attributes": self.attributes} if self.attributes else {}),
+            **(
+                {"children": [child.to_dict() for child in self.children]}
+                if self.children
+                else {}
+            ),
+        }
+
+    def breakdown(self, limit: int = 5) -> str:
+        """Slowest steps, each with its slowest API call."""
+        parts = []
+        for child in sorted(self.children, key=lambda s: -(s.duration or 0))[:limit]:
+            part = f"{child.name} {child.duration:.2f}s"
+            if child.children:
+                slowest = max(child.children, key=lambda s: s.duration or 0)
+                details = [slowest.name, f"{slowest.duration:.2f}s"]
+                if "status" in slowest.attributes:
+                    details.append(str(slowest.attributes["status"]))
+                part += f" ({' '.join(details)})"
+            parts.append(part)
+        return ", ".join(parts)
+
+
+@contextlib.contextmanager
+def trace(name: str, /, **attributes):
+    """Root span, exported with its children once finished."""
+    root = Span(name, attributes)
+    token = _current.set(root)
+    t0 = time.perf_counter()
+    try:
+        yield root
+    except BaseException as e:
+        root.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        root.duration = time.perf_counter() - t0
+        _current.reset(token)
+        export(root)
+
+
+@contextlib.contextmanager
+def span(name: str, /, **attributes):
+    """Child span of the current trace, does nothing outside of one."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, attributes)
+    parent.children.append(child)
+    token = _current.set(child)
+    t0 = time.perf_counter()
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        child.duration = time.perf_counter() - t0
+        _current.reset(token)
+
+
+_tracer = None
+
+
+def export(root: Span):
+    if TRACE_LOG:
+        trace_logger.info(json.dumps(root.to_dict()))
+    if OTLP_ENDPOINT:
+        tracer = _otlp_tracer()
+        if tracer is not None:
+            _replay(tracer, root)
+
+
+def _otlp_tracer():
+    global _tracer
+    if _tracer is None:
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            logger.warning(
+                "OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk and "
+                "opentelemetry-exporter-otlp-proto-http aren't installed"
+            )
+            _tracer = False
+            return None
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": "locust-operator"})
+        )
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        _tracer = provider.get_tracer("locust-operator")
+    return _tracer or None
+
+
+def _replay(tracer, span: Span, context=None):
+    """Send a finished span and its children, with their recorded times."""
+    from opentelemetry import trace as otel_trace
+
+    otel_span = tracer.start_span(
+        span.name,
+        context=context,
+        start_time=int(span.start * 1e9),
+        attributes=span.attributes,
+    )
+    child_context = otel_trace.set_span_in_context(otel_span)
+    for child in span.children:
+        _replay(tracer, child, child_context)
+    otel_span.end(end_time=int((span.start + (span.duration or 0)) * 1e9))
@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import enum
+import heapq
+import itertools
+import logging
+import time
+import zlib
+
+from constants import MAX_CONCURRENT_RECONCILES
+from metrics import RECONCILE_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """Order in which waiting reconciles run, lowest first."""
+
+    CREATE = 0
+    UPDATE = 1
+    # Every existing object is resumed on startup, mostly with nothing to do
+    RESUME = 2
+
+    @classmethod
+    def for_reason(cls, reason: str) -> "Priority":
+        return {"create": cls.CREATE, "resume": cls.RESUME}.get(reason, cls.UPDATE)
+
+
+class ReconcileQueue:
+    """Limits the reconciles running at once, the others wait for a slot in
+    priority order, then in arrival order.
+
+    The resumes of the existing objects on startup are the backlog, whose
+    end is logged once: until then the operator is still catching up.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_RECONCILES):
+        self._max_concurrency = max(max_concurrency, 1)
+        self._running = 0
+        self._waiting: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+        self._backlog = 0
+        self._backlog_started: float | None = None
+        self.resumed = 0
+        self.drained_seconds: float | None = None
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Priority):
+        if priority == Priority.RESUME:
+            self._backlog += 1
+            if self._backlog_started is None:
+                self._backlog_started = time.monotonic()
+        try:
+            await self._acquire(priority)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            if priority == Priority.RESUME:
+                self._backlog -= 1
+                self.resumed += 1
+                self._check_drained()
+
+    async def _acquire(self, priority: Priority):
+        if self._running < self._max_concurrency and not self._waiting:
+            self._running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        RECONCILE_QUEUE_DEPTH.labels(priority.name.lower()).inc()
+        try:
+            # The slot is taken on our behalf by _release
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            RECONCILE_QUEUE_DEPTH.labels(priority.name.lower()).dec()
+
+    def _release(self):
+        self._running -= 1
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            self._running += 1
+            future.set_result(None)
+            return
+
+    def _check_drained(self):
+        if self._backlog or self.drained_seconds is not None:
+            return
+        self.drained_seconds = time.monotonic() - self._backlog_started
+        logger.info(
+            f"Startup backlog drained, resumed {self.resumed} objects "
+            f"in {self.drained_seconds:.1f}s"
+        )
+
+    def stats(self) -> dict:
+        waiting = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, future in self._waiting:
+            if not future.done():
+                waiting[Priority(priority).name.lower()] += 1
+        return {
+            "running": self._running,
+            "waiting": waiting,
+            "resumed": self.resumed,
+            "backlog_drained": self.drained_seconds is not None,
+            **(
+                {"backlog_drained_seconds": round(self.drained_seconds, 1)}
+                if self.drained_seconds is not None
+                else {}
+            ),
+        }
+
+
+def stagger(namespace: str, name: str, interval: float) -> float:
+    """Fixed offset within interval of an object's periodic work, spreading
+    the objects evenly instead of starting them together.
+    """
+    digest = zlib.crc32(f"{namespace}/{name}".encode())
+    return (digest / 0xFFFFFFFF) * interval
+
+
+_staggered: set[tuple[str, str]] = set()
+
+
+async def stagger_start(namespace: str, name: str, interval: float):
+    """Delay the first run of an object's timer by its stagger."""
+    if (namespace, name) in _staggered:
+        return
+    _staggered.add((namespace, name))
+    await asyncio.sleep(stagger(namespace, name, interval))
+
+
+reconcile_queue = ReconcileQueue()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The operator modules are run by kopf as top-level modules, mirror that here.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "locust_operator"))
@@ -0,0 +1,60 @@
+from admission import AdmissionLedger, Resources, locust_test_requests
+
+
+def test_requests_of_a_test():
+    spec = {
+        "master": {"resources": {"requests": {"cpu": "500m", "memory": "512Mi"}}},
+        "worker": {"resources": {"limits": {"cpu": "1", "memory": "1Gi"}}},
+    }
+
+    assert locust_test_requests(spec, 3) == Resources(3.5, 3.5 * 1024**3)
+
+
+def test_admits_in_priority_then_creation_order():
+    ledger = AdmissionLedger(cpu="4")
+    small, big = Resources(cpu=1), Resources(cpu=3)
+
+    assert ledger.try_admit("a", "running", big, 0, "2026-01-01T00:00:00Z") == 0
+    assert ledger.try_admit("a", "first", big, 0, "2026-01-01T00:01:00Z") == 1
+    # Fits, but waits behind the older test
+    assert ledger.try_admit("a", "second", small, 0, "2026-01-01T00:02:00Z") == 2
+    assert ledger.try_admit("a", "urgent", small, 1, "2026-01-01T00:03:00Z") == 0
+
+    ledger.forget("a", "running")
+    ledger.forget("a", "urgent")
+    assert ledger.try_admit("a", "second", small, 0, "2026-01-01T00:02:00Z") == 2
+    assert ledger.try_admit("a", "first", big, 0, "2026-01-01T00:01:00Z") == 0
+    assert ledger.try_admit("a", "second", small, 0, "2026-01-01T00:02:00Z") == 0
+    assert ledger.used("cluster") == Resources(cpu=4)
+
+
+def test_namespaces_have_their_own_budget():
+    ledger = AdmissionLedger(memory="1Gi", scope="namespace")
+    request = Resources(memory=1024**3)
+
+    assert ledger.try_admit("a", "test", request, 0, "") == 0
+    assert ledger.try_admit("b", "test", request, 0, "") == 0
+    assert ledger.try_admit("a", "other", request, 0, "") == 1
+
+
+def test_observe_keeps_local_admissions():
+    ledger = AdmissionLedger(cpu="1")
+    ledger.try_admit("a", "test", Resources(cpu=1), 0, "")
+
+    # Event of the status written before the admission
+    ledger.observe("a", "test", {"state": "QUEUED"}, Resources(cpu=1), 0, "")
+
+    assert ("a", "test") in ledger.admitted
+    assert not ledger.waiting
+
+
+def test_finished_runs_release_their_resources():
+    ledger = AdmissionLedger(cpu="1")
+    ledger.try_admit("a", "done", Resources(cpu=1), 0, "")
+    assert ledger.try_admit("a", "next", Resources(cpu=1), 0, "") == 1
+
+    status = {"state": "STOPPED", "run_finished_at": "2026-01-01T00:10:00Z"}
+    ledger.observe("a", "done", status, Resources(cpu=1), 0, "")
+
+    assert ledger.used("cluster") == Resources()
+    assert ledger.try_admit("a", "next", Resources(cpu=1), 0, "") == 0
@@ -0,0 +1,48 @@
+from autoscale import Autoscale, plan_workers
+
+
+def autoscale(**spec):
+    return Autoscale.from_spec({"autoscale": {"maxWorkers": 10, **spec}})
+
+
+def test_from_spec():
+    assert Autoscale.from_spec({}) is None
+    assert autoscale(minWorkers=20).max_workers == 20
+
+
+def test_plan_workers_from_users():
+    workers, _ = plan_workers(
+        autoscale(targetUsersPerWorker=50), current=2, user_count=260, cpu_usages=[]
+    )
+
+    assert workers == 6
+
+
+def test_plan_workers_from_users_of_each_process():
+    workers, reason = plan_workers(
+        autoscale(targetUsersPerWorker=50),
+        current=2,
+        user_count=260,
+        cpu_usages=[],
+        processes=4,
+    )
+
+    assert workers == 2
+    assert "4 workers per pod" in reason
+
+
+def test_plan_workers_from_cpu():
+    workers, reason = plan_workers(
+        autoscale(targetCpuPercent=50), current=4, user_count=0, cpu_usages=[90, 70]
+    )
+
+    assert workers == 7
+    assert "cpu 80%" in reason
+
+
+def test_plan_workers_takes_largest_proposal_within_bounds():
+    spec = autoscale(minWorkers=2, targetUsersPerWorker=100, targetCpuPercent=50)
+
+    assert plan_workers(spec, 4, 100, [25, 25])[0] == 2
+    assert plan_workers(spec, 4, 100, [100, 100])[0] == 8
+    assert plan_workers(spec, 4, 5000, [100, 100])[0] == 10
@@ -0,0 +1,28 @@
+import importlib
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "benchmarks"))
+
+import run  # noqa: E402
+
+
+def test_benchmark_runs_offline(tmp_path, monkeypatch):
+    monkeypatch.delenv("KUBERNETES_SERVICE_HOST", raising=False)
+    for name, value in run.ENVIRONMENT.items():
+        monkeypatch.setenv(name, value)
+    # Set above when imported first, earlier tests may have imported them
+    controller = importlib.import_module("controller")
+    ratelimit = importlib.import_module("ratelimit")
+    monkeypatch.setattr(controller, "IN_CLUSTER", None)
+    monkeypatch.setattr(controller, "SLOW_RECONCILE_SECONDS", 0)
+    monkeypatch.setattr(ratelimit.api_rate_limit, "rate", 0)
+
+    results = run.main(["--tests", "2", "--polls", "1", "--output", str(tmp_path)])
+
+    (run_results,) = results["runs"]
+    assert run_results["reconcile"]["ensure_results"] == {"created": 10}
+    assert run_results["noop_reconcile"]["ensure_results"] == {"unchanged": 10}
+    assert run_results["noop_reconcile"]["api_calls_per_reconcile"] == 5
+    assert run_results["stats_poll"]["api_calls_per_poll"] >= 1
+    assert list(tmp_path.glob("*.json"))
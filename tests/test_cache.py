@@ -0,0 +1,75 @@
+from cache import TEST_RUN_LABEL, Informer
+from kubernetes import client
+
+
+def job(name, test_run, namespace="default"):
+    return client.V1Job(
+        metadata=client.V1ObjectMeta(
+            name=name,
+            namespace=namespace,
+            labels={TEST_RUN_LABEL: test_run},
+            resource_version="1",
+        )
+    )
+
+
+def job_list(*jobs, resource_version="10"):
+    return client.V1JobList(
+        items=list(jobs), metadata=client.V1ListMeta(resource_version=resource_version)
+    )
+
+
+def test_informer_indexes_by_namespace_and_test_run():
+    informer = Informer(
+        "jobs",
+        lambda **_: job_list(
+            job("a-master", "a"), job("a-worker", "a"), job("b-master", "b")
+        ),
+    )
+
+    assert informer.list("default", "a") is None
+
+    informer._resync()
+
+    assert informer.resource_version == "10"
+    assert {j.metadata.name for j in informer.list("default", "a")} == {
+        "a-master",
+        "a-worker",
+    }
+    assert informer.list("other", "a") == []
+    assert informer.get("default", "b-master") is not None
+    assert informer.get("default", "missing") is None
+    assert (informer.hits, informer.misses) == (3, 1)
+
+
+def test_informer_resync_drops_objects_deleted_while_not_watching():
+    items = [job("a-master", "a"), job("a-worker", "a")]
+    informer = Informer("jobs", lambda **_: job_list(*items))
+    informer._resync()
+
+    items.pop()
+    informer._resync()
+
+    assert [j.metadata.name for j in informer.list("default", "a")] == ["a-master"]
+
+
+def test_informer_forget():
+    informer = Informer("jobs", lambda **_: job_list(job("a-master", "a")))
+    informer._resync()
+
+    informer.forget("default", "a-master")
+
+    assert informer.get("default", "a-master") is None
+    assert informer.list("default", "a") == []
+
+
+def test_informer_answers_nothing_until_synced_again():
+    informer = Informer("jobs", lambda **_: job_list(job("a-master", "a")))
+    informer._resync()
+
+    # Watch failed, relisting
+    informer._synced.clear()
+
+    assert informer.get("default", "a-master") is None
+    assert informer.list("default", "a") is None
+    assert (informer.hits, informer.misses) == (0, 1)
@@ -0,0 +1,589 @@
+import asyncio
+import base64
+import datetime
+import gzip
+import logging
+import random
+
+import controller
+import kopf
+import pytest
+from admission import AdmissionLedger, Resources
+from controller import LocustTest
+from kubernetes import client
+from objects import SPEC_HASH_ANNOTATION
+from planner import plan_restart
+from stats import PollState
+
+
+def locust_test(spec=None, status=None):
+    body = kopf.Body(
+        {
+            "apiVersion": "locust.io/v1",
+            "kind": "LocustTest",
+            "metadata": {"name": "test", "namespace": "default", "uid": "uid"},
+            "spec": spec or {},
+            "status": status or {},
+        }
+    )
+    return LocustTest("test", "default", body, kopf.Patch(), logging.getLogger())
+
+
+class FakeProxyResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+def test_fetch_stats_through_api_proxy(monkeypatch):
+    monkeypatch.setattr(controller, "IN_CLUSTER", None)
+    response = FakeProxyResponse(b'{"state": "running", "ok": true, "x": null}')
+    calls = []
+
+    test = locust_test()
+    monkeypatch.setattr(
+        test._core,
+        "connect_get_namespaced_service_proxy_with_path",
+        lambda **kwargs: calls.append(kwargs) or response,
+    )
+
+    stats = asyncio.run(test.fetch_stats("test-webui", 8089))
+
+    assert stats == {"state": "running", "ok": True, "x": None}
+    assert calls[0]["name"] == "test-webui:8089"
+    assert calls[0]["_preload_content"] is False
+    assert response.released
+
+
+def test_invalid_bundle_is_rejected():
+    test = locust_test({"locustfile": {"bundle": "bm90IGd6aXA="}})
+
+    with pytest.raises(kopf.PermanentError):
+        asyncio.run(test.ensure_configmap())
+
+    assert test._patch.status["state"] == "Invalid"
+
+
+def test_bundles_up_to_the_configmap_size_are_accepted(monkeypatch):
+    ensured = []
+
+    async def ensure_shared(create, read, patch, desired, lookup):
+        ensured.append(desired)
+        return "created"
+
+    monkeypatch.setattr(controller, "ensure_shared", ensure_shared)
+
+    def bundle(size):
+        # Incompressible, the tarball is as large as its content
+        content = gzip.compress(random.Random(0).randbytes(size))
+        return base64.b64encode(content).decode()
+
+    # More than the annotations of the test could hold
+    test = locust_test({"locustfile": {"bundle": bundle(300 * 1024)}})
+    cm_name = asyncio.run(test.ensure_configmap())
+    assert [cm.metadata.name for cm in ensured] == [cm_name]
+
+    test = locust_test({"locustfile": {"bundle": bundle(1024 * 1024)}})
+    with pytest.raises(kopf.PermanentError):
+        asyncio.run(test.ensure_configmap())
+    assert test._patch.status["state"] == "Invalid"
+
+
+def test_capture_results_of_a_stopped_run(monkeypatch):
+    test = locust_test()
+    ensured = []
+
+    async def fetch(svc, port, path):
+        if path == "exceptions/csv":
+            raise client.ApiException(status=503)
+        return f"{path}\n".encode()
+
+    async def ensure(create, read, patch, desired, lookup=None, apply=None):
+        ensured.append(desired)
+        return "created"
+
+    monkeypatch.setattr(test, "fetch", fetch)
+    monkeypatch.setattr(test, "_ensure", ensure)
+    stats = {
+        "state": "stopped",
+        "stats": [{"name": "Aggregated", "num_requests": 10, "num_failures": 1}],
+        "errors": [{"error": "boom"}],
+    }
+
+    results = asyncio.run(test.capture_results(stats))
+
+    cm = ensured[0]
+    assert cm.metadata.name == "test-results"
+    assert cm.metadata.owner_references[0].uid == "uid"
+    assert sorted(cm.binary_data) == [
+        "failures.csv.gz",
+        "requests.csv.gz",
+        "stats.json.gz",
+    ]
+    requests_csv = gzip.decompress(base64.b64decode(cm.binary_data["requests.csv.gz"]))
+    assert requests_csv == b"stats/requests/csv\n"
+    assert results["num_requests"] == 10
+    assert results["num_failures"] == 1
+    assert results["errors"] == 1
+
+
+def test_results_of_an_exited_master_are_captured(monkeypatch):
+    test = locust_test()
+    finished = client.V1Job(
+        status=client.V1JobStatus(
+            conditions=[client.V1JobCondition(type="Complete", status="True")]
+        )
+    )
+    monkeypatch.setattr(controller.owned_objects, "get", lambda *_: finished)
+    captured, written = [], []
+
+    async def capture_results(stats, exports=True):
+        captured.append((stats, exports))
+        return {"configmap": "test-results"}
+
+    async def fetch(*_):
+        pytest.fail("polled the exited master")
+
+    monkeypatch.setattr(test, "capture_results", capture_results)
+    monkeypatch.setattr(test, "fetch", fetch)
+    monkeypatch.setattr(
+        test._custom,
+        "patch_namespaced_custom_object_status",
+        lambda *args: written.append(args[-1]),
+    )
+    poll = PollState(last_stats={"state": "running"})
+
+    assert asyncio.run(test.poll_stats(poll)) == "stopped"
+    assert asyncio.run(test.poll_stats(poll)) == "stopped"
+
+    assert captured == [({"state": "running"}, False)]
+    (status,) = (patch["status"] for patch in written)
+    assert status["state"] == "STOPPED"
+    assert status["results"] == {"configmap": "test-results"}
+    assert status["run_finished_at"]
+
+
+def test_restart_seconds_until_the_new_master_answers(monkeypatch):
+    restarted_at = datetime.datetime.now(datetime.timezone.utc) - (
+        datetime.timedelta(seconds=12)
+    )
+    test = locust_test(
+        status={"restarted_at": restarted_at.isoformat(), "master_revision": 2}
+    )
+    old = client.V1Job(
+        metadata=client.V1ObjectMeta(name="test-master"),
+        status=client.V1JobStatus(ready=1),
+    )
+    new = client.V1Job(
+        metadata=client.V1ObjectMeta(name="test-master-2"),
+        status=client.V1JobStatus(ready=0),
+    )
+    jobs = [old, new]
+    monkeypatch.setattr(controller.owned_objects, "list", lambda *_: jobs)
+
+    assert test.restart_pending
+    # Still answered by the old, terminating master
+    assert test.get_restart_seconds() is None
+    new.status.ready = 1
+    assert 12 <= test.get_restart_seconds() < 14
+    # The job cache can't tell, the answer is taken as the new master's
+    jobs = None
+    assert test.get_restart_seconds() is not None
+
+    recorded = locust_test(
+        status={"restarted_at": restarted_at.isoformat(), "restart_seconds": 12.0}
+    )
+    assert not recorded.restart_pending
+    assert recorded.get_restart_seconds() is None
+    assert not locust_test().restart_pending
+
+
+def test_startup_times_are_recorded_once(monkeypatch):
+    test = locust_test(
+        {"workers": 2}, status={"restarted_at": "2026-01-01T00:00:00+00:00"}
+    )
+    ready = client.V1Pod(
+        status=client.V1PodStatus(
+            conditions=[
+                client.V1PodCondition(
+                    type="Ready",
+                    status="True",
+                    last_transition_time=datetime.datetime(
+                        2026, 1, 1, 0, 0, 4, tzinfo=datetime.timezone.utc
+                    ),
+                )
+            ]
+        )
+    )
+    listed = []
+    monkeypatch.setattr(
+        test._core,
+        "list_namespaced_pod",
+        lambda namespace, label_selector: (
+            listed.append(label_selector) or client.V1PodList(items=[ready])
+        ),
+    )
+    poll = PollState()
+
+    first = asyncio.run(test.get_startup_times(1, poll))
+    second = asyncio.run(test.get_startup_times(2, poll))
+    third = asyncio.run(test.get_startup_times(2, poll))
+
+    assert first == {"master_ready_seconds": 4.0}
+    assert set(second) == {"workers_connected_seconds"}
+    assert third == {}
+    assert listed == [f"job-name={test.get_master_job_name()}"]
+
+
+def test_master_pods_listed_once_the_job_is_ready(monkeypatch):
+    test = locust_test(status={"restarted_at": "2026-01-01T00:00:00+00:00"})
+    job = client.V1Job(status=client.V1JobStatus(ready=0))
+    monkeypatch.setattr(controller.owned_objects, "get", lambda *_: job)
+    monkeypatch.setattr(
+        test._core,
+        "list_namespaced_pod",
+        lambda *_, **__: pytest.fail("listed the pods of a master not ready"),
+    )
+
+    assert asyncio.run(test.get_master_ready_time()) is None
+
+
+def test_load_profile_starts_then_aborts(monkeypatch):
+    test = locust_test(
+        {
+            "workers": 2,
+            "loadProfile": {
+                "stages": [{"durationSeconds": 60, "users": 10}],
+                "abort": [{"metric": "failRatio", "threshold": 0.1}],
+            },
+        }
+    )
+    requests, calls = [], []
+
+    async def fetch(svc, port, path, data=None):
+        requests.append((path, data))
+        return b"{}"
+
+    async def call(fn, *args, **kwargs):
+        calls.append((fn.__name__, args))
+
+    monkeypatch.setattr(test, "fetch", fetch)
+    monkeypatch.setattr(controller, "call", call)
+    monkeypatch.setattr(kopf, "event", lambda *args, **kwargs: None)
+    poll = PollState()
+
+    def drive(state, workers, fail_ratio=0.0):
+        total = {"name": "Aggregated", "current_rps": 10.0}
+        total["current_fail_per_sec"] = 10.0 * fail_ratio
+        stats = {"state": state, "stats": [total]}
+        sample = {"state": state, "worker_count": workers}
+        return asyncio.run(test.drive_load_profile(stats, sample, poll))
+
+    assert drive("ready", 1) is None
+    started = drive("ready", 2)
+    assert started["stage"] == 0
+    assert requests == [("swarm", {"user_count": 10, "spawn_rate": 10})]
+
+    assert drive("running", 2) is None
+    aborted = drive("running", 2, fail_ratio=0.5)
+    assert "fail ratio 50.0%" in aborted["aborted"]
+    assert requests[-1] == ("stop", None)
+    assert calls == [
+        (
+            "patch_namespaced_job",
+            ("test-worker", "default", {"spec": {"parallelism": 0}}),
+        )
+    ]
+    assert drive("stopped", 0) is None
+
+
+def test_ready_master_awaits_its_load_profile():
+    spec = {
+        "workers": 0,
+        "loadProfile": {"stages": [{"durationSeconds": 60, "users": 1}]},
+    }
+    poll = PollState()
+
+    assert not locust_test({"workers": 0}).awaits_start(poll)
+    assert locust_test(spec).awaits_start(poll)
+    poll.load_profile = {"started_at": "2026-01-01T00:00:00+00:00"}
+    assert not locust_test(spec).awaits_start(poll)
+
+
+def test_old_workers_kept_until_new_ones_connected(monkeypatch):
+    test = locust_test(
+        {"workers": 2, "worker": {"processes": 2}},
+        {"worker_revision": 3, "rolling_workers": True},
+    )
+    deleted = []
+
+    async def delete_jobs(component=None, keep=None):
+        deleted.append((component, keep))
+
+    monkeypatch.setattr(test, "delete_jobs", delete_jobs)
+    poll = PollState()
+
+    def workers(*pods):
+        return {"workers": [{"id": f"{pod}_{i}"} for pod in pods for i in range(2)]}
+
+    assert not asyncio.run(
+        test.finish_worker_rollout(
+            workers("test-worker-ab12c", "test-worker-3-x"), poll
+        )
+    )
+    assert asyncio.run(
+        test.finish_worker_rollout(workers("test-worker-3-x", "test-worker-3-y"), poll)
+    )
+    assert not asyncio.run(
+        test.finish_worker_rollout(workers("test-worker-3-x", "test-worker-3-y"), poll)
+    )
+    assert deleted == [("worker", "test-worker-3")]
+
+
+def test_queued_until_admitted(monkeypatch):
+    ledger = AdmissionLedger(cpu="2")
+    monkeypatch.setattr(controller, "admission", ledger)
+    ledger.try_admit("default", "running", Resources(cpu=2), 0, "")
+    test = locust_test(
+        {"workers": 1, "worker": {"resources": {"requests": {"cpu": "1"}}}}
+    )
+
+    with pytest.raises(kopf.TemporaryError):
+        test.admit()
+    assert test._patch.status["state"] == "QUEUED"
+    assert test._patch.status["queue_position"] == 1
+
+    ledger.forget("default", "running")
+    test.admit()
+    assert test._patch.status["admitted_at"]
+    assert test._patch.status["queue_position"] is None
+
+
+def test_aborted_and_finished_runs_release_admission(monkeypatch):
+    ledger = AdmissionLedger(cpu="2")
+    monkeypatch.setattr(controller, "admission", ledger)
+    spec = {
+        "workers": 1,
+        "master": {"resources": {"requests": {"cpu": "1"}}},
+        "worker": {"resources": {"requests": {"cpu": "1"}}},
+    }
+    aborted = locust_test(spec, {"state": "STOPPED", "load_profile": {"aborted": "x"}})
+    assert aborted.get_resource_requests() == Resources(cpu=1)
+
+    finished = {"state": "STOPPED", "admitted_at": "x", "run_finished_at": "y"}
+    ledger.try_admit("default", "other", Resources(cpu=2), 0, "")
+    # Resumed as it is, restarted through the queue
+    locust_test(spec, finished).admit()
+    rerun = locust_test(spec, finished)
+    with pytest.raises(kopf.TemporaryError):
+        rerun.admit(plan_restart([("change", ("spec", "image"), "a", "b")]))
+    assert rerun._patch.status["state"] == "QUEUED"
+    assert rerun._patch.status["run_finished_at"] is None
+
+
+def test_resume_of_finished_test_creates_no_jobs(monkeypatch):
+    test = locust_test({"workers": 2}, {"state": "STOPPED", "run_finished_at": "x"})
+    ensured = []
+    for step in (
+        "ensure_configmap",
+        "ensure_master_service",
+        "ensure_webui_service",
+        "ensure_master",
+        "ensure_worker",
+    ):
+
+        async def ensure(*args, step=step):
+            ensured.append(step)
+
+        monkeypatch.setattr(test, step, ensure)
+
+    asyncio.run(test.reconcile())
+
+    assert ensured == []
+    assert "state" not in test._patch.status
+    # Run again by a restart of its master, not of its workers alone
+    workers_changed = [("change", ("spec", "worker", "image"), "a", "b")]
+    assert test.run_finished(plan_restart(workers_changed))
+    image_changed = [("change", ("spec", "image"), "a", "b")]
+    assert not test.run_finished(plan_restart(image_changed))
+
+
+def test_resumed_finished_run_stays_out_of_the_budget(monkeypatch):
+    ledger = AdmissionLedger(cpu="2")
+    monkeypatch.setattr(controller, "admission", ledger)
+    spec = {
+        "workers": 1,
+        "master": {"resources": {"requests": {"cpu": "1"}}},
+        "worker": {"resources": {"requests": {"cpu": "1"}}},
+    }
+    finished = locust_test(
+        spec, {"state": "STOPPED", "admitted_at": "x", "run_finished_at": "y"}
+    )
+    finished.observe_admission()
+
+    asyncio.run(finished.reconcile())
+    other = locust_test(spec)
+    other.name = "other"
+    other.admit()
+
+    assert other._patch.status["admitted_at"]
+    assert ledger.admitted == {("default", "other"): Resources(cpu=2)}
+    assert ledger.used("cluster").within(ledger.budget)
+
+
+def test_queue_wait_is_not_part_of_the_run():
+    body = kopf.Body(
+        {
+            "metadata": {"name": "test", "creationTimestamp": "2026-01-01T00:00:00Z"},
+            "spec": {},
+            "status": {"admitted_at": "2026-01-01T00:05:00+00:00"},
+        }
+    )
+    test = LocustTest("test", "default", body, kopf.Patch(), logging.getLogger())
+
+    assert test.get_run_start() == "2026-01-01T00:05:00+00:00"
+
+
+def test_larger_than_budget_is_invalid(monkeypatch):
+    monkeypatch.setattr(controller, "admission", AdmissionLedger(cpu="1"))
+    test = locust_test(
+        {"workers": 2, "worker": {"resources": {"requests": {"cpu": "1"}}}}
+    )
+
+    with pytest.raises(kopf.PermanentError):
+        test.admit()
+
+
+def test_worker_processes_from_cpu_request():
+    def expected(processes, cpu="3500m"):
+        worker = {"processes": processes, "resources": {"requests": {"cpu": cpu}}}
+        test = locust_test({"workers": 2, "worker": worker}, {"pool_workers": 1})
+        return test.get_worker_processes(), test.get_expected_workers()
+
+    assert expected(1) == (1, 2)
+    assert expected(4) == (4, 5)
+    assert expected("auto") == (3, 4)
+    assert expected("auto", cpu="500m") == (1, 2)
+
+
+def test_no_pool_workers_for_tests_they_would_run_differently(monkeypatch):
+    test = locust_test({"workerPool": "pool", "env": [{"name": "A", "value": "1"}]})
+    monkeypatch.setattr(
+        test._core, "list_namespaced_pod", lambda *_, **__: client.V1PodList(items=[])
+    )
+
+    async def claim_workers(**_):
+        pytest.fail("claimed")
+
+    monkeypatch.setattr(controller, "claim_workers", claim_workers)
+
+    asyncio.run(test.claim_pool_workers("test-master"))
+
+    assert test._patch.status["pool_workers"] == 0
+    assert test.get_pool_unsupported() == ["env"]
+    assert locust_test({"worker": {"processes": 2}}).get_pool_unsupported() == [
+        "worker processes"
+    ]
+
+
+def test_master_is_isolated_from_workers():
+    test = locust_test({"master": {"isolation": "required"}})
+
+    master = test.get_scheduling("master")
+    worker = test.get_scheduling("worker")
+
+    assert master["topology_spread_constraints"] is None
+    assert master["affinity"]["podAntiAffinity"][
+        "requiredDuringSchedulingIgnoredDuringExecution"
+    ][0]["labelSelector"]["matchLabels"] == test.specific_labels("worker")
+    assert (
+        "preferredDuringSchedulingIgnoredDuringExecution"
+        in (worker["affinity"]["podAntiAffinity"])
+    )
+    assert len(worker["topology_spread_constraints"]) == 2
+    assert (
+        locust_test({"master": {"isolation": "none"}}).get_scheduling("master")[
+            "affinity"
+        ]
+        is None
+    )
+
+
+def test_worker_distribution(monkeypatch):
+    test = locust_test()
+
+    def pod(node, phase="Running"):
+        return client.V1Pod(
+            spec=client.V1PodSpec(containers=[], node_name=node),
+            status=client.V1PodStatus(phase=phase),
+        )
+
+    monkeypatch.setattr(
+        test._core,
+        "list_namespaced_pod",
+        lambda namespace, label_selector: client.V1PodList(
+            items=[pod("a"), pod("a"), pod("b"), pod("c", "Pending"), pod(None)]
+        ),
+    )
+    zones = {"a": "zone-1", "b": "zone-2"}
+
+    async def get_node_zone(core, name):
+        return zones[name]
+
+    monkeypatch.setattr(controller, "get_node_zone", get_node_zone)
+
+    assert asyncio.run(test.get_worker_distribution()) == {
+        "nodes": 2,
+        "max_pods_per_node": 2,
+        "pods_per_node": {"a": 2, "b": 1},
+        "pods_per_zone": {"zone-1": 2, "zone-2": 1},
+    }
+
+
+def test_worker_distribution_taken_again_after_resize(monkeypatch):
+    taken = []
+
+    async def get_worker_distribution():
+        taken.append(True)
+        return {"nodes": len(taken)}
+
+    def observe(workers, connected, status=None):
+        test = locust_test({"workers": workers}, status)
+        monkeypatch.setattr(test, "get_worker_distribution", get_worker_distribution)
+        return asyncio.run(test.observe_worker_distribution(connected, poll))
+
+    poll = PollState()
+    assert observe(2, 1) is None
+    assert observe(2, 2) == {"nodes": 1}
+    assert observe(2, 2) is None
+    assert observe(3, 2) is None
+    assert observe(3, 3) == {"nodes": 2}
+    # Taken before the operator restarted
+    poll = PollState()
+    assert observe(3, 3, {"worker_distribution": {"nodes": 2}}) is None
+
+
+def test_upgrade_keeps_running_job_with_older_template(monkeypatch):
+    test = locust_test({"image": "locustio/locust", "workers": 4})
+    running = client.V1Job(
+        metadata=client.V1ObjectMeta(name="test-worker", annotations={}),
+        spec=client.V1JobSpec(template=client.V1PodTemplateSpec()),
+    )
+    patches = []
+
+    def patch_job(name, namespace, body):
+        if isinstance(body, client.V1Job):
+            raise client.ApiException(status=422, reason="field is immutable")
+        patches.append(body)
+
+    monkeypatch.setattr(test._batch, "read_namespaced_job", lambda *_: running)
+    monkeypatch.setattr(test._batch, "patch_namespaced_job", patch_job)
+
+    asyncio.run(test.ensure_worker(None, "test-master"))
+
+    (patch,) = patches
+    assert patch["spec"] == {"parallelism": 4}
+    assert SPEC_HASH_ANNOTATION in patch["metadata"]["annotations"]
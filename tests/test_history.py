@@ -0,0 +1,92 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from history import HistoryStore, RingBuffer, Tier, TieredSeries, history
+from server import OperatorServer
+
+
+def stats(rps, p95):
+    return {
+        "total_rps": rps,
+        "user_count": 10,
+        "stats": [
+            {"method": "GET", "name": "/", "current_rps": rps},
+            {
+                "name": "Aggregated",
+                "num_requests": 100,
+                "num_failures": 5,
+                "response_time_percentile_0.95": p95,
+            },
+        ],
+    }
+
+
+def test_ring_buffer_keeps_the_newest_samples():
+    buffer = RingBuffer(3, ("value",))
+
+    for t in range(5):
+        buffer.append(t, [t * 10])
+
+    assert buffer.to_dict() == {"time": [2, 3, 4], "value": [20, 30, 40]}
+    assert buffer.to_dict(since=4) == {"time": [4], "value": [40]}
+
+
+def test_ring_buffer_grows_up_to_its_capacity():
+    buffer = RingBuffer(360, ("a", "b"))
+    buffer.append(0, [1, 2])
+
+    assert len(buffer._times) == len(buffer._values[1]) == 1
+    for t in range(1, 400):
+        buffer.append(t, [t, t])
+    assert len(buffer._times) == 360
+    assert buffer.to_dict()["time"][0] == 40
+
+
+def test_coarser_tiers_get_mean_and_worst_response_time():
+    series = TieredSeries(
+        ("rps", "response_time_p95"), (Tier("raw", 0, 10), Tier("10s", 10, 10))
+    )
+
+    for t, rps, p95 in [(0, 10, 100), (5, 20, 300), (10, 30, 50)]:
+        series.add(t, [rps, p95])
+
+    assert series.buffers[0].size == 3
+    assert series.buffers[1].to_dict() == {
+        "time": [0],
+        "rps": [15],
+        "response_time_p95": [300],
+    }
+
+
+def test_summary_of_the_run():
+    store = HistoryStore()
+    for t, rps in enumerate([10, 20, 30, 40]):
+        run = store.record("default", "test", t, stats(rps, rps * 10))
+
+    assert run.summary() == {
+        "rps_min": 10,
+        "rps_max": 40,
+        "rps_p95": 40,
+        "latency_ms_min": 100,
+        "latency_ms_max": 400,
+        "latency_ms_p95": 400,
+    }
+    assert run.to_dict()["aggregate"]["fail_ratio"] == [0.05] * 4
+
+
+def test_history_endpoint():
+    history.record("default", "test", 1, stats(10, 100))
+
+    async def main():
+        server = OperatorServer(0)
+        async with TestClient(TestServer(server.app)) as client:
+            found = await client.get("/history/default/test?resolution=0")
+            missing = await client.get("/history/default/other")
+            return await found.json(), missing.status
+
+    body, missing_status = asyncio.run(main())
+
+    assert body["aggregate"]["total_rps"] == [10]
+    assert body["summary"]["rps_max"] == 10
+    assert missing_status == 404
+    history.forget("default", "test")
@@ -0,0 +1,63 @@
+from loadprofile import LoadProfile, check_abort
+
+
+def profile(**spec):
+    return LoadProfile.from_spec(
+        {
+            "loadProfile": {
+                "stages": [
+                    {"durationSeconds": 60, "users": 10, "spawnRate": 1},
+                    {"durationSeconds": 120, "users": 100},
+                ],
+                **spec,
+            }
+        }
+    )
+
+
+def test_from_spec():
+    assert LoadProfile.from_spec({}) is None
+    assert profile().stages[1].spawn_rate == 100
+
+
+def test_stage_at():
+    load_profile = profile()
+
+    assert load_profile.stage_at(0) == 0
+    assert load_profile.stage_at(60) == 1
+    assert load_profile.stage_at(179) == 1
+    assert load_profile.stage_at(180) is None
+
+
+def test_abort_after_breach_lasts():
+    rules = profile(
+        abort=[{"metric": "responseTimeP95Ms", "threshold": 500, "forSeconds": 30}]
+    ).abort_rules
+    # Cumulative percentiles lag behind, only the current window counts
+    slow = {
+        "current_response_time_percentiles": {"response_time_percentile_0.95": 800},
+        "stats": [{"name": "Aggregated", "response_time_percentile_0.95": 100}],
+    }
+    fast = {
+        "current_response_time_percentiles": {"response_time_percentile_0.95": 100},
+        "stats": [{"name": "Aggregated", "response_time_percentile_0.95": 800}],
+    }
+    breaches = {}
+
+    assert check_abort(rules, slow, 0, breaches) is None
+    assert check_abort(rules, fast, 20, breaches) is None
+    assert check_abort(rules, slow, 25, breaches) is None
+    assert "800ms above 500ms" in check_abort(rules, slow, 55, breaches)
+
+
+def test_abort_on_fail_ratio():
+    rules = profile(abort=[{"metric": "failRatio", "threshold": 0.05}]).abort_rules
+
+    def stats(fail_per_sec, fail_ratio):
+        total = {"name": "Aggregated", "current_rps": 100}
+        total["current_fail_per_sec"] = fail_per_sec
+        return {"fail_ratio": fail_ratio, "stats": [total]}
+
+    assert check_abort(rules, stats(1, fail_ratio=0.5), 0, {}) is None
+    assert "fail ratio 10.0%" in check_abort(rules, stats(10, fail_ratio=0), 0, {})
+    assert check_abort(rules, {"stats": []}, 0, {}) is None
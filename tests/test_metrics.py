@@ -0,0 +1,67 @@
+from metrics import forget_test, observe_stats
+from prometheus_client import REGISTRY
+
+STATS = {
+    "state": "running",
+    "user_count": 10,
+    "worker_count": 2,
+    "stats": [
+        {
+            "method": "GET",
+            "name": "/",
+            "num_requests": 200,
+            "num_failures": 10,
+            "current_rps": 12.5,
+            "current_fail_per_sec": 0.5,
+            "response_time_percentile_0.95": 250,
+        },
+        {
+            "method": None,
+            "name": "Aggregated",
+            "num_requests": 200,
+            "num_failures": 10,
+            "current_rps": 12.5,
+            "median_response_time": 100,
+        },
+    ],
+}
+
+
+def value(name, **labels):
+    return REGISTRY.get_sample_value(name, {"namespace": "ns", "test": "t", **labels})
+
+
+def test_observe_stats():
+    observe_stats("ns", "t", STATS)
+
+    assert value("locust_users") == 10
+    assert value("locust_workers") == 2
+    assert value("locust_requests_per_second", method="GET", endpoint="/") == 12.5
+    assert value("locust_failure_ratio", method="GET", endpoint="/") == 0.05
+    assert (
+        value(
+            "locust_response_time_seconds",
+            method="GET",
+            endpoint="/",
+            quantile="0.95",
+        )
+        == 0.25
+    )
+    assert (
+        value(
+            "locust_response_time_seconds",
+            method="",
+            endpoint="Aggregated",
+            quantile="0.5",
+        )
+        == 0.1
+    )
+
+
+def test_forget_test():
+    observe_stats("ns", "t", STATS)
+
+    forget_test("ns", "t")
+
+    assert value("locust_users") is None
+    assert value("locust_requests_per_second", method="GET", endpoint="/") is None
@@ -0,0 +1,341 @@
+import asyncio
+
+import kopf
+import objects
+import pytest
+from kubernetes import client
+from objects import (
+    SPEC_HASH_ANNOTATION,
+    build_bundle_configmap,
+    build_scheduling,
+    build_worker_job,
+    default_spread,
+    ensure,
+    ensure_shared,
+    exists,
+    set_spec_hash,
+    spec_hash,
+)
+
+
+def not_found():
+    raise client.ApiException(status=404)
+
+
+def configmap(**metadata):
+    return client.V1ConfigMap(
+        metadata=client.V1ObjectMeta(name="cm", **metadata),
+        data={"locustfile.py": "..."},
+    )
+
+
+def test_ensure_creates_missing_object():
+    desired = configmap()
+    created = []
+
+    result = asyncio.run(
+        ensure(
+            created.append,
+            not_found,
+            lambda desired: pytest.fail("should not patch"),
+            desired,
+        )
+    )
+
+    assert result == "created"
+    assert created == [desired]
+
+
+def test_ensure_patches_existing_object():
+    desired = configmap()
+    patched = []
+
+    result = asyncio.run(
+        ensure(
+            lambda desired: pytest.fail("should not create"),
+            configmap,
+            patched.append,
+            desired,
+        )
+    )
+
+    assert result == "patched"
+    assert patched == [desired]
+
+
+def test_ensure_waits_for_terminating_object():
+    existing = configmap(deletion_timestamp="now")
+
+    with pytest.raises(kopf.TemporaryError):
+        asyncio.run(ensure(None, lambda: existing, None, configmap()))
+
+
+def test_exists():
+    assert asyncio.run(exists(lambda: "found"))
+    assert not asyncio.run(exists(not_found))
+
+
+def test_ensure_skips_unchanged_object():
+    desired = configmap()
+    existing = configmap(annotations={SPEC_HASH_ANNOTATION: spec_hash(desired)})
+
+    result = asyncio.run(
+        ensure(None, lambda: existing, lambda d: pytest.fail("patched"), desired)
+    )
+
+    assert result == "unchanged"
+
+
+def test_spec_hash_ignores_own_annotation():
+    cm = configmap()
+    before = spec_hash(cm)
+
+    set_spec_hash(cm)
+
+    assert spec_hash(cm) == before
+    cm.data["locustfile.py"] = "changed"
+    assert spec_hash(cm) != before
+
+
+def test_ensure_patches_when_created_concurrently():
+    def conflict(desired):
+        raise client.ApiException(status=409)
+
+    patched = []
+
+    result = asyncio.run(ensure(conflict, not_found, patched.append, configmap()))
+
+    assert result == "patched"
+    assert len(patched) == 1
+
+
+def test_ensure_server_side_apply(monkeypatch):
+    monkeypatch.setattr(objects, "SERVER_SIDE_APPLY", True)
+    applied = []
+
+    result = asyncio.run(
+        ensure(
+            None,
+            lambda: pytest.fail("should not read"),
+            None,
+            configmap(),
+            lookup=lambda: None,
+            apply=lambda desired, **kwargs: applied.append(kwargs) or desired,
+        )
+    )
+
+    assert result == "applied"
+    assert applied == [{"field_manager": "locust-operator", "force": True}]
+
+
+def test_ensure_server_side_apply_waits_for_terminating_object(monkeypatch):
+    monkeypatch.setattr(objects, "SERVER_SIDE_APPLY", True)
+
+    with pytest.raises(kopf.TemporaryError):
+        asyncio.run(
+            ensure(
+                None,
+                None,
+                None,
+                configmap(),
+                lookup=lambda: None,
+                apply=lambda desired, **kwargs: configmap(deletion_timestamp="now"),
+            )
+        )
+
+
+def bundle(*owner_uids):
+    cm = build_bundle_configmap(
+        name="bundle", content=b"...", annotations={}, labels={}
+    )
+    cm.metadata.owner_references = [
+        client.V1OwnerReference(
+            api_version="locust.io/v1", kind="LocustTest", name=uid, uid=uid
+        )
+        for uid in owner_uids
+    ]
+    return cm
+
+
+def test_ensure_shared_adds_owner():
+    patched = []
+
+    result = asyncio.run(
+        ensure_shared(None, lambda: bundle("a"), patched.append, bundle("b"))
+    )
+
+    assert result == "patched"
+    assert patched[0]["metadata"]["ownerReferences"][0]["uid"] == "b"
+
+
+def test_ensure_shared_already_owned():
+    result = asyncio.run(
+        ensure_shared(
+            None,
+            lambda: bundle("a", "b"),
+            lambda p: pytest.fail("patched"),
+            bundle("b"),
+        )
+    )
+
+    assert result == "unchanged"
+
+
+def worker_job(cm_name, bundle, processes=1):
+    return build_worker_job(
+        name="test-worker",
+        image="locustio/locust",
+        args="",
+        env=[],
+        master_svc="test-master",
+        worker_count=1,
+        processes=processes,
+        cm_name=cm_name,
+        bundle=bundle,
+        annotations={},
+        labels={},
+        pod_annotations={},
+        pod_labels={},
+        pod_resources={},
+        image_pull_policy=None,
+        image_pull_secrets=None,
+    )
+
+
+def test_job_unpacks_bundle():
+    pod_spec = worker_job("locust-bundle-abc", bundle=True).spec.template.spec
+
+    assert [c.name for c in pod_spec.init_containers] == [
+        "unpack-locustfile",
+        "wait-for-master",
+    ]
+    assert {v.name for v in pod_spec.volumes} == {"locustfile", "locustfile-bundle"}
+    assert pod_spec.volumes[1].empty_dir is not None
+    assert pod_spec.containers[0].volume_mounts[0].mount_path == "/home/locust"
+
+
+def test_job_without_locustfile_has_no_volumes():
+    pod_spec = worker_job(None, bundle=False).spec.template.spec
+
+    assert pod_spec.volumes == []
+    assert pod_spec.containers[0].volume_mounts == []
+
+
+def test_workers_wait_for_ready_master():
+    pod_spec = worker_job(None, bundle=False).spec.template.spec
+
+    (wait,) = pod_spec.init_containers
+    assert wait.command[-2:] == ["test-master", "5557"]
+
+
+def test_worker_processes():
+    single = worker_job(None, bundle=False).spec.template.spec.containers[0]
+    forked = worker_job(None, bundle=False, processes=4).spec.template.spec
+
+    assert "--processes" not in single.args
+    assert forked.containers[0].args[3:5] == ["--processes", "4"]
+
+
+def test_scheduling_adds_anti_affinity_to_given_affinity():
+    node_affinity = {
+        "nodeAffinity": {"requiredDuringSchedulingIgnoredDuringExecution": {}}
+    }
+    pod_spec = {"affinity": node_affinity, "nodeSelector": {"pool": "load"}}
+
+    scheduling = build_scheduling(
+        pod_spec, avoid={"component": "worker"}, avoid_required=True
+    )
+
+    assert scheduling["node_selector"] == {"pool": "load"}
+    assert scheduling["affinity"]["nodeAffinity"] == node_affinity["nodeAffinity"]
+    (term,) = scheduling["affinity"]["podAntiAffinity"][
+        "requiredDuringSchedulingIgnoredDuringExecution"
+    ]
+    assert term["labelSelector"] == {"matchLabels": {"component": "worker"}}
+    assert "podAntiAffinity" not in pod_spec["affinity"]
+
+
+def test_scheduling_default_spread_can_be_disabled():
+    spread = default_spread({"component": "worker"})
+
+    assert build_scheduling({}, spread=spread)["topology_spread_constraints"] == spread
+    disabled = build_scheduling({"topologySpreadConstraints": []}, spread=spread)
+    assert disabled["topology_spread_constraints"] == []
+
+
+def test_job_serializes_scheduling():
+    job = build_worker_job(
+        name="test-worker",
+        image="locustio/locust",
+        args="",
+        env=[],
+        master_svc="test-master",
+        worker_count=1,
+        processes=1,
+        cm_name=None,
+        bundle=False,
+        annotations={},
+        labels={},
+        pod_annotations={},
+        pod_labels={},
+        pod_resources={},
+        image_pull_policy=None,
+        image_pull_secrets=None,
+        scheduling=build_scheduling(
+            {"tolerations": [{"key": "load", "operator": "Exists"}]},
+            spread=default_spread({"component": "worker"}),
+        ),
+    )
+
+    pod_spec = client.ApiClient().sanitize_for_serialization(job)["spec"]["template"][
+        "spec"
+    ]
+    assert pod_spec["tolerations"] == [{"key": "load", "operator": "Exists"}]
+    assert pod_spec["topologySpreadConstraints"][0]["whenUnsatisfiable"] == (
+        "ScheduleAnyway"
+    )
+
+
+def test_call_retries_throttled_requests(monkeypatch):
+    monkeypatch.setattr(objects, "retry_delay", lambda error, attempt: 0)
+    attempts = []
+
+    def read():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise client.ApiException(status=429)
+        return "ok"
+
+    assert asyncio.run(objects.call(read)) == "ok"
+    assert len(attempts) == 3
+
+
+def test_call_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(objects, "retry_delay", lambda error, attempt: 0)
+    monkeypatch.setattr(objects, "API_MAX_RETRIES", 1)
+    attempts = []
+
+    def read():
+        attempts.append(1)
+        raise client.ApiException(status=429)
+
+    with pytest.raises(client.ApiException):
+        asyncio.run(objects.call(read))
+    assert len(attempts) == 2
+
+
+def test_ensure_keeps_object_with_immutable_changes():
+    def patch(body):
+        if body is desired:
+            raise client.ApiException(status=422)
+        patched.append(body)
+
+    desired = configmap()
+    patched = []
+
+    result = asyncio.run(
+        ensure(None, configmap, patch, desired, mutable=lambda d: {"kept": True})
+    )
+
+    assert result == "patched"
+    assert patched == [{"kept": True}]
@@ -1,2 +1,61 @@
+import asyncio
+import functools
+import logging
+
+import kopf
+import pytest
+from kubernetes import config
+from scheduler import StatsScheduler
+
+
+@pytest.fixture(scope="module")
+def main():
+    # No cluster to configure the client for
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(config, "load_kube_config", lambda *args, **kwargs: None)
+        m.setattr(config, "load_incluster_config", lambda *args, **kwargs: None)
+        import main
+    return main
+
+
+async def fire(handler, **kwargs):
+    """Call a handler the way kopf does, sync ones in an executor thread."""
+    if asyncio.iscoroutinefunction(handler):
+        return await handler(**kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(handler, **kwargs))
+
+
 def test_true():
     assert True
+
+
+def test_events_schedule_stats_polls(main, monkeypatch):
+    stats_scheduler = StatsScheduler()
+    monkeypatch.setattr(main, "stats_scheduler", stats_scheduler)
+    body = kopf.Body(
+        {
+            "apiVersion": "locust.io/v1",
+            "kind": "LocustTest",
+            "metadata": {"name": "test", "namespace": "default", "uid": "uid"},
+            "spec": {},
+            "status": {"state": "Running"},
+        }
+    )
+
+    async def event(type):
+        await fire(
+            main.track_stats,
+            name="test",
+            namespace="default",
+            type=type,
+            patch=kopf.Patch(),
+            body=body,
+            logger=logging.getLogger(),
+        )
+
+    asyncio.run(event("ADDED"))
+    assert ("default", "test") in stats_scheduler._tests
+
+    asyncio.run(event("DELETED"))
+    assert len(stats_scheduler) == 0
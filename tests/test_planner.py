@@ -0,0 +1,154 @@
+import asyncio
+import copy
+import logging
+
+import kopf
+from controller import LocustTest
+from kubernetes import client
+from planner import MASTER, WORKERS, plan_restart
+
+
+def change(*path):
+    return ("change", path, "old", "new")
+
+
+def test_no_diff_restarts_nothing():
+    assert not plan_restart(None).restart
+    assert not plan_restart([]).restart
+
+
+def test_worker_only_change_keeps_master():
+    plan = plan_restart([change("spec", "worker", "resources", "limits", "cpu")])
+
+    assert plan.workers
+    assert not plan.master
+    assert plan.describe() == "workers"
+
+
+def test_master_only_change_keeps_workers():
+    plan = plan_restart([change("spec", "master", "labels", "team")])
+
+    assert plan.master
+    assert not plan.workers
+
+
+def test_shared_and_locustfile_changes_restart_everything():
+    assert plan_restart([change("spec", "image")]).describe() == "master and workers"
+
+    plan = plan_restart([change("spec", "locustfile", "content")])
+    assert plan.configmap
+    assert plan.master and plan.workers
+
+
+def test_in_place_changes_restart_nothing():
+    plan = plan_restart(
+        [
+            change("spec", "workers"),
+            change("spec", "labels", "team"),
+            change("spec", "metrics", "intervalSeconds"),
+            change("metadata", "labels", "team"),
+        ]
+    )
+
+    assert not plan.restart
+    assert not plan.configmap
+    assert plan.fields == ()
+
+
+def test_master_isolation_restarts_everything():
+    plan = plan_restart([change("spec", "master", "isolation")])
+
+    assert plan.master and plan.workers
+
+
+def test_replaced_master_spec_restarts_everything():
+    assert plan_restart([change("spec", "master")]).describe() == "master and workers"
+    assert plan_restart([change("spec")]).configmap
+
+
+BASE_SPEC = {
+    "image": "locustio/locust",
+    "workers": 2,
+    "locustfile": {"content": "from locust import HttpUser"},
+}
+
+POD_FIELDS = {"master": {}, "worker": {"processes": 2}}
+for component in POD_FIELDS:
+    POD_FIELDS[component].update(
+        {
+            "resources": {"requests": {"cpu": "2"}},
+            "labels": {"team": "load"},
+            "annotations": {"team": "load"},
+            "nodeSelector": {"pool": "load"},
+            "tolerations": [{"key": "load", "operator": "Exists"}],
+            "affinity": {"nodeAffinity": {}},
+            "topologySpreadConstraints": [{"maxSkew": 2}],
+            "priorityClassName": "load",
+        }
+    )
+POD_FIELDS["master"]["isolation"] = "none"
+
+# A value for every field of the spec, the ones not in a pod template included
+FIELDS = {
+    ("image",): "locustio/locust:2",
+    ("imagePullPolicy",): "Always",
+    ("imagePullSecrets",): [{"name": "registry"}],
+    ("args",): "--host http://other",
+    ("env",): [{"name": "HOST", "value": "other"}],
+    ("locustfile", "content"): "from locust import FastHttpUser",
+    ("locustfile", "bundle"): "H4sIAAAAAAAAAwMAAAAAAAAAAAA=",
+    ("workers",): 4,
+    ("labels",): {"team": "load"},
+    ("annotations",): {"team": "load"},
+    **{
+        (component, field): value
+        for component, fields in POD_FIELDS.items()
+        for field, value in fields.items()
+    },
+}
+
+
+def pod_templates(spec: dict) -> dict[str, dict]:
+    body = kopf.Body(
+        {
+            "apiVersion": "locust.io/v1",
+            "kind": "LocustTest",
+            "metadata": {"name": "test", "namespace": "default", "uid": "uid"},
+            "spec": spec,
+        }
+    )
+    test = LocustTest("test", "default", body, kopf.Patch(), logging.getLogger())
+    templates = {}
+
+    async def ensure(create, read, patch, desired, *args):
+        component = MASTER if "master" in desired.metadata.name else WORKERS
+        templates[component] = client.ApiClient().sanitize_for_serialization(
+            desired.spec.template
+        )
+
+    test._ensure = ensure
+    asyncio.run(test.ensure_master("test-locustfile"))
+    asyncio.run(test.ensure_worker("test-locustfile", "test-master"))
+    return templates
+
+
+def test_every_pod_template_field_restarts_its_jobs():
+    before = pod_templates(BASE_SPEC)
+
+    for path, value in FIELDS.items():
+        spec = copy.deepcopy(BASE_SPEC)
+        *parents, field = path
+        parent = spec
+        for key in parents:
+            parent = parent.setdefault(key, {})
+        if path[0] == "locustfile":
+            parent.clear()
+        parent[field] = value
+
+        after = pod_templates(spec)
+        changed = {
+            component for component in before if before[component] != after[component]
+        }
+        plan = plan_restart([change("spec", *path)])
+
+        assert changed <= plan.components, path
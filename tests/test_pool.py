@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+import kopf
+import pool
+from kubernetes import client
+from pool import (
+    MASTER_HOST_ANNOTATION,
+    POOL_LABEL,
+    POOL_STATE_LABEL,
+    STANDBY,
+    WorkerPool,
+    claim_workers,
+)
+
+OWNER = kopf.Body(
+    {
+        "apiVersion": "locust.io/v1",
+        "kind": "LocustTest",
+        "metadata": {"name": "test", "namespace": "default", "uid": "uid"},
+    }
+)
+
+
+def standby_pod(name, image="locustio/locust", phase="Running", resources=None):
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(
+            name=name, labels={POOL_LABEL: "pool", POOL_STATE_LABEL: STANDBY}
+        ),
+        spec=client.V1PodSpec(
+            containers=[
+                client.V1Container(
+                    name="locust-worker",
+                    image=image,
+                    resources=client.V1ResourceRequirements(**(resources or {})),
+                )
+            ]
+        ),
+        status=client.V1PodStatus(phase=phase),
+    )
+
+
+# As the API server stores the pods of a pool with a 1 CPU limit
+SAME_RESOURCES = {"limits": {"cpu": "1"}, "requests": {"cpu": "1000m"}}
+
+
+def fake_pods(monkeypatch, pods):
+    monkeypatch.setattr(
+        client.CoreV1Api,
+        "list_namespaced_pod",
+        lambda self, namespace, label_selector: client.V1PodList(items=pods),
+    )
+
+
+def test_claim_patches_standby_pods(monkeypatch):
+    fake_pods(
+        monkeypatch,
+        [
+            standby_pod("pending", phase="Pending"),
+            standby_pod("other-image", image="custom"),
+            standby_pod("other-resources", resources={"limits": {"cpu": "2"}}),
+            standby_pod("a", resources=SAME_RESOURCES),
+            standby_pod("b", resources=SAME_RESOURCES),
+        ],
+    )
+    refilled = []
+    monkeypatch.setattr(pool, "schedule_refill", lambda *args: refilled.append(args))
+    patches = {}
+
+    def patch(self, name, namespace, body):
+        if name == "b":
+            # Claimed by another test in the meantime
+            raise client.ApiException(status=422)
+        patches[name] = body
+
+    monkeypatch.setattr(client.CoreV1Api, "patch_namespaced_pod", patch)
+
+    claimed = asyncio.run(
+        claim_workers(
+            pool="pool",
+            namespace="default",
+            image="locustio/locust",
+            resources={"limits": {"cpu": "1"}},
+            count=3,
+            owner=OWNER,
+            labels={"locust.io/test-run": "test"},
+            master_host="test-master",
+        )
+    )
+
+    assert claimed == ["a"]
+    assert refilled == [("default", "pool")]
+    ops = {op["path"]: op for op in patches["a"]}
+    assert patches["a"][0] == {
+        "op": "test",
+        "path": "/metadata/labels/locust.io~1pool-state",
+        "value": STANDBY,
+    }
+    assert ops["/metadata/labels/locust.io~1test-run"]["value"] == "test"
+    assert ops["/metadata/annotations/locust.io~1master-host"]["value"] == "test-master"
+    assert ops["/metadata/ownerReferences"]["value"][0]["uid"] == "uid"
+
+
+def test_refill_replaces_missing_and_exited_pods(monkeypatch):
+    fake_pods(monkeypatch, [standby_pod("a"), standby_pod("failed", phase="Failed")])
+    created, deleted = [], []
+    monkeypatch.setattr(
+        client.CoreV1Api,
+        "create_namespaced_pod",
+        lambda self, namespace, pod: created.append(pod),
+    )
+    monkeypatch.setattr(
+        client.CoreV1Api,
+        "delete_namespaced_pod",
+        lambda self, name, namespace: deleted.append(name),
+    )
+    spec = {"image": "locustio/locust", "size": 3}
+    owner = {
+        "apiVersion": "locust.io/v1",
+        "kind": "LocustWorkerPool",
+        "metadata": {"name": "pool", "namespace": "default", "uid": "pool-uid"},
+    }
+
+    status = asyncio.run(
+        WorkerPool("pool", "default", spec, logging.getLogger()).refill(owner)
+    )
+
+    assert status == {"ready": 1}
+    assert deleted == ["failed"]
+    assert len(created) == 2
+    pod = created[0]
+    assert pod.metadata.labels[POOL_STATE_LABEL] == STANDBY
+    assert pod.metadata.owner_references[0].uid == "pool-uid"
+    field_path = pod.spec.volumes[0].downward_api.items[0].field_ref.field_path
+    assert MASTER_HOST_ANNOTATION in field_path
@@ -0,0 +1,48 @@
+from kubernetes import client
+from ratelimit import MAX_RETRY_DELAY, TokenBucket, retry_delay
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_rate():
+    clock = Clock()
+    bucket = TokenBucket(rate=10, burst=3, clock=clock)
+
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == 0.1
+    assert bucket.reserve() == 0.2
+
+    clock.now = 1
+    assert bucket.reserve() == 0
+
+
+def test_bucket_pause_holds_calls():
+    clock = Clock()
+    bucket = TokenBucket(rate=0, burst=1, clock=clock)
+
+    assert bucket.reserve() == 0
+    bucket.pause(2)
+    assert bucket.reserve() == 2
+
+    clock.now = 3
+    assert bucket.reserve() == 0
+
+
+def throttled(retry_after=None):
+    error = client.ApiException(status=429)
+    error.headers = {"Retry-After": retry_after} if retry_after else {}
+    return error
+
+
+def test_retry_delay():
+    assert retry_delay(throttled("3"), 0) == 3
+    assert retry_delay(throttled("3600"), 0) == MAX_RETRY_DELAY
+    assert retry_delay(throttled("Wed, 21 Oct 2015 07:28:00 GMT"), 0) == 0
+    assert retry_delay(throttled(), 0) == 0.5
+    assert retry_delay(throttled(), 2) == 2
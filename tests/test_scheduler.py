@@ -0,0 +1,118 @@
+import asyncio
+import math
+
+import scheduler
+from scheduler import ScheduledTest, StatsScheduler
+from workqueue import stagger
+
+
+class FakeTest:
+    def __init__(self, name, state="running", interval=5):
+        self.namespace = "default"
+        self.name = name
+        self.state = state
+        self.interval = interval
+        self.polls = 0
+        self.restart_pending = False
+        self.starting = False
+
+    def get_poll_interval(self):
+        return self.interval
+
+    def awaits_start(self, poll):
+        return self.starting
+
+    async def poll_stats(self, poll):
+        self.polls += 1
+        return self.state
+
+
+class FakeClockScheduler(StatsScheduler):
+    """Polls as the scheduler would, on a clock moved from one due poll to
+    the next instead of waiting for it.
+    """
+
+    clock = 0.0
+
+    def _now(self):
+        return self.clock
+
+
+def run_scheduler(tests, seconds, removed=(), keep=None):
+    async def main():
+        stats_scheduler = FakeClockScheduler(max_concurrency=2)
+        stats_scheduler._semaphore = asyncio.Semaphore(2)
+        for test in tests:
+            stats_scheduler.upsert(test)
+        for test in removed:
+            stats_scheduler.remove(test.namespace, test.name)
+        if keep is not None:
+            stats_scheduler.retain(keep)
+
+        while True:
+            stats_scheduler._start_due_polls()
+            await asyncio.gather(*stats_scheduler._polls)
+            next_due = stats_scheduler._heap[0][0] if stats_scheduler._heap else None
+            if next_due is None or next_due > seconds:
+                return stats_scheduler
+            stats_scheduler.clock = next_due
+
+    return asyncio.run(main())
+
+
+def expected_polls(test, interval, seconds):
+    first = stagger(test.namespace, test.name, test.interval)
+    return math.floor((seconds - first) / interval) + 1
+
+
+def test_running_tests_are_polled_every_interval():
+    tests = [FakeTest(f"test-{i}") for i in range(5)]
+
+    run_scheduler(tests, 50)
+
+    assert [test.polls for test in tests] == [
+        expected_polls(test, 5, 50) for test in tests
+    ]
+    assert all(test.polls >= 10 for test in tests)
+
+
+def test_idle_tests_are_polled_slower(monkeypatch):
+    monkeypatch.setattr(scheduler, "STATS_IDLE_INTERVAL", 20)
+    running = FakeTest("running")
+    stopped = FakeTest("stopped", state="stopped")
+
+    run_scheduler([running, stopped], 50)
+
+    assert running.polls == expected_polls(running, 5, 50)
+    assert stopped.polls == expected_polls(stopped, 20, 50) == 3
+
+
+def test_removed_tests_are_not_polled():
+    test = FakeTest("removed")
+
+    run_scheduler([test], 50, removed=[test])
+
+    assert test.polls == 0
+
+
+def test_retain_drops_tests_of_other_shards():
+    kept, dropped = FakeTest("kept"), FakeTest("dropped")
+
+    stats_scheduler = run_scheduler(
+        [kept, dropped], 10, keep=lambda namespace, name: name == "kept"
+    )
+
+    assert len(stats_scheduler) == 1
+    assert dropped.polls == 0 < kept.polls
+
+
+def test_ready_master_is_polled_until_workers_connected(monkeypatch):
+    monkeypatch.setattr(scheduler, "STATS_IDLE_INTERVAL", 30)
+    test = FakeTest("ready", state="ready", interval=5)
+    entry = ScheduledTest(test=test, interval=5, state="ready")
+    stats_scheduler = StatsScheduler()
+
+    test.starting = True
+    assert stats_scheduler._next_interval(entry) == 5
+    test.starting = False
+    assert stats_scheduler._next_interval(entry) == 30
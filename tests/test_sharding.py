@@ -0,0 +1,128 @@
+import asyncio
+import base64
+import datetime
+import gzip
+import json
+import random
+from collections import Counter
+
+import kopf
+import sharding
+from kubernetes import client
+from sharding import (
+    BUNDLE_DIGEST_PREFIX,
+    ShardDiffBaseStorage,
+    ShardMembership,
+    ShardProgressStorage,
+    rendezvous_owner,
+)
+
+TESTS = [("default", f"test-{i}") for i in range(300)]
+
+
+def test_tests_spread_over_members():
+    members = ["operator-a", "operator-b", "operator-c"]
+
+    owners = Counter(rendezvous_owner(members, *test) for test in TESTS)
+
+    assert set(owners) == set(members)
+    assert all(60 < count < 140 for count in owners.values())
+
+
+def test_only_tests_of_a_gone_member_move():
+    members = ["operator-a", "operator-b", "operator-c"]
+    before = {test: rendezvous_owner(members, *test) for test in TESTS}
+
+    after = {test: rendezvous_owner(members[:2], *test) for test in TESTS}
+
+    moved = {test for test in TESTS if before[test] != after[test]}
+    assert moved == {test for test in TESTS if before[test] == "operator-c"}
+
+
+def lease(name, renewed_seconds_ago, duration=15):
+    renew_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=renewed_seconds_ago
+    )
+    return client.V1Lease(
+        metadata=client.V1ObjectMeta(name=name),
+        spec=client.V1LeaseSpec(renew_time=renew_time, lease_duration_seconds=duration),
+    )
+
+
+def test_expired_leases_are_not_members(monkeypatch):
+    leases = [lease("operator-a", 1), lease("operator-b", 5), lease("operator-c", 60)]
+    monkeypatch.setattr(
+        client.CoordinationV1Api,
+        "list_namespaced_lease",
+        lambda self, namespace, label_selector: client.V1LeaseList(items=leases),
+    )
+    shards = ShardMembership(identity="operator-a", enabled=True)
+
+    members = asyncio.run(shards.list_members())
+
+    assert members == ("operator-a", "operator-b")
+
+
+def test_owns_everything_unsharded():
+    shards = ShardMembership(identity="operator-a", enabled=False)
+    shards.members = ("operator-a", "operator-b")
+
+    assert all(shards.owns(*test) for test in TESTS)
+
+
+def test_only_the_owner_records_handled_changes(monkeypatch):
+    membership = ShardMembership(identity="operator-a", enabled=True)
+    membership.members = ("operator-a", "operator-b")
+    monkeypatch.setattr(sharding, "shards", membership)
+    owned, other = (
+        next(t for t in TESTS if membership.owns(*t) == mine) for mine in (True, False)
+    )
+
+    def store(namespace, name):
+        body = kopf.Body({"metadata": {"namespace": namespace, "name": name}})
+        patch = kopf.Patch()
+        ShardDiffBaseStorage(prefix="locust.io").store(
+            body=body, patch=patch, essence={"spec": {}}
+        )
+        ShardProgressStorage(prefix="locust.io").store(
+            key="on_update", record={"retries": 1}, body=body, patch=patch
+        )
+        return patch
+
+    annotations = store(*owned).metadata.annotations
+    assert "locust.io/last-handled-configuration" in annotations
+    assert "locust.io/on_update" in annotations
+    assert not store(*other)
+
+
+def bundle_body(content: bytes) -> kopf.Body:
+    bundle = base64.b64encode(gzip.compress(content)).decode()
+    return kopf.Body(
+        {
+            "metadata": {"namespace": "default", "name": "test"},
+            "spec": {"locustfile": {"bundle": bundle}},
+        }
+    )
+
+
+def test_bundles_handled_as_their_digest():
+    storage = ShardDiffBaseStorage(prefix="locust.io")
+    # Incompressible, larger than the annotations of an object can hold
+    content = random.Random(0).randbytes(300 * 1024)
+    body = bundle_body(content)
+    assert len(body["spec"]["locustfile"]["bundle"]) > 256 * 1024
+
+    essence = storage.build(body=body)
+    patch = kopf.Patch()
+    storage.store(body=body, patch=patch, essence=essence)
+
+    bundle = essence["spec"]["locustfile"]["bundle"]
+    assert bundle.startswith(BUNDLE_DIGEST_PREFIX)
+    assert sum(map(len, patch.metadata.annotations.values())) < 1024
+    assert storage.build(body=bundle_body(content[1:])) != essence
+    # Recorded whole before, not a change
+    stored = json.dumps(dict(body))
+    handled = kopf.Body(
+        {"metadata": {"annotations": {"locust.io/last-handled-configuration": stored}}}
+    )
+    assert storage.fetch(body=handled)["spec"] == essence["spec"]
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from stats import StatsClient, StatusWriter, worker_pods_status
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get("/stats/requests", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/stats/requests"
+
+
+def test_get_json():
+    async def handler(request):
+        return web.json_response({"state": "running", "total_rps": 1.5})
+
+    async def main():
+        runner, url = await serve(handler)
+        stats = StatsClient()
+        try:
+            return await stats.get_json(url)
+        finally:
+            await stats.close()
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == {"state": "running", "total_rps": 1.5}
+
+
+def test_get_json_times_out_on_hung_master():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return web.json_response({})
+
+    async def main():
+        runner, url = await serve(handler)
+        stats = StatsClient(read_timeout=0.1)
+        try:
+            await stats.get_json(url)
+        finally:
+            await stats.close()
+            await runner.cleanup()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+
+
+def sample(**overrides):
+    return {
+        "state": "running",
+        "fail_ratio": 0.0,
+        "total_rps": 100.0,
+        "user_count": 10,
+        "worker_count": 2,
+        **overrides,
+    }
+
+
+def test_status_writer_skips_changes_within_deadbands():
+    writer = StatusWriter(rps_deadband_percent=5, fail_ratio_deadband=0.01)
+    assert writer.should_write(sample(), 0)
+    writer.written(sample(), 0)
+
+    assert not writer.should_write(sample(total_rps=104.0, fail_ratio=0.005), 60)
+    assert writer.should_write(sample(total_rps=110.0), 60)
+    assert writer.should_write(sample(fail_ratio=0.02), 60)
+    assert writer.should_write(sample(user_count=11), 60)
+    assert writer.skipped == 1
+
+
+def test_status_writer_coalesces_changes_but_not_state_changes():
+    writer = StatusWriter(min_interval=10)
+    writer.written(sample(), 0)
+
+    assert not writer.should_write(sample(user_count=20), 5)
+    assert writer.should_write(sample(state="stopped"), 5)
+    assert writer.should_write(sample(user_count=20), 10)
+
+
+def test_status_writer_rewrites_state_overwritten_by_reconcile():
+    writer = StatusWriter()
+    writer.written(sample(), 0)
+
+    assert not writer.should_write(sample(), 60, stored_state="RUNNING")
+    assert writer.should_write(sample(), 60, stored_state="CREATED")
+
+
+def test_status_writer_configure_from_spec():
+    writer = StatusWriter()
+
+    writer.configure({"rpsDeadbandPercent": 20, "minWriteIntervalSeconds": 0})
+
+    assert (writer.rps_deadband_percent, writer.min_interval) == (20.0, 0.0)
+    assert writer.fail_ratio_deadband == 0.01
+
+
+def test_worker_pods_status():
+    workers = [
+        {"id": "test-worker-abc_1f2e", "cpu_usage": 95},
+        {"id": "test-worker-abc_3d4c", "cpu_usage": 91},
+        {"id": "test-worker-def_5b6a", "cpu_usage": 40},
+        {"id": "test-worker-ghi_7f8e", "cpu_usage": None},
+    ]
+
+    assert worker_pods_status(workers) == {
+        "worker_pods": 2,
+        "worker_pod_cpu_max_percent": 93,
+        "saturated_worker_pods": 1,
+    }
+    assert worker_pods_status([]) == {}
@@ -0,0 +1,65 @@
+import asyncio
+
+import controller
+import pytest
+from kubernetes import client
+from metrics import timed_step
+from objects import call
+from test_controller import locust_test
+from tracing import Span, span, trace
+
+
+@timed_step
+async def ensure_thing(fail=False):
+    def api_call():
+        if fail:
+            raise client.ApiException(status=409)
+
+    await call(api_call)
+
+
+async def traced_reconcile():
+    with trace("reconcile", name="test") as root:
+        await asyncio.gather(ensure_thing(), ensure_thing())
+        with pytest.raises(client.ApiException):
+            await ensure_thing(fail=True)
+    return root
+
+
+def test_steps_and_api_calls_are_traced():
+    root = asyncio.run(traced_reconcile())
+
+    assert [child.name for child in root.children] == ["ensure_thing"] * 3
+    assert root.children[0].children[0].name == "api_call"
+    assert root.children[0].children[0].attributes == {"retries": 0, "status": "ok"}
+    failed = root.children[2]
+    assert failed.attributes == {"error": "ApiException"}
+    assert failed.children[0].attributes["status"] == "409"
+    assert all(child.duration is not None for child in root.children)
+
+
+def test_spans_outside_a_trace_do_nothing():
+    with span("alone") as alone:
+        assert alone is None
+
+
+def test_slow_reconcile_posts_breakdown(monkeypatch):
+    monkeypatch.setattr(controller, "SLOW_RECONCILE_SECONDS", 1)
+    events = []
+    monkeypatch.setattr(
+        controller.kopf, "event", lambda body, **kwargs: events.append(kwargs)
+    )
+    root = Span("reconcile", duration=3.0)
+    step = Span("ensure_master", duration=2.5)
+    step.children.append(Span("create_namespaced_job", {"status": "ok"}, duration=2.4))
+    root.children += [Span("ensure_configmap", duration=0.5), step]
+
+    locust_test().report_if_slow(root)
+    locust_test().report_if_slow(Span("reconcile", duration=0.5))
+
+    (event,) = events
+    assert event["reason"] == "SlowReconcile"
+    assert event["message"] == (
+        "Reconcile took 3.0s: ensure_master 2.50s (create_namespaced_job 2.40s ok), "
+        "ensure_configmap 0.50s"
+    )
@@ -0,0 +1,89 @@
+import asyncio
+
+from workqueue import Priority, ReconcileQueue, stagger
+
+
+def test_waiting_reconciles_run_by_priority():
+    order = []
+
+    async def reconcile(queue, name, priority, release=None):
+        async with queue.slot(priority):
+            order.append(name)
+            if release is not None:
+                await release.wait()
+
+    async def main():
+        queue = ReconcileQueue(max_concurrency=1)
+        release = asyncio.Event()
+        first = asyncio.create_task(reconcile(queue, "first", Priority.RESUME, release))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(reconcile(queue, name, priority))
+            for name, priority in (
+                ("resume", Priority.RESUME),
+                ("update", Priority.UPDATE),
+                ("create", Priority.CREATE),
+            )
+        ]
+        await asyncio.sleep(0)
+        assert queue.stats()["waiting"] == {"create": 1, "update": 1, "resume": 1}
+
+        release.set()
+        await asyncio.gather(first, *waiting)
+        return queue
+
+    queue = asyncio.run(main())
+
+    assert order == ["first", "create", "update", "resume"]
+    assert queue.stats()["running"] == 0
+    assert queue.resumed == 2
+    assert queue.drained_seconds is not None
+
+
+def test_cancelled_reconcile_gives_up_its_place():
+    async def main():
+        queue = ReconcileQueue(max_concurrency=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with queue.slot(Priority.CREATE):
+                await release.wait()
+
+        async def wait_turn():
+            async with queue.slot(Priority.UPDATE):
+                pass
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(wait_turn())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        release.set()
+        await asyncio.gather(holder, cancelled, return_exceptions=True)
+
+        # Still usable, the slot went back to the queue
+        await asyncio.wait_for(wait_turn(), 1)
+        return queue
+
+    queue = asyncio.run(main())
+
+    assert queue.stats()["running"] == 0
+
+
+def test_backlog_drains_once_resumes_are_done():
+    async def main():
+        queue = ReconcileQueue(max_concurrency=2)
+        async with queue.slot(Priority.RESUME):
+            assert queue.drained_seconds is None
+        return queue
+
+    queue = asyncio.run(main())
+
+    assert queue.stats()["backlog_drained"]
+
+
+def test_stagger_spreads_over_interval():
+    delays = [stagger("default", f"t-{i}", 10) for i in range(100)]
+
+    assert all(0 <= delay <= 10 for delay in delays)
+    assert sum(delay < 5 for delay in delays) > 30